@@ -1,148 +1,234 @@
-import json
+"""
+HTTP tap - pure ASGI middleware (thay cho DebugRequestMiddleware / ResponseLoggerMiddleware
+kiểu BaseHTTPMiddleware: không tạo thêm task, không bọc/consume body_iterator)
+
+Chỉ quan sát các message receive/send đi qua:
+- Mọi request: size request/response, số chunk, status, TTFB, thời gian xử lý, client disconnect
+- Response được sample: giữ preview vài KB payload (kể cả SSE stream) trong /v1/status
+- /v1/chat/completions: body request được đưa vào capture pipeline (core/capture.py)
+"""
+import random
 import time
-import os
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.datastructures import Headers
-
-
-class DebugRequestMiddleware(BaseHTTPMiddleware):
-    """Middleware để log toàn bộ request details"""
-    
-    async def dispatch(self, request: Request, call_next):
-        # Chỉ log khi KHÔNG phải production (Render)
-        is_production = os.getenv("RENDER") is not None
-        
-        # CRITICAL FIX: Skip middleware hoàn toàn trên production
-        if is_production:
-            return await call_next(request)
-        
-        # Log request details (chỉ local development)
-        if request.url.path == "/v1/chat/completions":
-            # CRITICAL: Clone body thay vì consume
-            body_bytes = b""
-            chunks = []
-            
-            async for chunk in request.stream():
-                chunks.append(chunk)
-                body_bytes += chunk
-            
-            if body_bytes:
-                try:
-                    body_json = json.loads(body_bytes.decode('utf-8'))
-                    
-                    messages = body_json.get("messages", [])
-                    if messages:
-                        system_messages = [msg for msg in messages if msg.get("role") == "system"]
-                        user_messages = [msg for msg in messages if msg.get("role") == "user"]
-                        
-                        if system_messages:
-                            for idx, msg in enumerate(system_messages):
-                                content = msg.get("content", "")
-                                content_length = len(content)
-                                
-                                try:
-                                    log_dir = "logs/system_prompts"
-                                    os.makedirs(log_dir, exist_ok=True)
-                                    
-                                    timestamp = time.strftime("%Y%m%d_%H%M%S")
-                                    filename = f"{log_dir}/system_prompt_{timestamp}.txt"
-                                    
-                                    with open(filename, 'w', encoding='utf-8') as f:
-                                        f.write(f"Timestamp: {timestamp}\n")
-                                        f.write(f"Length: {content_length} chars\n")
-                                        f.write(f"Estimated tokens: ~{content_length // 4}\n")
-                                        f.write(f"\n{'='*80}\n\n")
-                                        f.write(content)
-                                    
-                                except Exception as save_error:
-                                    print(f"[ERROR] Failed to save system prompt: {save_error}")
-                        
-                        if user_messages:
-                            for idx, msg in enumerate(user_messages):
-                                content = msg.get("content", "")
-                                
-                                if isinstance(content, list):
-                                    extracted_texts = []
-                                    image_count = 0
-                                    
-                                    for item in content:
-                                        if isinstance(item, dict):
-                                            if item.get("type") == "text":
-                                                extracted_texts.append(item.get("text", ""))
-                                            elif item.get("type") == "image":
-                                                extracted_texts.append("[IMAGE]")
-                                                image_count += 1
-                                            elif item.get("type") == "image_url":
-                                                image_url = item.get("image_url", {})
-                                                if isinstance(image_url, dict):
-                                                    url = image_url.get("url", "")
-                                                elif isinstance(image_url, str):
-                                                    url = image_url
-                                                else:
-                                                    url = ""
-                                                
-                                                if url.startswith("data:image"):
-                                                    extracted_texts.append(f"[IMAGE_URL_{image_count}]")
-                                                    
-                                                    try:
-                                                        import base64
-                                                        import re
-                                                        
-                                                        match = re.match(r'data:image/([a-zA-Z]+);base64,(.+)', url)
-                                                        if match:
-                                                            image_format = match.group(1)
-                                                            base64_data = match.group(2)
-                                                            
-                                                            image_bytes = base64.b64decode(base64_data)
-                                                            
-                                                            log_dir = "logs/images"
-                                                            os.makedirs(log_dir, exist_ok=True)
-                                                            
-                                                            timestamp = time.strftime("%Y%m%d_%H%M%S")
-                                                            filename = f"{log_dir}/image_{timestamp}_{idx}_{image_count}.{image_format}"
-                                                            
-                                                            with open(filename, 'wb') as f:
-                                                                f.write(image_bytes)
-                                                                                                                        
-                                                            image_count += 1
-
-                                                    
-                                                    except Exception as save_error:
-                                                        print(f"[Middleware]   ❌ Failed to save image: {save_error}")
-                                                else:
-                                                    extracted_texts.append(f"[IMAGE_URL_{image_count} - External URL]")
-                                                    image_count += 1
-                                    
-                                    if image_count > 0:
-                                        print(f"[Middleware]   🖼️ User message #{idx} contains {image_count} image(s)")
-                                
-                except Exception as e:
-                    print(f"[Middleware]   - Parse error: {e}")
-            
-            # CRITICAL FIX: Tạo lại request với body stream mới - PROPER WAY
-            chunk_index = 0
-            
-            async def new_receive():
-                nonlocal chunk_index
-                if chunk_index < len(chunks):
-                    chunk = chunks[chunk_index]
-                    chunk_index += 1
-                    return {
-                        "type": "http.request",
-                        "body": chunk,
-                        "more_body": chunk_index < len(chunks)
-                    }
-                else:
-                    # End of stream
-                    return {
-                        "type": "http.request",
-                        "body": b"",
-                        "more_body": False
-                    }
-            
-            # Replace request stream
-            request._receive = new_receive
-        
-        response = await call_next(request)
-        return response
\ No newline at end of file
+from collections import deque
+from typing import Dict, Optional
+
+from core.capture import capture_pipeline
+from config.settings import (
+    HTTP_TAP_ENABLED, HTTP_TAP_SAMPLE_RATE, HTTP_TAP_PAYLOAD_BYTES, HTTP_TAP_RECENT
+)
+
+
+CAPTURE_PATH = "/v1/chat/completions"
+OTHER_PATHS = "other"
+
+
+class _Exchange:
+    """State của 1 request/response đang đi qua tap"""
+
+    __slots__ = (
+        "method", "path", "started_at", "status", "request_bytes", "response_bytes", "chunks",
+        "events", "first_byte_at", "finished_at", "streaming", "disconnected", "preview", "preview_size"
+    )
+
+    def __init__(self, scope, sampled: bool):
+        self.method = scope.get("method", "")
+        self.path = scope.get("path", "")
+        self.started_at = time.perf_counter()
+        self.status: Optional[int] = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.chunks = 0
+        self.events = 0
+        self.first_byte_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.streaming = False
+        self.disconnected = False
+        # None = không sample payload
+        self.preview: Optional[list] = [] if sampled else None
+        self.preview_size = 0
+
+
+class HttpTap:
+    """Thống kê theo path + ring buffer các exchange gần nhất"""
+
+    def __init__(self, enabled: bool = True, sample_rate: float = 1.0, payload_bytes: int = 4096,
+                 recent_size: int = 50, max_paths: int = 32):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.payload_bytes = payload_bytes
+        self.max_paths = max_paths
+        self._paths: Dict[str, dict] = {}
+        self._recent: deque = deque(maxlen=recent_size)
+
+    def sample(self) -> bool:
+        if self.sample_rate <= 0 or self.payload_bytes <= 0:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _path_stats(self, path: str) -> dict:
+        stats = self._paths.get(path)
+        if stats is None:
+            # Giới hạn số path (tránh bị scanner 404 làm phình dict)
+            if len(self._paths) >= self.max_paths:
+                path = OTHER_PATHS
+                stats = self._paths.get(path)
+            if stats is None:
+                stats = {
+                    "requests": 0, "server_errors": 0, "disconnects": 0,
+                    "request_bytes": 0, "response_bytes": 0, "total_ms": 0.0, "max_ms": 0.0
+                }
+                self._paths[path] = stats
+        return stats
+
+    def record(self, exchange: _Exchange):
+        finished_at = exchange.finished_at or time.perf_counter()
+        duration_ms = (finished_at - exchange.started_at) * 1000
+
+        stats = self._path_stats(exchange.path)
+        stats["requests"] += 1
+        stats["request_bytes"] += exchange.request_bytes
+        stats["response_bytes"] += exchange.response_bytes
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        if exchange.status is None or exchange.status >= 500:
+            stats["server_errors"] += 1
+        if exchange.disconnected:
+            stats["disconnects"] += 1
+
+        entry = {
+            "method": exchange.method,
+            "path": exchange.path,
+            "status": exchange.status,
+            "request_bytes": exchange.request_bytes,
+            "response_bytes": exchange.response_bytes,
+            "chunks": exchange.chunks,
+            "streaming": exchange.streaming,
+            "ttfb_ms": round((exchange.first_byte_at - exchange.started_at) * 1000, 1)
+            if exchange.first_byte_at is not None else None,
+            "duration_ms": round(duration_ms, 1),
+            "disconnected": exchange.disconnected
+        }
+        if exchange.streaming:
+            entry["events"] = exchange.events
+        if exchange.preview is not None:
+            entry["payload_preview"] = b"".join(exchange.preview).decode('utf-8', errors='replace')
+        self._recent.append(entry)
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "paths": {
+                path: {**stats, "avg_ms": round(stats["total_ms"] / stats["requests"], 1) if stats["requests"] else 0.0}
+                for path, stats in self._paths.items()
+            },
+            "recent": list(self._recent)
+        }
+
+
+http_tap = HttpTap(
+    enabled=HTTP_TAP_ENABLED,
+    sample_rate=HTTP_TAP_SAMPLE_RATE,
+    payload_bytes=HTTP_TAP_PAYLOAD_BYTES,
+    recent_size=HTTP_TAP_RECENT
+)
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers") or ():
+        if key == name:
+            return value
+    return None
+
+
+class HttpTapMiddleware:
+    """
+    Pure ASGI middleware: bọc receive/send bằng closure, forward nguyên message
+    (không copy body, không buffer response). Chỉ giữ:
+    - reference tới các chunk body request khi request được capture
+    - tối đa HTTP_TAP_PAYLOAD_BYTES của response khi được sample
+    """
+
+    def __init__(self, app, tap: HttpTap = http_tap, capture=capture_pipeline):
+        self.app = app
+        self.tap = tap
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tap.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        tap = self.tap
+        capture = self.capture
+        exchange = _Exchange(scope, tap.sample())
+
+        capture_chunks: Optional[list] = None
+        if scope.get("path") == CAPTURE_PATH and capture.sample():
+            content_length = _header(scope, b"content-length")
+            if content_length is None or not content_length.isdigit() or capture.accepts_size(int(content_length)):
+                capture_chunks = []
+
+        async def tapped_receive():
+            nonlocal capture_chunks
+            message = await receive()
+
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                exchange.request_bytes += len(body)
+
+                if capture_chunks is not None:
+                    if body:
+                        capture_chunks.append(body)
+                    if not message.get("more_body", False):
+                        # Join 1 lần duy nhất (body 1 chunk → dùng luôn object gốc)
+                        captured = capture_chunks[0] if len(capture_chunks) == 1 else b"".join(capture_chunks)
+                        capture_chunks = None
+                        capture.submit(captured)
+            elif message["type"] == "http.disconnect":
+                # StreamingResponse vẫn nhận http.disconnect sau khi gửi xong → chỉ tính khi đang dở
+                if exchange.finished_at is None:
+                    exchange.disconnected = True
+                capture_chunks = None
+
+            return message
+
+        async def tapped_send(message):
+            message_type = message["type"]
+
+            if message_type == "http.response.start":
+                exchange.status = message["status"]
+                for key, value in message.get("headers") or ():
+                    if key.lower() == b"content-type":
+                        exchange.streaming = value.startswith(b"text/event-stream")
+                        break
+            elif message_type == "http.response.body":
+                body = message.get("body", b"")
+                if body:
+                    if exchange.first_byte_at is None:
+                        exchange.first_byte_at = time.perf_counter()
+                    exchange.response_bytes += len(body)
+                    exchange.chunks += 1
+                    if exchange.streaming:
+                        exchange.events += body.count(b"data: ")
+
+                    remaining = tap.payload_bytes - exchange.preview_size
+                    if exchange.preview is not None and remaining > 0:
+                        piece = body[:remaining]
+                        exchange.preview.append(piece)
+                        exchange.preview_size += len(piece)
+
+                if not message.get("more_body", False):
+                    exchange.finished_at = time.perf_counter()
+
+            await send(message)
+
+        try:
+            await self.app(scope, tapped_receive, tapped_send)
+        except BaseException:
+            # Stream bị cắt giữa chừng (client cancel) - status None thì tính là server error
+            if exchange.status is not None and exchange.finished_at is None:
+                exchange.disconnected = True
+            raise
+        finally:
+            tap.record(exchange)
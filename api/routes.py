@@ -1,227 +1,12 @@
 import os
-import re
 import asyncio
 import time
 import uuid
-import json
 from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Depends, Header, Response
-
-def _extract_images_from_messages(messages: list) -> list[dict]:
-    """
-    Extract tất cả images từ messages.
-    Trả về list các image objects với format: {type, data, format}
-    🔥 CRITICAL: Wrapped trong try-catch để không crash nếu có lỗi
-    """
-    images = []
-    
-    try:
-        if not messages or not isinstance(messages, list):
-            return images
-        
-        for msg_idx, msg in enumerate(messages):
-            try:
-                # Validate msg structure
-                if not hasattr(msg, 'content'):
-                    continue
-                
-                content = msg.content
-                
-                if isinstance(content, list):
-                    for item_idx, item in enumerate(content):
-                        try:
-                            if isinstance(item, dict):
-                                if item.get("type") == "image_url":
-                                    image_url_data = item.get("image_url", {})
-                                    
-                                    if isinstance(image_url_data, dict):
-                                        url = image_url_data.get("url", "")
-                                    elif isinstance(image_url_data, str):
-                                        url = image_url_data
-                                    else:
-                                        continue
-                                    
-                                    if url.startswith("data:image"):
-                                        import re
-                                        match = re.match(r'data:image/([a-zA-Z]+);base64,(.+)', url)
-                                        if match:
-                                            image_format = match.group(1)
-                                            base64_data = match.group(2)
-                                            
-                                            # Validate base64 data (basic check)
-                                            if base64_data and len(base64_data) > 0:
-                                                images.append({
-                                                    "type": "image_url",
-                                                    "format": image_format,
-                                                    "data": base64_data
-                                                })
-                        except Exception as item_error:
-                            # Log item error nhưng không crash
-                            from core import warning
-                            warning(
-                                f"Failed to process image item {item_idx} in message {msg_idx}",
-                                {"error": str(item_error), "error_type": type(item_error).__name__}
-                            )
-                            continue
-                            
-            except Exception as msg_error:
-                # Log message error nhưng không crash
-                from core import warning
-                warning(
-                    f"Failed to process message {msg_idx}",
-                    {"error": str(msg_error), "error_type": type(msg_error).__name__}
-                )
-                continue
-        
-    except Exception as e:
-        # Log top-level error nhưng trả về empty list thay vì crash
-        from core import error
-        error(
-            f"Critical error in _extract_images_from_messages",
-            {"error": str(e), "error_type": type(e).__name__},
-            show_traceback=True
-        )
-        return []
-    
-    return images
-
-def _extract_folder_path(messages: list) -> str | None:
-    """
-    Extract folder_path từ system/user messages.
-    Tìm pattern: # Current Working Directory (/path/to/folder)
-    🔥 CRITICAL: Wrapped trong try-catch để không crash
-    """
-    try:
-        if not messages or not isinstance(messages, list):
-            return None
-        
-        for msg in messages:
-            try:
-                if not hasattr(msg, 'content'):
-                    continue
-                
-                content = msg.content
-                
-                if isinstance(content, str):
-                    match = re.search(
-                        r'# Current Working Directory \(([^)]+)\)',
-                        content
-                    )
-                    if match:
-                        folder_path = match.group(1)
-                        # Validate folder_path is not empty
-                        if folder_path and folder_path.strip():
-                            return folder_path.strip()
-                            
-                elif isinstance(content, list):
-                    for item in content:
-                        try:
-                            if isinstance(item, dict) and item.get("type") == "text":
-                                text = item.get("text", "")
-                                if text:
-                                    match = re.search(
-                                        r'# Current Working Directory \(([^)]+)\)',
-                                        text
-                                    )
-                                    if match:
-                                        folder_path = match.group(1)
-                                        if folder_path and folder_path.strip():
-                                            return folder_path.strip()
-                        except Exception:
-                            continue
-                            
-            except Exception:
-                continue
-                
-    except Exception as e:
-        from core import warning
-        warning(
-            f"Error in _extract_folder_path",
-            {"error": str(e), "error_type": type(e).__name__}
-        )
-        return None
-    
-    return None
-
-def _detect_new_task(messages: list) -> bool:
-    """
-    Kiểm tra xem có <task></task> KHÔNG RỖNG trong MESSAGE CUỐI CÙNG không.
-    Trả về True nếu đây là task mới (có nội dung task).
-    🔥 CRITICAL: Wrapped trong try-catch, default False nếu có lỗi
-    """
-    try:
-        if not messages or not isinstance(messages, list) or len(messages) == 0:
-            return False
-        
-        latest_msg = messages[-1]
-        
-        if not hasattr(latest_msg, 'content'):
-            return False
-        
-        content = latest_msg.content
-        
-        if isinstance(content, str):
-            has_task_tag = '<task>' in content and '</task>' in content
-            if has_task_tag:
-                try:
-                    task_start_idx = content.find('<task>') + 6
-                    task_end_idx = content.find('</task>')
-                    
-                    # Validate indices
-                    if task_end_idx <= task_start_idx:
-                        return False
-                    
-                    task_content = content[task_start_idx:task_end_idx].strip()
-                    
-                    if len(task_content) == 0:
-                        return False
-                    
-                    return True
-                except Exception:
-                    return False
-            else:
-                return False
-                
-        elif isinstance(content, list):
-            for idx, item in enumerate(content):
-                try:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        text = item.get("text", "")
-                        if not text:
-                            continue
-                        
-                        has_task_tag = '<task>' in text and '</task>' in text
-                        if has_task_tag:
-                            task_start_idx = text.find('<task>') + 6
-                            task_end_idx = text.find('</task>')
-                            
-                            # Validate indices
-                            if task_end_idx <= task_start_idx:
-                                continue
-                            
-                            task_content = text[task_start_idx:task_end_idx].strip()
-                            
-                            if len(task_content) == 0:
-                                continue
-                            
-                            return True
-                except Exception:
-                    continue
-                    
-            return False
-        else:
-            return False
-            
-    except Exception as e:
-        from core import warning
-        warning(
-            f"Error in _detect_new_task",
-            {"error": str(e), "error_type": type(e).__name__}
-        )
-        return False
+from fastapi import APIRouter, HTTPException, Depends, Header, Response, Request
 
 def _validate_and_fix_response(response: dict, request_id: str, is_fake: bool = False) -> dict:
     """
@@ -360,12 +145,220 @@ def _validate_and_fix_response(response: dict, request_id: str, is_fake: bool =
             show_traceback=True
         )
 
-from config.settings import REQUEST_TIMEOUT, HTTP_PORT
-from models import ChatCompletionRequest
+from config.settings import REQUEST_TIMEOUT, HTTP_PORT, HEDGE_API_KEYS, STRICT_REQUEST_VALIDATION
+from models import ChatCompletionRequest, RequestParseError, parse_chat_completion_request
 from .dependencies import verify_api_key
 import uuid
 import time
-from core import error_response, is_fake_mode_enabled, generate_fake_response
+from core import error_response, is_fake_mode_enabled, generate_fake_response, QueueFullError
+from core import json_codec
+from core.response_channel import EVENT_DELTA
+
+def _error_response_from_result(response: dict, tab_id: int, request_id: str):
+    """
+    Convert error dict từ wait_for_response/stream_response thành error_response
+    """
+    error_msg = response.get("error", "Unknown error")
+    error_type = response.get("error_type", "UNKNOWN")
+    status_hint = response.get("status_hint", 500)
+    
+    # Map error_type tới detail message phù hợp
+    detail_messages = {
+        "TIMEOUT": f"Request timeout sau {response.get('timeout_seconds', 'N/A')} giây. Tab DeepSeek không phản hồi kịp thời.",
+        "COOLING_DOWN": "Tab đang trong trạng thái cooling down hoặc chưa sẵn sàng nhận request mới.",
+        "TAB_ERROR": "Tab gặp lỗi khi xử lý request.",
+        "CONNECTION_LOST": "ZenTab extension mất kết nối khi đang xử lý request. Có thể retry ngay khi ZenTab kết nối lại.",
+        "EXCEPTION": f"Lỗi nội bộ: {error_msg}"
+    }
+    
+    detail_message = detail_messages.get(error_type, error_msg)
+    
+    # Build metadata với thông tin đầy đủ
+    error_metadata = {
+        "tab_id": tab_id,
+        "request_id": request_id,
+        "error_type": error_type
+    }
+    
+    # Thêm thông tin bổ sung nếu có
+    if "exception_class" in response:
+        error_metadata["exception_class"] = response["exception_class"]
+    if response.get("retryable"):
+        error_metadata["retryable"] = True
+    if "traceback_preview" in response:
+        error_metadata["traceback_preview"] = response["traceback_preview"][:200]
+    
+    return error_response(
+        error_message=f"Error from wait_for_response: {error_type}",
+        detail_message=detail_message,
+        metadata=error_metadata,
+        status_code=status_hint,
+        show_traceback=(error_type == "EXCEPTION")  # Chỉ show traceback cho EXCEPTION
+    )
+
+# Chu kỳ kiểm tra client (Cline) còn kết nối trong lúc chờ response non-stream
+CLIENT_DISCONNECT_POLL_INTERVAL = 1.0
+
+# Body được parse thủ công (fast path) → khai báo schema cho /docs
+CHAT_COMPLETIONS_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": ChatCompletionRequest.model_json_schema()}}
+    }
+}
+
+def _should_hedge(api_key: str, hedge_header: Optional[str]) -> bool:
+    """Header X-ZenEnd-Hedge (nếu có) override cấu hình HEDGE_API_KEYS"""
+    if hedge_header is not None:
+        return hedge_header.strip().lower() in ("1", "true", "yes", "on")
+    return api_key in HEDGE_API_KEYS
+
+async def _wait_for_response_or_disconnect(port_manager, http_request: Request, request_id: str,
+                                           events=None) -> Optional[dict]:
+    """
+    Đợi response như wait_for_response nhưng dừng sớm khi client ngắt kết nối.
+    
+    Returns:
+        dict | None: Response/error dict, hoặc None nếu client đã ngắt (request đã bị cancel)
+    """
+    response_task = asyncio.create_task(port_manager.wait_for_response(request_id, REQUEST_TIMEOUT, stream=events))
+    
+    try:
+        while True:
+            done, _ = await asyncio.wait({response_task}, timeout=CLIENT_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return response_task.result()
+            
+            if await http_request.is_disconnected():
+                await port_manager.cancel_request(request_id, reason="client_disconnected")
+                return None
+    except asyncio.CancelledError:
+        # Handler bị huỷ (server shutdown/client abort) → vẫn phải giải phóng tab
+        asyncio.create_task(port_manager.cancel_request(request_id, reason="request_cancelled"))
+        raise
+    finally:
+        if not response_task.done():
+            response_task.cancel()
+
+def _sse_chunk(chunk: dict) -> bytes:
+    return b"data: " + json_codec.dumps_bytes(chunk) + b"\n\n"
+
+async def _stream_completion(port_manager, request_id: str, tab_id: int, events=None):
+    """
+    Relay từng delta từ ZenTab về client dưới dạng chat.completion.chunk ngay khi nhận được.
+    Response cuối (promptResponse) chỉ gửi phần content chưa được stream + finish_reason/usage.
+    """
+    from fastapi.responses import StreamingResponse
+    
+    chunk_id = f"chatcmpl-{request_id}"
+    created = int(time.time())
+    streamed_parts = []
+    finished = False
+    
+    try:
+        if events is None:
+            events = port_manager.stream_response(request_id, REQUEST_TIMEOUT)
+        
+        async for event_type, payload in events:
+            if event_type == EVENT_DELTA:
+                delta = {"content": payload}
+                if not streamed_parts:
+                    delta["role"] = "assistant"
+                streamed_parts.append(payload)
+                
+                yield _sse_chunk({
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": "deepseek-chat",
+                    "choices": [{
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": None,
+                        "logprobs": None
+                    }]
+                })
+                continue
+            
+            response = payload
+            finished = True
+            
+            if not isinstance(response, dict) or "error" in response:
+                if isinstance(response, dict):
+                    error = _error_response_from_result(response, tab_id, request_id)
+                else:
+                    error = error_response(
+                        error_message="Invalid response from stream_response",
+                        detail_message=f"Response không hợp lệ (type: {type(response).__name__}). Có thể ZenTab extension không phản hồi đúng format.",
+                        metadata={"tab_id": tab_id, "request_id": request_id, "response_type": type(response).__name__},
+                        status_code=500,
+                        show_traceback=False
+                    )
+                async for chunk in error.body_iterator:
+                    yield chunk
+                return
+            
+            port_manager.mark_request_completed(request_id)
+            port_manager.schedule_request_cleanup(request_id, delay=30.0)
+            
+            final_chunk = _validate_and_fix_response(response, request_id, is_fake=False)
+            
+            # 🔥 CRITICAL: _validate_and_fix_response trả về StreamingResponse nghĩa là error
+            if isinstance(final_chunk, StreamingResponse):
+                async for chunk in final_chunk.body_iterator:
+                    yield chunk
+                return
+            
+            choice = final_chunk["choices"][0]
+            content = choice["delta"]["content"]
+            streamed_text = "".join(streamed_parts)
+            
+            if streamed_text:
+                # Chỉ gửi phần còn thiếu - client đã nhận các delta trước đó
+                if content.startswith(streamed_text):
+                    remainder = content[len(streamed_text):]
+                else:
+                    from core import warning
+                    warning(
+                        "Final response does not extend streamed deltas, dropping final content",
+                        {"request_id": request_id, "streamed_length": len(streamed_text), "content_length": len(content)}
+                    )
+                    remainder = ""
+                choice["delta"] = {"content": remainder}
+                final_chunk["id"] = chunk_id
+                final_chunk["object"] = "chat.completion.chunk"
+            
+            from core import info
+            info(
+                "✅ Streamed response to client",
+                {
+                    "request_id": request_id,
+                    "tab_id": tab_id,
+                    "delta_count": len(streamed_parts),
+                    "finish_reason": choice.get("finish_reason", "unknown"),
+                    "content_length": len(content)
+                }
+            )
+            
+            yield _sse_chunk(final_chunk)
+            yield "data: [DONE]\n\n"
+            return
+    
+    except Exception as e:
+        error = error_response(
+            error_message="Unexpected error while streaming response",
+            detail_message=f"Đã xảy ra lỗi không mong muốn khi stream response: {str(e)}",
+            metadata={"request_id": request_id, "tab_id": tab_id, "error_type": type(e).__name__},
+            status_code=500,
+            show_traceback=True
+        )
+        async for chunk in error.body_iterator:
+            yield chunk
+    
+    finally:
+        if not finished:
+            # Client ngắt kết nối giữa chừng (generator bị close/cancel) → báo ZenTab dừng tab
+            asyncio.create_task(port_manager.cancel_request(request_id, reason="client_disconnected"))
 
 router = APIRouter()
 
@@ -420,6 +413,19 @@ def setup_routes(app, port_manager):
             "websocket_enabled": not os.getenv("RENDER")
         }
     
+    @router.get("/v1/status")
+    async def backend_status(api_key: str = Depends(verify_api_key)):
+        """
+        Trạng thái chi tiết: connection, tab registry, hàng đợi tab, debug capture, HTTP tap
+        """
+        from core.capture import capture_pipeline
+        from api.middleware import http_tap
+
+        status = port_manager.get_detailed_status()
+        status["capture"] = capture_pipeline.get_stats()
+        status["http_tap"] = http_tap.get_stats()
+        return status
+    
     @router.head("/health")
     async def health_check_head():
         """
@@ -427,13 +433,26 @@ def setup_routes(app, port_manager):
         """
         return Response(status_code=200)
 
-    @router.post("/v1/chat/completions")
+    @router.post("/v1/chat/completions", openapi_extra=CHAT_COMPLETIONS_OPENAPI)
     async def chat_completions(
-        request: ChatCompletionRequest,
-        api_key: str = Depends(verify_api_key)
+        http_request: Request,
+        api_key: str = Depends(verify_api_key),
+        x_zenend_hedge: Optional[str] = Header(None)
     ):
         from fastapi.responses import StreamingResponse
         
+        # 🆕 Đọc raw body 1 lần, chỉ lấy field cần thiết (không validate cả history thành Pydantic)
+        try:
+            request = parse_chat_completion_request(await http_request.body(), strict=STRICT_REQUEST_VALIDATION)
+        except RequestParseError as e:
+            return error_response(
+                error_message=str(e),
+                detail_message=f"Request body không hợp lệ: {str(e)}",
+                metadata={"errors": e.errors},
+                status_code=e.status_code,
+                show_traceback=False
+            )
+        
         SUPPORTED_MODELS = ["deepseek-chat"]
         if request.model not in SUPPORTED_MODELS:
             return error_response(
@@ -507,63 +526,109 @@ def setup_routes(app, port_manager):
                 show_traceback=False
             )
                 
-        folder_path = _extract_folder_path(request.messages)
-        is_new_task = _detect_new_task(request.messages)
+        request_id = f"api-{uuid.uuid4().hex[:16]}"
+        
+        # 🆕 Preprocess 1 lượt (cache theo prefix hội thoại → lượt sau chỉ xử lý message mới)
+        try:
+            conversation = port_manager.conversations.build(request.messages)
+        except Exception as e:
+            return error_response(
+                error_message="Invalid messages in request",
+                detail_message=f"Không thể xử lý messages trong request: {str(e)}",
+                metadata={"error_type": type(e).__name__, "messages_count": len(request.messages)},
+                status_code=400,
+                show_traceback=False
+            )
+        folder_path = conversation.folder_path
+        is_new_task = conversation.is_new_task
+        
+        if not conversation.user_count:
+            return error_response(
+                error_message="No user message in request",
+                detail_message="Không tìm thấy user message trong request. Request phải chứa ít nhất một message có role='user'.",
+                metadata={"total_messages": len(request.messages), "system_messages": conversation.system_count},
+                status_code=400,
+                show_traceback=False
+            )
+
+        if not is_new_task and not folder_path:
+            return error_response(
+                error_message="Missing folder_path in request",
+                detail_message="Không tìm thấy folder_path trong request. Vui lòng đảm bảo task context được bao gồm trong messages.",
+                metadata={"is_new_task": False, "messages_count": len(request.messages)},
+                status_code=400,
+                show_traceback=False
+            )
+        
+        # 🆕 Xếp hàng chờ tab rảnh thay vì trả 503 ngay
+        try:
+            free_tabs, queue_wait = await port_manager.wait_for_free_tabs(folder_path, is_new_task, timeout=10.0)
+        except QueueFullError:
+            return error_response(
+                error_message="Tab wait queue is full",
+                detail_message="Quá nhiều request đang chờ tab DeepSeek rảnh. Vui lòng thử lại sau.",
+                metadata={"is_new_task": is_new_task, "folder_path": folder_path or "None", "queue_depth": port_manager.tab_queue.depth},
+                status_code=503,
+                show_traceback=False
+            )
 
         if is_new_task:
-            available_tabs = await port_manager.request_fresh_tabs(timeout=10.0)
+            available_tabs = free_tabs
             
             if not available_tabs or len(available_tabs) == 0:
                 return error_response(
                     error_message="No available tabs for new task",
                     detail_message="Không có tab DeepSeek nào khả dụng hoặc tất cả tabs đang busy. Vui lòng đợi hoặc mở thêm tab DeepSeek.",
-                    metadata={"is_new_task": True, "available_tabs_count": 0},
+                    metadata={"is_new_task": True, "available_tabs_count": 0, "queue_wait_seconds": round(queue_wait, 2)},
                     status_code=503,
                     show_traceback=False
                 )
             
             # 🔥 NEW: Ưu tiên tab KHÔNG có folder_path hoặc có folder_path TRÙNG
             if folder_path:
-                matching_tabs = [t for t in available_tabs if t.get('folderPath') == folder_path or t.get('folderPath') is None]
-                if matching_tabs:
-                    selected_tab = matching_tabs[0]
-                else:
-                    selected_tab = available_tabs[0]
+                preferred_tabs = [t for t in available_tabs if t.get('folderPath') == folder_path or t.get('folderPath') is None]
+            else:
+                preferred_tabs = [t for t in available_tabs if t.get('folderPath') is None]
+            
+            # 🆕 Lease atomically: tab ưu tiên trước, fallback các tab còn lại
+            # Trong mỗi nhóm, scheduler xếp tab theo expected completion time
+            selected_tab = port_manager.lease_tab(port_manager.tab_scheduler.order(preferred_tabs), request_id)
+            if selected_tab is None:
+                selected_tab = port_manager.lease_tab(port_manager.tab_scheduler.order(available_tabs), request_id)
+                if selected_tab is not None and folder_path:
                     from core import warning
                     warning(
                         f"No matching tabs for folder '{folder_path}', using first available tab",
                         {"folder_path": folder_path, "selected_tab_id": selected_tab.get('tabId')}
                     )
-            else:
-                no_folder_tabs = [t for t in available_tabs if t.get('folderPath') is None]
-                selected_tab = no_folder_tabs[0] if no_folder_tabs else available_tabs[0]
         else:
-            if not folder_path:
-                return error_response(
-                    error_message="Missing folder_path in request",
-                    detail_message="Không tìm thấy folder_path trong request. Vui lòng đảm bảo task context được bao gồm trong messages.",
-                    metadata={"is_new_task": False, "messages_count": len(request.messages)},
-                    status_code=400,
-                    show_traceback=False
-                )
-            
-            folder_tabs = await port_manager.request_tabs_by_folder(folder_path, timeout=10.0)
+            folder_tabs = free_tabs
             
             if not folder_tabs or len(folder_tabs) == 0:
                 return error_response(
                     error_message=f"No tabs linked to folder: {folder_path}",
                     detail_message=f"Không có tab nào rảnh được liên kết với folder '{folder_path}'. Các tab có thể đang busy hoặc chưa được link.",
-                    metadata={"folder_path": folder_path, "is_new_task": False},
+                    metadata={"folder_path": folder_path, "is_new_task": False, "queue_wait_seconds": round(queue_wait, 2)},
                     status_code=503,
                     show_traceback=False
                 )
             
-            # 🔥 FIX: Double-check canAccept để chắc chắn tab thực sự rảnh
-            selected_tab = folder_tabs[0]
+            selected_tab = port_manager.lease_tab(port_manager.tab_scheduler.order(folder_tabs), request_id)
+        
+        if selected_tab is None:
+            return error_response(
+                error_message="All free tabs already leased",
+                detail_message="Tất cả tabs rảnh vừa được request khác giữ chỗ. Vui lòng thử lại.",
+                metadata={"is_new_task": is_new_task, "folder_path": folder_path or "None", "request_id": request_id},
+                status_code=503,
+                show_traceback=False
+            )
         
         tab_id = selected_tab.get('tabId')
+        connection_id = selected_tab.get('connectionId')
         
         if not tab_id or not isinstance(tab_id, int) or tab_id <= 0:
+            port_manager.release_tab_lease(request_id)
             return error_response(
                 error_message=f"Invalid tab ID from ZenTab: {tab_id}",
                 detail_message=f"Nhận được tab ID không hợp lệ từ ZenTab extension: {tab_id}",
@@ -572,20 +637,23 @@ def setup_routes(app, port_manager):
                 show_traceback=False
             )
         
-        # 🆕 EXTRACT IMAGES từ messages với error handling
+        # 🆕 Images của hội thoại (đã decode trong conversation index) với error handling
         try:
-            images = _extract_images_from_messages(request.messages)
+            all_images = port_manager.conversations.resolve_images(conversation, request.messages)
+            # 🆕 Chỉ gửi ảnh tab chưa nhận ở các lượt trước (new task → gửi lại toàn bộ)
+            images = port_manager.image_cache.select_new((connection_id, tab_id), all_images, is_new_task)
             has_images = len(images) > 0
             
-            if has_images:
+            if all_images:
                 from core import info
                 info(
-                    f"📸 Extracted {len(images)} image(s) from request",
+                    f"📸 Extracted {len(all_images)} image(s) from request, {len(images)} new for tab",
                     {
                         "request_id": request_id,
                         "tab_id": tab_id,
-                        "image_count": len(images),
-                        "image_formats": [img["format"] for img in images]
+                        "image_count": len(all_images),
+                        "new_image_count": len(images),
+                        "image_formats": [img.format for img in images]
                     }
                 )
         except Exception as e:
@@ -602,6 +670,7 @@ def setup_routes(app, port_manager):
         can_accept = selected_tab.get('canAccept', False)
         
         if tab_status != 'free' or not can_accept:
+            port_manager.release_tab_lease(request_id)
             return error_response(
                 error_message=f"Tab not ready: status={tab_status}, can_accept={can_accept}",
                 detail_message=f"Tab không sẵn sàng nhận request. Trạng thái: {tab_status}, Có thể nhận: {can_accept}",
@@ -610,49 +679,9 @@ def setup_routes(app, port_manager):
                 show_traceback=False
             )
 
-        request_id = f"api-{uuid.uuid4().hex[:16]}"
-
-        system_messages = [msg for msg in request.messages if msg.role == "system"]
-        user_messages = [msg for msg in request.messages if msg.role == "user"]
-        
-        if not user_messages:
-            return error_response(
-                error_message="No user message in request",
-                detail_message="Không tìm thấy user message trong request. Request phải chứa ít nhất một message có role='user'.",
-                metadata={"total_messages": len(request.messages), "system_messages": len(system_messages)},
-                status_code=400,
-                show_traceback=False
-            )
-
-        system_prompt = ""
-        if is_new_task and system_messages:
-            system_content = system_messages[0].content
-            if isinstance(system_content, str):
-                system_prompt = system_content
-            elif isinstance(system_content, list):
-                text_parts = []
-                for item in system_content:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        text_parts.append(item.get("text", ""))
-                system_prompt = "\n\n".join(text_parts)
-        
-        raw_content = user_messages[-1].content
-        
-        if isinstance(raw_content, list):
-            text_parts = []
-            for item in raw_content:
-                if isinstance(item, dict):
-                    if item.get("type") == "text":
-                        text_parts.append(item.get("text", ""))
-                    elif item.get("type") == "image":
-                        text_parts.append("[IMAGE - Not supported]")
-            
-            user_prompt = "\n\n".join(text_parts)
-        else:
-            user_prompt = raw_content
+        system_prompt = conversation.system_prompt if is_new_task else ""
+        user_prompt = conversation.last_user_text
 
-        port_manager.request_to_tab[request_id] = tab_id
-        
         # 🆕 LOG: Chi tiết về isNewTask decision
         from core import info
         info(
@@ -660,12 +689,14 @@ def setup_routes(app, port_manager):
             {
                 "request_id": request_id,
                 "tab_id": tab_id,
+                "connection_id": connection_id or "None",
                 "is_new_task": is_new_task,
                 "folder_path": folder_path or "None",
                 "tab_folder_path": selected_tab.get('folderPath') or "None",
                 "has_system_prompt": bool(system_prompt and system_prompt.strip()),
                 "user_prompt_length": len(user_prompt),
-                "system_prompt_length": len(system_prompt) if system_prompt else 0
+                "system_prompt_length": len(system_prompt) if system_prompt else 0,
+                "queue_wait_seconds": round(queue_wait, 2)
             }
         )
 
@@ -675,7 +706,8 @@ def setup_routes(app, port_manager):
             "systemPrompt": system_prompt,
             "userPrompt": user_prompt,
             "requestId": request_id,
-            "isNewTask": is_new_task
+            "isNewTask": is_new_task,
+            "stream": bool(request.stream)
         }
         
         if is_new_task and folder_path:
@@ -691,30 +723,21 @@ def setup_routes(app, port_manager):
             ws_message["images"] = images
         
         try:
-            # 🔥 CRITICAL: Validate WebSocket state trước khi gửi
-            if not port_manager.websocket:
+            # 🔥 CRITICAL: Validate connection sở hữu tab trước khi gửi
+            connection = port_manager.connection_pool.get(connection_id)
+            if not connection or not connection.is_open():
+                port_manager.release_tab_lease(request_id)
                 return error_response(
                     error_message="WebSocket connection lost",
-                    detail_message="WebSocket đã bị disconnect trước khi gửi prompt. Vui lòng reconnect ZenTab extension.",
-                    metadata={"tab_id": tab_id, "request_id": request_id},
+                    detail_message="WebSocket sở hữu tab đã bị disconnect trước khi gửi prompt. Vui lòng reconnect ZenTab extension.",
+                    metadata={"tab_id": tab_id, "request_id": request_id, "connection_id": connection_id or "None"},
                     status_code=503,
                     show_traceback=False
                 )
             
-            # Check WebSocket state (FastAPI WebSocket)
-            if hasattr(port_manager.websocket, 'client_state'):
-                from starlette.websockets import WebSocketState
-                if port_manager.websocket.client_state != WebSocketState.CONNECTED:
-                    return error_response(
-                        error_message="WebSocket not in CONNECTED state",
-                        detail_message=f"WebSocket state: {port_manager.websocket.client_state}. Không thể gửi message.",
-                        metadata={"tab_id": tab_id, "request_id": request_id, "ws_state": str(port_manager.websocket.client_state)},
-                        status_code=503,
-                        show_traceback=False
-                    )
-            
             # 🔥 CRITICAL: Validate ws_message structure
             if not ws_message or not isinstance(ws_message, dict):
+                port_manager.release_tab_lease(request_id)
                 return error_response(
                     error_message="Invalid WebSocket message structure",
                     detail_message=f"WebSocket message không hợp lệ (type: {type(ws_message).__name__})",
@@ -724,9 +747,11 @@ def setup_routes(app, port_manager):
                 )
             
             # Try to serialize ws_message to JSON (validation)
+            # System prompt đã gửi cho connection này trước đó → chỉ gửi hash, ảnh → binary frames
             try:
-                json_str = json.dumps(ws_message)
+                json_str, attachments = port_manager.encode_prompt_message(connection_id, ws_message)
             except (TypeError, ValueError) as json_err:
+                port_manager.release_tab_lease(request_id)
                 return error_response(
                     error_message="Failed to serialize WebSocket message to JSON",
                     detail_message=f"Không thể chuyển ws_message sang JSON. Lỗi: {str(json_err)}",
@@ -735,14 +760,15 @@ def setup_routes(app, port_manager):
                     show_traceback=True
                 )
             
-            # Send message
-            await port_manager.websocket.send_text(json_str)
+            # Send message qua đúng connection sở hữu tab
+            await port_manager.dispatch_prompt(request_id, selected_tab, json_str, attachments)
+            port_manager.image_cache.record_sent(request_id, (connection_id, tab_id), images, is_new_task)
             
         except Exception as e:
             import traceback
             traceback.print_exc()
             
-            port_manager.request_to_tab.pop(request_id, None)
+            port_manager.release_tab_lease(request_id)
             return error_response(
                 error_message=f"Failed to send prompt to tab {tab_id}",
                 detail_message=f"Không thể gửi prompt tới tab. Lỗi: {str(e)}",
@@ -751,8 +777,28 @@ def setup_routes(app, port_manager):
                 show_traceback=True
             )
         
+        # 🆕 Hedging (opt-in): new task chậm quá percentile latency → gửi thêm tới tab rảnh thứ 2
+        events = None
+        if is_new_task and _should_hedge(api_key, x_zenend_hedge):
+            events = port_manager.stream_hedged_response(request_id, ws_message, folder_path, REQUEST_TIMEOUT)
+        
+        # 🆕 New task lỗi phía tab → server tự retry sang tab rảnh khác (không bắt Cline backoff)
+        if is_new_task and port_manager.retry_policy.max_retries > 0:
+            events = port_manager.stream_with_retry(request_id, ws_message, folder_path, REQUEST_TIMEOUT, events)
+        
+        # 🆕 Client yêu cầu stream → trả SSE ngay, relay từng delta khi ZenTab gửi lên
+        if request.stream:
+            return StreamingResponse(
+                _stream_completion(port_manager, request_id, tab_id, events),
+                media_type="text/event-stream"
+            )
+        
         try:
-            response = await port_manager.wait_for_response(request_id, REQUEST_TIMEOUT)
+            response = await _wait_for_response_or_disconnect(port_manager, http_request, request_id, events)
+            
+            if response is None:
+                # Client đã ngắt kết nối - không còn ai nhận response
+                return Response(status_code=499)
             
             # 🔥 CRITICAL: Validate response structure trước khi xử lý
             if not response or not isinstance(response, dict):
@@ -766,44 +812,11 @@ def setup_routes(app, port_manager):
             
             # 🆕 FIX: Xử lý error response với status_hint từ wait_for_response
             if "error" in response:
-                error_msg = response.get("error", "Unknown error")
-                error_type = response.get("error_type", "UNKNOWN")
-                status_hint = response.get("status_hint", 500)
-                
-                # Map error_type tới detail message phù hợp
-                detail_messages = {
-                    "TIMEOUT": f"Request timeout sau {response.get('timeout_seconds', 'N/A')} giây. Tab DeepSeek không phản hồi kịp thời.",
-                    "COOLING_DOWN": "Tab đang trong trạng thái cooling down hoặc chưa sẵn sàng nhận request mới.",
-                    "TAB_ERROR": "Tab gặp lỗi khi xử lý request.",
-                    "EXCEPTION": f"Lỗi nội bộ: {error_msg}"
-                }
-                
-                detail_message = detail_messages.get(error_type, error_msg)
-                
-                # Build metadata với thông tin đầy đủ
-                error_metadata = {
-                    "tab_id": tab_id,
-                    "request_id": request_id,
-                    "error_type": error_type
-                }
-                
-                # Thêm thông tin bổ sung nếu có
-                if "exception_class" in response:
-                    error_metadata["exception_class"] = response["exception_class"]
-                if "traceback_preview" in response:
-                    error_metadata["traceback_preview"] = response["traceback_preview"][:200]
-                
-                return error_response(
-                    error_message=f"Error from wait_for_response: {error_type}",
-                    detail_message=detail_message,
-                    metadata=error_metadata,
-                    status_code=status_hint,
-                    show_traceback=(error_type == "EXCEPTION")  # Chỉ show traceback cho EXCEPTION
-                )
+                return _error_response_from_result(response, tab_id, request_id)
             
             port_manager.mark_request_completed(request_id)
 
-            asyncio.create_task(port_manager.schedule_request_cleanup(request_id, delay=30.0))
+            port_manager.schedule_request_cleanup(request_id, delay=30.0)
             
             # 🔥 CRITICAL: _validate_and_fix_response có thể return error_response
             response = _validate_and_fix_response(response, request_id, is_fake=False)
@@ -830,8 +843,8 @@ def setup_routes(app, port_manager):
             if response.get("object") == "chat.completion.chunk":
                 async def generate_real():
                     try:
-                        yield f"data: {json.dumps(response)}\n\n"
-                        yield "data: [DONE]\n\n"
+                        yield _sse_chunk(response)
+                        yield b"data: [DONE]\n\n"
                     except Exception as gen_error:
                         print(f"[API Route] ❌ Generator error: {gen_error}")
                 
@@ -845,7 +858,7 @@ def setup_routes(app, port_manager):
         except Exception as e:
             port_manager.mark_request_processed(request_id)
             
-            asyncio.create_task(port_manager.schedule_request_cleanup(request_id, delay=10.0))
+            port_manager.schedule_request_cleanup(request_id, delay=10.0)
             
             return error_response(
                 error_message=f"Unexpected error processing request",
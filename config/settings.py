@@ -9,4 +9,88 @@ API_KEY = os.getenv("API_KEY", "THIS_IS_API_KEY")
 HTTP_PORT = int(os.getenv("PORT", 3030))
 HTTP_HOST = "0.0.0.0"
 
-REQUEST_TIMEOUT = 1500
\ No newline at end of file
+REQUEST_TIMEOUT = 1500
+
+# JSON backend: auto (orjson → msgspec → json) | orjson | msgspec | json
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+
+# Logger (core/logger.py): level tối thiểu DEBUG | INFO | WARNING | ERROR | CRITICAL | OFF,
+# format console (ANSI color) | json (JSON lines, cho Render/log collector),
+# số record tối đa chờ ghi (queue đầy → bỏ record, không block event loop)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "console").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# /v1/chat/completions mặc định chỉ đọc field cần thiết từ body (fast path);
+# bật để validate toàn bộ request (mọi message) bằng Pydantic như trước
+STRICT_REQUEST_VALIDATION = os.getenv("STRICT_REQUEST_VALIDATION", "false").lower() in ("1", "true", "yes")
+
+# Session resume cho ZenTab WebSocket (/ws?sessionId=...): thời gian giữ session sau khi
+# socket rớt (giây) và số message chưa ack giữ lại để replay
+WS_SESSION_RESUME_GRACE = float(os.getenv("WS_SESSION_RESUME_GRACE", 30))
+WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", 200))
+
+# Hàng đợi chờ tab rảnh (thay vì trả 503 ngay)
+TAB_QUEUE_MAX_DEPTH = int(os.getenv("TAB_QUEUE_MAX_DEPTH", 50))
+TAB_QUEUE_MAX_WAIT = float(os.getenv("TAB_QUEUE_MAX_WAIT", 60))
+
+# Lease giữ chỗ tab cho 1 request - hết hạn nếu không được release (giây)
+TAB_LEASE_TTL = float(os.getenv("TAB_LEASE_TTL", REQUEST_TIMEOUT + 60))
+
+# State ngắn hạn của request (dedupe, in-progress, log) - TTL (giây) và số entry tối đa
+REQUEST_STATE_TTL = float(os.getenv("REQUEST_STATE_TTL", 300))
+REQUEST_STATE_MAX_ENTRIES = int(os.getenv("REQUEST_STATE_MAX_ENTRIES", 10000))
+
+# Circuit breaker theo tab: số lỗi liên tiếp trước khi quarantine, thời gian quarantine
+# ban đầu và tối đa (giây, tăng gấp đôi mỗi lần probe thất bại)
+TAB_FAILURE_THRESHOLD = int(os.getenv("TAB_FAILURE_THRESHOLD", 3))
+TAB_QUARANTINE_BASE = float(os.getenv("TAB_QUARANTINE_BASE", 30))
+TAB_QUARANTINE_MAX = float(os.getenv("TAB_QUARANTINE_MAX", 600))
+
+# Pacing theo tab/account khi DeepSeek throttle (COOLING_DOWN): window đếm request (giây),
+# cooldown mặc định khi error message không có số giây, cooldown tối đa
+TAB_PACING_WINDOW = float(os.getenv("TAB_PACING_WINDOW", 60))
+TAB_COOLDOWN_DEFAULT = float(os.getenv("TAB_COOLDOWN_DEFAULT", 20))
+TAB_COOLDOWN_MAX = float(os.getenv("TAB_COOLDOWN_MAX", 300))
+
+# Số ảnh (đã decode + hash) giữ trong LRU cache để dedupe ảnh giữa các lượt hội thoại
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", 64))
+
+# Số conversation index (kết quả preprocess messages theo prefix hội thoại) giữ trong LRU
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", 128))
+
+# Debug capture (DebugRequestMiddleware): lưu system prompt + ảnh của /v1/chat/completions
+# vào CAPTURE_DIR (content-addressed). Mặc định tắt trên production (Render).
+# Sample rate 0..1, số request chờ ghi tối đa (queue đầy → bỏ capture), giới hạn size (bytes)
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false" if os.getenv("RENDER") else "true").lower() in ("1", "true", "yes")
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "logs")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 1.0))
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", 32))
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", 20 * 1024 * 1024))
+CAPTURE_MAX_IMAGE_BYTES = int(os.getenv("CAPTURE_MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+
+# HTTP tap (pure ASGI middleware): đếm size/timing của mọi request HTTP (kể cả SSE stream).
+# Sample rate 0..1 cho việc giữ preview payload response (mặc định tắt trên Render),
+# số bytes preview tối đa, số exchange gần nhất giữ lại cho /v1/status
+HTTP_TAP_ENABLED = os.getenv("HTTP_TAP_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_TAP_SAMPLE_RATE = float(os.getenv("HTTP_TAP_SAMPLE_RATE", 0.0 if os.getenv("RENDER") else 1.0))
+HTTP_TAP_PAYLOAD_BYTES = int(os.getenv("HTTP_TAP_PAYLOAD_BYTES", 4096))
+HTTP_TAP_RECENT = int(os.getenv("HTTP_TAP_RECENT", 50))
+
+# Policy chọn tab: first_free | least_latency | power_of_two
+TAB_SCHEDULER_POLICY = os.getenv("TAB_SCHEDULER_POLICY", "least_latency")
+
+# Retry new task sang tab khác khi tab lỗi (TAB_ERROR/COOLING_DOWN/CONNECTION_LOST)
+# Số lần retry tối đa mỗi request, backoff (giây) và giới hạn tổng số retry mỗi phút
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 2))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 4))
+RETRY_RATE_PER_MINUTE = float(os.getenv("RETRY_RATE_PER_MINUTE", 30))
+
+# Hedged requests cho new task: gửi thêm prompt tới tab rảnh thứ 2 nếu tab đầu chậm
+# Bật theo API key (danh sách phân cách bằng dấu phẩy) hoặc header X-ZenEnd-Hedge
+HEDGE_API_KEYS = [key.strip() for key in os.getenv("HEDGE_API_KEYS", "").split(",") if key.strip()]
+HEDGE_LATENCY_PERCENTILE = float(os.getenv("HEDGE_LATENCY_PERCENTILE", 95))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 10))
+# Delay khi chưa đủ số liệu latency
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 60))
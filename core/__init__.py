@@ -1,9 +1,11 @@
 from .port_manager import PortManager
+from .tab_queue import QueueFullError
 from .logger import Logger, debug, info, warning, error, critical, error_response
 from .fake_response import is_fake_mode_enabled, generate_fake_response, FAKE_CONTENT
 
 __all__ = [
     "PortManager",
+    "QueueFullError",
     "Logger",
     "debug",
     "info", 
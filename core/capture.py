@@ -0,0 +1,220 @@
+"""
+Capture pipeline cho request /v1/chat/completions (debug)
+Middleware chỉ enqueue reference tới body (bytes, không copy); 1 worker thread
+parse JSON, decode ảnh và ghi file → event loop không bị block bởi disk I/O
+
+Storage content-addressed (ghi 1 lần cho mỗi nội dung):
+- {CAPTURE_DIR}/system_prompts/system_prompt_<sha256[:16]>.txt
+- {CAPTURE_DIR}/images/image_<sha256[:16]>.<format>
+"""
+import base64
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from core.prompt_cache import prompt_hash
+from config.settings import (
+    CAPTURE_ENABLED, CAPTURE_DIR, CAPTURE_SAMPLE_RATE, CAPTURE_QUEUE_SIZE,
+    CAPTURE_MAX_BODY_BYTES, CAPTURE_MAX_IMAGE_BYTES
+)
+
+
+_DATA_URL_PREFIX = re.compile(r'data:image/([a-zA-Z]+);base64,')
+_STOP = object()
+
+
+class CapturePipeline:
+    """
+    - sample() quyết định trước có giữ body hay không; submit(): non-blocking - bỏ qua
+      body quá lớn, hoặc queue đầy (dropped)
+    - Worker thread khởi động lazily ở lần submit đầu tiên
+    - File được ghi vào tmp rồi os.replace → không có file ghi dở, không ghi đè nội dung khác
+    """
+
+    def __init__(self, root: str = "logs", sample_rate: float = 1.0, queue_size: int = 32,
+                 max_body_bytes: int = 20 * 1024 * 1024, max_image_bytes: int = 10 * 1024 * 1024,
+                 enabled: bool = True):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self.max_image_bytes = max_image_bytes
+        self.enabled = enabled
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "enqueued": 0, "sampled_out": 0, "oversize": 0, "dropped": 0,
+            "processed": 0, "errors": 0,
+            "prompts_stored": 0, "images_stored": 0, "duplicates": 0, "images_oversize": 0
+        }
+
+    def sample(self) -> bool:
+        """Request này có được capture không (gọi trước khi giữ lại body)"""
+        if not self.enabled:
+            return False
+
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.stats["sampled_out"] += 1
+            return False
+        return True
+
+    def accepts_size(self, size: int) -> bool:
+        """Body size (vd: từ Content-Length) còn trong giới hạn capture"""
+        if size > self.max_body_bytes:
+            self.stats["oversize"] += 1
+            return False
+        return True
+
+    def submit(self, body: bytes) -> bool:
+        """
+        Gọi từ event loop sau khi sample() == True. Trả về True nếu body được đưa vào queue.
+        """
+        if not self.enabled or not body:
+            return False
+
+        if not self.accepts_size(len(body)):
+            return False
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(body)
+        except queue.Full:
+            # Worker không theo kịp → bỏ capture, KHÔNG làm chậm request
+            self.stats["dropped"] += 1
+            return False
+
+        self.stats["enqueued"] += 1
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="zenend-capture", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            body = self._queue.get()
+            try:
+                if body is _STOP:
+                    return
+                self._process(body)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[Capture] ❌ Failed to capture request: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _process(self, body: bytes):
+        from core import json_codec
+
+        data = json_codec.loads(body)
+        messages = data.get("messages") if isinstance(data, dict) else None
+        if not isinstance(messages, list):
+            return
+
+        for message in messages:
+            if not isinstance(message, dict):
+                continue
+
+            content = message.get("content", "")
+            if message.get("role") == "system":
+                self._store_system_prompt(content)
+            elif message.get("role") == "user" and isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "image_url":
+                        image_url = item.get("image_url", {})
+                        url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
+                        if isinstance(url, str) and url.startswith("data:image"):
+                            self._store_image(url)
+
+    def _write_once(self, path: str, data: bytes) -> bool:
+        """Ghi file nếu chưa tồn tại (content-addressed → cùng nội dung, cùng path)"""
+        if os.path.exists(path):
+            self.stats["duplicates"] += 1
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+    def _store_system_prompt(self, content):
+        if isinstance(content, list):
+            content = "\n\n".join(
+                item.get("text", "") for item in content
+                if isinstance(item, dict) and item.get("type") == "text"
+            )
+        if not isinstance(content, str) or not content:
+            return
+
+        digest = prompt_hash(content)
+        path = os.path.join(self.root, "system_prompts", f"system_prompt_{digest[:16]}.txt")
+        if os.path.exists(path):
+            self.stats["duplicates"] += 1
+            return
+
+        header = (
+            f"Timestamp: {time.strftime('%Y%m%d_%H%M%S')}\n"
+            f"Length: {len(content)} chars\n"
+            f"Estimated tokens: ~{len(content) // 4}\n"
+            f"\n{'=' * 80}\n\n"
+        ).encode('utf-8')
+        if self._write_once(path, header + content.encode('utf-8')):
+            self.stats["prompts_stored"] += 1
+
+    def _store_image(self, url: str):
+        match = _DATA_URL_PREFIX.match(url)
+        if not match:
+            return
+
+        # base64 dài 4/3 bytes ảnh - bỏ qua ảnh quá lớn trước khi decode
+        if (len(url) - match.end()) * 3 // 4 > self.max_image_bytes:
+            self.stats["images_oversize"] += 1
+            return
+
+        image_bytes = base64.b64decode(url[match.end():])
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        path = os.path.join(self.root, "images", f"image_{digest[:16]}.{match.group(1)}")
+        if self._write_once(path, image_bytes):
+            self.stats["images_stored"] += 1
+
+    def stop(self, timeout: float = 5.0):
+        """Chờ worker xử lý nốt queue rồi dừng (gọi khi shutdown)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "queue_depth": self._queue.qsize()
+        }
+
+
+capture_pipeline = CapturePipeline(
+    root=CAPTURE_DIR,
+    sample_rate=CAPTURE_SAMPLE_RATE,
+    queue_size=CAPTURE_QUEUE_SIZE,
+    max_body_bytes=CAPTURE_MAX_BODY_BYTES,
+    max_image_bytes=CAPTURE_MAX_IMAGE_BYTES,
+    enabled=CAPTURE_ENABLED
+)
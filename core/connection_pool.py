@@ -0,0 +1,227 @@
+"""
+Connection pool cho nhiều ZenTab extension kết nối cùng lúc
+Mỗi connection có tab registry riêng (tabs của browser profile đó)
+"""
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from core import json_codec
+from core.prompt_cache import KnownPrompts
+from core.tab_registry import TabRegistry
+from core.ws_session import ReplayBuffer, stamp_message
+
+
+class ZenTabConnection:
+    """
+    Một WebSocket connection tới ZenTab và state tabs của nó.
+
+    Nếu ZenTab kết nối với sessionId, message gửi đi được đánh msgSeq và giữ
+    trong replay buffer. Khi socket rớt, connection bị "park" (websocket=None)
+    trong grace period; socket mới với cùng sessionId được attach lại vào
+    chính connection này (giữ connection_id, tabs và request đang chạy).
+
+    `capabilities` là các tính năng protocol ZenTab khai báo qua ?capabilities=a,b
+    (vd: promptCache) - server chỉ dùng tính năng mà extension hỗ trợ.
+    """
+
+    def __init__(self, websocket, connection_id: Optional[str] = None,
+                 session_id: Optional[str] = None, replay_buffer_size: int = 200,
+                 capabilities: Optional[Iterable[str]] = None):
+        self.connection_id = connection_id or f"conn_{uuid.uuid4().hex[:8]}"
+        self.websocket = websocket
+        self.connected_at = time.time()
+        self.tab_registry = TabRegistry(self.connection_id)
+
+        self.session_id = session_id
+        self.replay_buffer = ReplayBuffer(replay_buffer_size) if session_id else None
+        # msgSeq lớn nhất đã nhận từ ZenTab (dedupe message gửi lại sau resume)
+        self.inbound_seq = 0
+        self.parked_at: Optional[float] = None
+        self.resume_count = 0
+
+        self.capabilities = set(capabilities or ())
+        # Hash system prompt mà extension đã nhận full text
+        self.known_prompts = KnownPrompts()
+
+    def supports(self, capability: str) -> bool:
+        return capability in self.capabilities
+
+    @property
+    def parked(self) -> bool:
+        return self.parked_at is not None
+
+    def park(self):
+        """Socket rớt nhưng session còn trong grace period - chờ ZenTab resume"""
+        self.websocket = None
+        self.parked_at = time.time()
+        self.tab_registry.stale = True
+
+    def attach(self, websocket):
+        """Gắn socket mới (resume) vào connection đang park"""
+        self.websocket = websocket
+        self.parked_at = None
+        self.resume_count += 1
+
+    def is_open(self) -> bool:
+        """Check state của websocket (FastAPI / websockets library / fallback)"""
+        if self.websocket is None:
+            return False
+        try:
+            if hasattr(self.websocket, 'client_state'):
+                # FastAPI WebSocket
+                from starlette.websockets import WebSocketState
+                return self.websocket.client_state == WebSocketState.CONNECTED
+            elif hasattr(self.websocket, 'closed'):
+                # Standard WebSocket
+                return not self.websocket.closed
+            elif hasattr(self.websocket, 'open'):
+                return self.websocket.open
+            elif hasattr(self.websocket, 'state'):
+                # websockets library
+                from websockets.protocol import State
+                return self.websocket.state == State.OPEN
+            # Fallback: assume open if we have the object
+            return True
+        except Exception:
+            return False
+
+    async def _send_raw(self, text: str):
+        if hasattr(self.websocket, 'send_text'):
+            await self.websocket.send_text(text)
+        else:
+            await self.websocket.send(text)
+
+    async def send_bytes(self, data):
+        """
+        Gửi binary frame (bytes/memoryview - không copy). Không đánh seq/buffer:
+        frame bị lỡ khi socket rớt thì ZenTab tự yêu cầu gửi lại.
+        """
+        if self.websocket is None:
+            return
+
+        try:
+            if hasattr(self.websocket, 'send_bytes'):
+                await self.websocket.send_bytes(data)
+            else:
+                await self.websocket.send(data)
+        except Exception:
+            if self.replay_buffer is None:
+                raise
+
+    async def send_text(self, text: str):
+        """
+        Gửi message. Với session: message được đánh msgSeq và giữ tới khi ack;
+        nếu connection đang park thì chỉ buffer, sẽ được replay khi resume.
+        """
+        if self.replay_buffer is None:
+            await self._send_raw(text)
+            return
+
+        seq = self.replay_buffer.next_seq()
+        text = stamp_message(text, seq)
+        self.replay_buffer.append(seq, text)
+
+        if self.parked:
+            return
+
+        try:
+            await self._send_raw(text)
+        except Exception:
+            # Socket đang rớt - message còn trong buffer, replay khi ZenTab resume
+            pass
+
+    async def send_control(self, message: dict):
+        """Message điều khiển session (ack, sessionReady) - không đánh seq, không buffer"""
+        if self.websocket is not None:
+            await self._send_raw(json_codec.dumps(message))
+
+    def messages_to_replay(self, last_seq: int) -> Optional[List[str]]:
+        """Message ZenTab chưa nhận (msgSeq > last_seq). None nếu buffer đã mất message cần replay."""
+        if self.replay_buffer is None:
+            return []
+        return self.replay_buffer.replay_after(last_seq)
+
+    async def replay(self, messages: List[str]):
+        for text in messages:
+            await self._send_raw(text)
+
+    def accept_inbound(self, seq) -> bool:
+        """Dedupe message ZenTab gửi lại sau resume. True nếu là message mới."""
+        if not isinstance(seq, int):
+            return True
+        if seq <= self.inbound_seq:
+            return False
+        self.inbound_seq = seq
+        return True
+
+    def get_stats(self) -> dict:
+        stats = {
+            "connection_id": self.connection_id,
+            "open": self.is_open(),
+            "connection_age": time.time() - self.connected_at,
+            "tab_registry": self.tab_registry.get_stats()
+        }
+        if self.capabilities:
+            stats["capabilities"] = sorted(self.capabilities)
+            stats["known_prompts"] = len(self.known_prompts)
+        if self.session_id:
+            stats["session"] = {
+                "session_id": self.session_id,
+                "parked": self.parked,
+                "parked_for": time.time() - self.parked_at if self.parked else None,
+                "resume_count": self.resume_count,
+                "inbound_seq": self.inbound_seq,
+                "replay_buffer": self.replay_buffer.get_stats()
+            }
+        return stats
+
+
+class ConnectionPool:
+    """Pool các ZenTab connections, key theo connection_id"""
+
+    def __init__(self):
+        self._connections: Dict[str, ZenTabConnection] = {}
+
+    def add(self, websocket, session_id: Optional[str] = None, replay_buffer_size: int = 200,
+            capabilities: Optional[Iterable[str]] = None) -> ZenTabConnection:
+        connection = ZenTabConnection(
+            websocket, session_id=session_id, replay_buffer_size=replay_buffer_size, capabilities=capabilities
+        )
+        self._connections[connection.connection_id] = connection
+        return connection
+
+    def remove(self, connection_id: str) -> Optional[ZenTabConnection]:
+        return self._connections.pop(connection_id, None)
+
+    def get(self, connection_id: Optional[str]) -> Optional[ZenTabConnection]:
+        if connection_id is None:
+            return None
+        return self._connections.get(connection_id)
+
+    def find_by_websocket(self, websocket) -> Optional[ZenTabConnection]:
+        for connection in self._connections.values():
+            if connection.websocket is websocket:
+                return connection
+        return None
+
+    def find_by_session(self, session_id: Optional[str]) -> Optional[ZenTabConnection]:
+        if not session_id:
+            return None
+        for connection in self._connections.values():
+            if connection.session_id == session_id:
+                return connection
+        return None
+
+    def all(self) -> List[ZenTabConnection]:
+        return list(self._connections.values())
+
+    def active(self) -> List[ZenTabConnection]:
+        """Connections có thể route request tới (bỏ qua connection đang park chờ resume)"""
+        return [connection for connection in self._connections.values() if not connection.parked]
+
+    def open_connections(self) -> List[ZenTabConnection]:
+        return [connection for connection in self._connections.values() if connection.is_open()]
+
+    def __len__(self) -> int:
+        return len(self._connections)
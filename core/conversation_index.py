@@ -0,0 +1,280 @@
+"""
+Conversation index - preprocess messages của Cline trong 1 lượt duyệt
+(folder path, new task, system prompt, user prompt cuối, images)
+
+Cline gửi lại toàn bộ history mỗi lượt → index được cache theo prefix messages; lượt sau
+chỉ hash và xử lý các message mới được nối thêm (không hash lại toàn bộ history).
+"""
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from core import json_codec
+
+
+FOLDER_PATTERN = re.compile(r'# Current Working Directory \(([^)]+)\)')
+IMAGE_PLACEHOLDER = "[IMAGE - Not supported]"
+DIGEST_SIZE = 16
+
+
+def message_field(message, name: str):
+    """role/content của message - dict (fast path, chưa validate) hoặc Pydantic Message"""
+    if isinstance(message, dict):
+        return message.get(name)
+    return getattr(message, name, None)
+
+
+def _iter_texts(content):
+    if isinstance(content, str):
+        yield content
+    elif isinstance(content, list):
+        for item in content:
+            if isinstance(item, dict) and item.get("type") == "text" and isinstance(item.get("text"), str):
+                yield item["text"]
+
+
+def _flatten_text(content) -> str:
+    """Nội dung text của message (list content → các phần text nối bằng dòng trống)"""
+    if isinstance(content, str):
+        return content
+    return "\n\n".join(_iter_texts(content))
+
+
+def _iter_image_urls(content):
+    """Data URL base64 của các phần image_url trong content"""
+    if not isinstance(content, list):
+        return
+    for item in content:
+        if not isinstance(item, dict) or item.get("type") != "image_url":
+            continue
+        image_url = item.get("image_url", {})
+        url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
+        if isinstance(url, str) and url.startswith("data:image"):
+            yield url
+
+
+def _flatten_user_prompt(content) -> str:
+    """Như _flatten_text nhưng giữ chỗ cho ảnh kiểu "image" (không hỗ trợ)"""
+    if not isinstance(content, list):
+        return content if isinstance(content, str) else ""
+
+    text_parts = []
+    for item in content:
+        if isinstance(item, dict):
+            if item.get("type") == "text":
+                text = item.get("text", "")
+                if isinstance(text, str):
+                    text_parts.append(text)
+            elif item.get("type") == "image":
+                text_parts.append(IMAGE_PLACEHOLDER)
+    return "\n\n".join(text_parts)
+
+
+def _has_task(text: str) -> bool:
+    """<task>...</task> không rỗng (tag mở đầu tiên, tag đóng đầu tiên)"""
+    start = text.find('<task>')
+    if start == -1:
+        return False
+    end = text.find('</task>')
+    if end == -1 or end <= start + 6:
+        return False
+    return bool(text[start + 6:end].strip())
+
+
+def detect_new_task(message) -> bool:
+    """Message (cuối cùng) có <task></task> không rỗng → task mới"""
+    content = message_field(message, 'content')
+    if isinstance(content, str):
+        return _has_task(content)
+    return any(_has_task(text) for text in _iter_texts(content)) if isinstance(content, list) else False
+
+
+def message_digest(message) -> bytes:
+    """
+    Digest nội dung 1 message: blake2b của [role, content] đã encode JSON.
+    Không phụ thuộc kiểu của các phần trong content (text/url lỗi kiểu vẫn hash được).
+    """
+    payload = [message_field(message, 'role'), message_field(message, 'content')]
+    try:
+        encoded = json_codec.dumps_bytes(payload)
+    except (TypeError, ValueError):
+        encoded = repr(payload).encode('utf-8', errors='replace')
+    return hashlib.blake2b(encoded, digest_size=DIGEST_SIZE).digest()
+
+
+class ConversationIndex:
+    """Kết quả preprocess của 1 prefix messages"""
+
+    def __init__(self):
+        self.message_count = 0
+        self.folder_path: Optional[str] = None
+        self.system_prompt = ""
+        self.system_count = 0
+        self.user_count = 0
+        self.last_user_text = ""
+        self.is_new_task = False
+        # Digest các ảnh theo thứ tự xuất hiện trong hội thoại. Chỉ giữ digest, bytes ảnh
+        # nằm trong ImageCache (LRU có giới hạn) → resolve_images() lúc gửi
+        self.image_digests: List[str] = []
+
+    def copy(self) -> "ConversationIndex":
+        index = ConversationIndex()
+        index.__dict__.update(self.__dict__)
+        index.image_digests = list(self.image_digests)
+        return index
+
+
+# (số message của prefix, digest message đầu, digest message cuối của prefix)
+PrefixKey = Tuple[int, bytes, bytes]
+
+
+class ConversationIndexCache:
+    """
+    LRU prefix key → ConversationIndex.
+
+    History của Cline chỉ được nối thêm; condense/restore checkpoint làm đổi số message
+    → prefix được nhận diện bằng số message + digest (blake2b 128-bit) của message đầu
+    (system prompt) và message cuối của prefix, không phải hash lại cả history mỗi lượt.
+
+    build(messages): tìm prefix dài nhất đã có index, copy index đó rồi chỉ xử lý
+    các message phía sau. Lượt kế tiếp của cùng hội thoại (history + assistant + user)
+    khớp prefix của lượt trước nên chỉ phải hash/xử lý 2 message mới.
+    """
+
+    def __init__(self, image_cache, max_entries: int = 128):
+        self.image_cache = image_cache
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[PrefixKey, ConversationIndex]" = OrderedDict()
+        # Số message của prefix → số entry (chỉ thử các độ dài đang có trong cache)
+        self._lengths: Dict[int, int] = {}
+
+        self.stats = {"builds": 0, "prefix_hits": 0, "messages_processed": 0, "messages_reused": 0,
+                      "images_reinterned": 0}
+
+    def _index_message(self, index: ConversationIndex, message):
+        role = message_field(message, 'role')
+        content = message_field(message, 'content')
+
+        if role == "system":
+            if index.system_count == 0:
+                index.system_prompt = _flatten_text(content)
+            index.system_count += 1
+        elif role == "user":
+            index.user_count += 1
+
+        if index.folder_path is None:
+            for text in _iter_texts(content):
+                match = FOLDER_PATTERN.search(text)
+                if match and match.group(1).strip():
+                    index.folder_path = match.group(1).strip()
+                    break
+
+        for image in self._intern_images(content):
+            index.image_digests.append(image.digest)
+
+    def _intern_images(self, content):
+        for url in _iter_image_urls(content):
+            try:
+                image = self.image_cache.intern(url)
+            except Exception as e:
+                from core import warning
+                warning(
+                    "Failed to decode image in message",
+                    {"error": str(e), "error_type": type(e).__name__}
+                )
+                continue
+            if image is not None:
+                yield image
+
+    def resolve_images(self, index: ConversationIndex, messages: List) -> list:
+        """
+        ImageAttachment của index (theo thứ tự). Ảnh đã bị ImageCache evict → decode lại
+        từ chính messages của request (messages là nội dung đã tạo ra index).
+        """
+        images = []
+        for digest in index.image_digests:
+            image = self.image_cache.get(digest)
+            if image is None:
+                self.stats["images_reinterned"] += 1
+                return [
+                    image
+                    for message in messages or []
+                    for image in self._intern_images(message_field(message, 'content'))
+                ]
+            images.append(image)
+        return images
+
+    def build(self, messages: List) -> ConversationIndex:
+        self.stats["builds"] += 1
+        messages = messages or []
+
+        # Mỗi message được hash tối đa 1 lần trong 1 lần build
+        digests: Dict[int, bytes] = {}
+
+        def prefix_key(length: int) -> PrefixKey:
+            for position in (0, length - 1):
+                if position not in digests:
+                    digests[position] = message_digest(messages[position])
+            return (length, digests[0], digests[length - 1])
+
+        # Prefix dài nhất đã có index (thường là toàn bộ history của lượt trước)
+        base = None
+        start = 0
+        for length in sorted(self._lengths, reverse=True):
+            if length > len(messages):
+                continue
+            key = prefix_key(length)
+            base = self._entries.get(key)
+            if base is not None:
+                start = length
+                self._entries.move_to_end(key)
+                break
+
+        if base is not None:
+            self.stats["prefix_hits"] += 1
+            self.stats["messages_reused"] += start
+            if start == len(messages):
+                return base
+            index = base.copy()
+        else:
+            index = ConversationIndex()
+
+        last_user = None
+        for message in messages[start:]:
+            try:
+                self._index_message(index, message)
+            except Exception as e:
+                from core import warning
+                warning(
+                    "Failed to index message",
+                    {"error": str(e), "error_type": type(e).__name__}
+                )
+            if message_field(message, 'role') == "user":
+                last_user = message
+
+        self.stats["messages_processed"] += len(messages) - start
+
+        if last_user is not None:
+            index.last_user_text = _flatten_user_prompt(message_field(last_user, 'content'))
+        index.is_new_task = detect_new_task(messages[-1]) if messages else False
+        index.message_count = len(messages)
+
+        if messages:
+            key = prefix_key(len(messages))
+            if key not in self._entries:
+                self._lengths[len(messages)] = self._lengths.get(len(messages), 0) + 1
+            self._entries[key] = index
+            while len(self._entries) > self.max_entries:
+                (length, _, _), _ = self._entries.popitem(last=False)
+                self._lengths[length] -= 1
+                if not self._lengths[length]:
+                    del self._lengths[length]
+
+        return index
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self._entries)
+        }
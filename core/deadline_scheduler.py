@@ -0,0 +1,175 @@
+"""
+Deadline scheduler - 1 background task phục vụ mọi deadline theo request
+Thay cho việc mỗi request tự create_task(asyncio.sleep(...)) để dọn dẹp
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+DeadlineKey = Tuple[str, str]
+
+
+class DeadlineScheduler:
+    """
+    Min-heap các deadline (when, generation, key) + dict key → deadline hiện tại.
+
+    Key là (request_id, name) nên 1 request có thể có nhiều loại deadline
+    (vd: "in_progress", "cleanup"). Đăng ký lại cùng key sẽ thay deadline cũ;
+    entry cũ trong heap bị bỏ qua khi tới hạn (lazy delete).
+
+    Callback là hàm sync, chạy trên event loop theo đúng thứ tự deadline.
+    `run_due()` có thể gọi trực tiếp (không cần background task) để test.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._heap: List[Tuple[float, int, DeadlineKey]] = []
+        self._deadlines: Dict[DeadlineKey, Tuple[float, int, Callable[[], None]]] = {}
+        self._by_request: Dict[str, Set[str]] = {}
+        self._generation = itertools.count()
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.fired_count = 0
+
+    def schedule(self, request_id: str, delay: float, callback: Callable[[], None], name: str = "cleanup"):
+        """Đăng ký (hoặc thay) deadline `name` của request sau `delay` giây"""
+        key = (request_id, name)
+        when = self._clock() + delay
+        generation = next(self._generation)
+
+        self._deadlines[key] = (when, generation, callback)
+        self._by_request.setdefault(request_id, set()).add(name)
+        heapq.heappush(self._heap, (when, generation, key))
+
+        # Deadline mới sớm hơn deadline background task đang chờ → đánh thức để tính lại
+        if self._heap[0][1] == generation and self._wakeup is not None:
+            self._wakeup.set()
+
+        self._ensure_running()
+
+    def cancel(self, request_id: str, name: Optional[str] = None) -> int:
+        """Huỷ 1 deadline (hoặc tất cả nếu name=None) của request. Trả về số deadline bị huỷ."""
+        names = self._by_request.get(request_id)
+        if not names:
+            return 0
+
+        targets = list(names) if name is None else [name] if name in names else []
+        for target in targets:
+            self._deadlines.pop((request_id, target), None)
+            names.discard(target)
+
+        if not names:
+            self._by_request.pop(request_id, None)
+
+        return len(targets)
+
+    def has_deadline(self, request_id: str, name: str = "cleanup") -> bool:
+        return (request_id, name) in self._deadlines
+
+    def _pop_deadline(self, key: DeadlineKey):
+        self._deadlines.pop(key, None)
+        names = self._by_request.get(key[0])
+        if names is not None:
+            names.discard(key[1])
+            if not names:
+                self._by_request.pop(key[0], None)
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Chạy mọi callback đã tới hạn. Trả về số callback đã chạy."""
+        now = self._clock() if now is None else now
+        fired = 0
+
+        while self._heap and self._heap[0][0] <= now:
+            when, generation, key = heapq.heappop(self._heap)
+            deadline = self._deadlines.get(key)
+            if deadline is None or deadline[1] != generation:
+                continue
+
+            self._pop_deadline(key)
+            fired += 1
+
+            try:
+                deadline[2]()
+            except Exception as e:
+                from core import error
+                error(
+                    "Deadline callback failed",
+                    {"request_id": key[0], "deadline": key[1], "error": str(e)},
+                    show_traceback=True
+                )
+
+        # Heap chứa nhiều entry đã bị huỷ/thay → rebuild
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [
+                item for item in self._heap
+                if self._deadlines.get(item[2], (None, None))[1] == item[1]
+            ]
+            heapq.heapify(self._heap)
+
+        self.fired_count += fired
+        return fired
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap:
+            when, generation, key = self._heap[0]
+            deadline = self._deadlines.get(key)
+            if deadline is not None and deadline[1] == generation:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def _ensure_running(self):
+        if self._task is not None and not self._task.done():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Không có event loop (vd: gọi từ code sync/test) - caller tự gọi run_due()
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self.run_due()
+
+            next_when = self.next_deadline()
+            if next_when is None:
+                # Hết deadline → dừng task, schedule() kế tiếp sẽ khởi động lại
+                self._task = None
+                return
+
+            timeout = max(next_when - self._clock(), 0.0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def get_stats(self) -> dict:
+        next_when = self.next_deadline()
+        return {
+            "pending": len(self._deadlines),
+            "heap_size": len(self._heap),
+            "fired": self.fired_count,
+            "next_in": next_when - self._clock() if next_when is not None else None
+        }
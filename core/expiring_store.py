@@ -0,0 +1,119 @@
+"""
+Expiring store - dict có TTL cho từng entry và giới hạn số entry cứng
+Dùng cho state ngắn hạn của request (dedupe, in-progress, log) thay cho các dict tự dọn
+"""
+import heapq
+import itertools
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+_MISSING = object()
+
+
+class ExpiringStore:
+    """
+    Key → value với thời điểm hết hạn riêng.
+
+    - `_entries`: key → (value, expires_at, generation) - lookup O(1)
+    - `_heap`: (expires_at, generation, key) - entry hết hạn sớm nhất ở đầu
+
+    Ghi đè/gia hạn 1 key chỉ push entry mới vào heap; entry cũ trong heap bị
+    bỏ qua khi pop (so sánh generation) và heap được compact khi phình quá lớn.
+    Entry hết hạn được dọn dần mỗi lần ghi (amortized), không cần task nền.
+    Khi vượt `max_entries` thì entry sắp hết hạn nhất bị loại trước.
+    """
+
+    def __init__(self, default_ttl: float, max_entries: int = 10000):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+
+        self._entries: Dict[Hashable, Tuple[Any, float, int]] = {}
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._generation = itertools.count()
+
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    def _is_current(self, heap_entry: Tuple[float, int, Hashable]) -> bool:
+        entry = self._entries.get(heap_entry[2])
+        return entry is not None and entry[2] == heap_entry[1]
+
+    def set(self, key: Hashable, value: Any = True, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        generation = next(self._generation)
+
+        self._entries[key] = (value, expires_at, generation)
+        heapq.heappush(self._heap, (expires_at, generation, key))
+
+        self.expire(now)
+
+        while len(self._entries) > self.max_entries:
+            expires_at, generation, evict_key = heapq.heappop(self._heap)
+            if self._entries.get(evict_key, (None, None, None))[2] == generation:
+                del self._entries[evict_key]
+                self.evicted_count += 1
+
+        # Heap chứa nhiều entry cũ (do ghi đè/pop) → rebuild
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for item in self._heap if self._is_current(item)]
+            heapq.heapify(self._heap)
+
+    def touch(self, key: Hashable, ttl: Optional[float] = None) -> bool:
+        """Gia hạn entry còn sống. Trả về False nếu key không tồn tại/đã hết hạn."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        if entry[1] <= time.time():
+            del self._entries[key]
+            self.expired_count += 1
+            return default
+
+        return entry[0]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[1] <= time.time():
+            return default
+        return entry[0]
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Xoá các entry đã hết hạn ở đầu heap. Trả về số entry bị xoá."""
+        now = time.time() if now is None else now
+        removed = 0
+
+        while self._heap and self._heap[0][0] <= now:
+            heap_entry = heapq.heappop(self._heap)
+            if self._is_current(heap_entry):
+                del self._entries[heap_entry[2]]
+                removed += 1
+
+        self.expired_count += removed
+        return removed
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "heap_size": len(self._heap),
+            "max_entries": self.max_entries,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count
+        }
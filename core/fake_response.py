@@ -1,6 +1,7 @@
 import time
 import uuid
-import json
+
+from core import json_codec
 
 ENABLE_FAKE_RESPONSE = False
 
@@ -72,5 +73,5 @@ async def generate_fake_response():
     }
     
     # Yield SSE formatted chunks
-    yield f"data: {json.dumps(fake_response)}\n\n".encode('utf-8')
+    yield b"data: " + json_codec.dumps_bytes(fake_response) + b"\n\n"
     yield "data: [DONE]\n\n".encode('utf-8')
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+Image cache - dedupe ảnh giữa các lượt hội thoại
+Cline gửi lại toàn bộ history (kèm mọi ảnh base64) mỗi request, nhưng tab DeepSeek
+đã có các ảnh cũ trong cuộc hội thoại → chỉ forward ảnh tab chưa nhận
+
+Binary attachments (chỉ khi ZenTab kết nối với ?capabilities=binaryAttachments):
+- Ảnh được gửi thành binary WebSocket frame riêng TRƯỚC sendPrompt:
+  b"ZATT" + 1 byte độ dài attachmentId + attachmentId (ascii) + bytes ảnh đã decode
+- sendPrompt chỉ tham chiếu: {"type": "image_url", "format", "attachmentId", "size"}
+- ZenTab thiếu attachment (vd: replay sau resume): gửi {"type": "unknownAttachment",
+  "requestId", "attachmentId"} → server gửi lại frame
+"""
+import binascii
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+
+TabKey = Tuple[str, int]
+
+BINARY_ATTACHMENTS_CAPABILITY = "binaryAttachments"
+ATTACHMENT_MAGIC = b"ZATT"
+
+_DATA_URL_PREFIX = re.compile(r'data:image/([a-zA-Z]+);base64,')
+# sha256 hex
+ATTACHMENT_ID_SIZE = 64
+HEADER_SIZE = len(ATTACHMENT_MAGIC) + 1 + ATTACHMENT_ID_SIZE
+# Số ký tự base64 mỗi lần decode (bội của 4) - bản copy tạm chỉ lớn cỡ 1 chunk
+DECODE_CHUNK = 1024 * 1024
+
+
+def _decode_chunks(url: str, offset: int) -> Optional[bytearray]:
+    """
+    Decode base64 chuẩn theo từng chunk thẳng vào frame cấp phát sẵn (HEADER_SIZE byte
+    đầu để trống). None nếu base64 không chuẩn (xuống dòng, ký tự lạ, thiếu padding).
+    """
+    encoded_size = len(url) - offset
+    if encoded_size % 4:
+        return None
+
+    padding = 2 if url.endswith("==") else 1 if url.endswith("=") else 0
+    frame = bytearray(HEADER_SIZE + encoded_size // 4 * 3 - padding)
+    position = HEADER_SIZE
+    try:
+        for chunk_start in range(offset, len(url), DECODE_CHUNK):
+            piece = binascii.a2b_base64(url[chunk_start:chunk_start + DECODE_CHUNK])
+            if position + len(piece) > len(frame):
+                return None
+            frame[position:position + len(piece)] = piece
+            position += len(piece)
+    except binascii.Error:
+        return None
+
+    # Ký tự bị a2b_base64 bỏ qua làm lệch độ dài → decode lại kiểu thường
+    return frame if position == len(frame) else None
+
+
+def _decode_into_frame(url: str, offset: int) -> bytearray:
+    """Frame chứa bytes ảnh từ vị trí HEADER_SIZE (header được ghi sau khi có digest)"""
+    frame = _decode_chunks(url, offset)
+    if frame is None:
+        # Base64 lạ - a2b_base64 tự xử lý / raise binascii.Error như trước
+        frame = bytearray(HEADER_SIZE)
+        frame += binascii.a2b_base64(url[offset:])
+    return frame
+
+
+class ImageAttachment:
+    """
+    1 ảnh đã decode. Frame binary (header + bytes ảnh) là bản duy nhất của ảnh trong
+    memory: các lần gửi binary dùng memoryview của frame, format inline encode lại từ frame.
+    Không giữ data URL gốc.
+    """
+
+    __slots__ = ("format", "digest", "frame", "header_size")
+
+    def __init__(self, image_format: str, url: str, offset: int):
+        self.format = image_format
+
+        frame = _decode_into_frame(url, offset)
+        view = memoryview(frame)
+        self.digest = hashlib.sha256(view[HEADER_SIZE:]).hexdigest()
+
+        attachment_id = self.digest.encode('ascii')
+        frame[:HEADER_SIZE] = ATTACHMENT_MAGIC + bytes([len(attachment_id)]) + attachment_id
+        self.header_size = HEADER_SIZE
+        self.frame = view
+
+    @property
+    def size(self) -> int:
+        return len(self.frame) - self.header_size
+
+    @property
+    def base64_size(self) -> int:
+        return (self.size + 2) // 3 * 4
+
+    def to_inline(self) -> dict:
+        """Format cũ: base64 nằm trong JSON (encode từ frame khi connection cần)"""
+        data = binascii.b2a_base64(self.frame[self.header_size:], newline=False).decode('ascii')
+        return {"type": "image_url", "format": self.format, "data": data, "hash": self.digest}
+
+    def to_reference(self) -> dict:
+        """Tham chiếu tới binary frame gửi kèm"""
+        return {"type": "image_url", "format": self.format, "attachmentId": self.digest, "size": self.size}
+
+
+def url_key(url: str) -> bytes:
+    """Key cache của data URL (không giữ reference tới chuỗi base64 trong cache)"""
+    return hashlib.sha256(url.encode('utf-8', errors='surrogatepass')).digest()
+
+
+class ImageCache:
+    """
+    - LRU sha256(data URL) → ImageAttachment (đã decode + hash sha256 nội dung ảnh), để lượt sau
+      không phải decode/hash lại các ảnh cũ trong history
+    - Mỗi tab giữ tập hash đã nhận. Chỉ ghi nhận khi tab trả lời thành công (commit),
+      request lỗi/cancel thì lượt sau gửi lại
+    - New task = cuộc hội thoại mới trên tab → tab cần lại toàn bộ ảnh
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._images: "OrderedDict[bytes, ImageAttachment]" = OrderedDict()
+        self._by_digest: Dict[str, ImageAttachment] = {}
+        self._tab_images: Dict[TabKey, Set[str]] = {}
+        # request_id → (tab, hash đã gửi, new_task)
+        self._pending: Dict[str, Tuple[TabKey, List[str], bool]] = {}
+
+        self.stats = {
+            "extracted": 0, "cache_hits": 0, "sent": 0, "skipped": 0, "bytes_saved": 0,
+            "binary_frames": 0, "resent": 0
+        }
+
+    def intern(self, url: str) -> Optional[ImageAttachment]:
+        """ImageAttachment của data URL - dùng lại entry cũ nếu đã thấy ảnh này. None nếu không phải ảnh base64."""
+        key = url_key(url)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            self.stats["extracted"] += 1
+            self.stats["cache_hits"] += 1
+            return image
+
+        # Chỉ match phần prefix - không copy phần base64 như regex (.+)
+        match = _DATA_URL_PREFIX.match(url)
+        if not match or match.end() >= len(url):
+            return None
+
+        image = ImageAttachment(match.group(1), url, match.end())
+        self.stats["extracted"] += 1
+
+        self._images[key] = image
+        self._by_digest[image.digest] = image
+        while len(self._images) > self.max_entries:
+            _, evicted = self._images.popitem(last=False)
+            if self._by_digest.get(evicted.digest) is evicted:
+                self._by_digest.pop(evicted.digest, None)
+        return image
+
+    def get(self, digest: str) -> Optional[ImageAttachment]:
+        return self._by_digest.get(digest)
+
+    def select_new(self, tab_key: TabKey, images: List[ImageAttachment], new_task: bool) -> List[ImageAttachment]:
+        """Ảnh cần gửi cho tab ở lượt này (tab chưa nhận, bỏ trùng trong cùng request)"""
+        known = set() if new_task else self._tab_images.get(tab_key, set())
+        selected = []
+        seen = set()
+
+        for image in images:
+            if image.digest in known or image.digest in seen:
+                self.stats["skipped"] += 1
+                self.stats["bytes_saved"] += image.base64_size
+                continue
+            seen.add(image.digest)
+            selected.append(image)
+
+        return selected
+
+    def record_sent(self, request_id: str, tab_key: TabKey, images: List[ImageAttachment], new_task: bool):
+        """Prompt đã gửi tới tab - chờ commit khi tab trả lời thành công"""
+        self.stats["sent"] += len(images)
+        self._pending[request_id] = (tab_key, [image.digest for image in images], new_task)
+
+    def commit(self, request_id: str):
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return
+
+        tab_key, digests, new_task = pending
+        if new_task:
+            self._tab_images[tab_key] = set(digests)
+        else:
+            self._tab_images.setdefault(tab_key, set()).update(digests)
+
+    def discard(self, request_id: str):
+        self._pending.pop(request_id, None)
+
+    def forget_connection(self, connection_id: str):
+        for key in [key for key in self._tab_images if key[0] == connection_id]:
+            self._tab_images.pop(key, None)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self._images),
+            "cached_bytes": sum(image.size for image in self._images.values()),
+            "tabs": len(self._tab_images),
+            "pending": len(self._pending)
+        }
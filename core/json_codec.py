@@ -0,0 +1,117 @@
+"""
+JSON codec dùng chung cho request path và WebSocket path
+Tự chọn backend nhanh nhất đang cài: orjson → msgspec → stdlib json
+(ép backend bằng env JSON_CODEC=orjson|msgspec|json)
+
+Mọi backend cho cùng output dạng compact, UTF-8 (không escape non-ASCII).
+- dumps(obj) -> str: cho WebSocket text frame
+- dumps_bytes(obj) -> bytes: cho SSE/HTTP body (bỏ qua bước str → bytes)
+- loads(str | bytes)
+- DecodeError: exception khi parse lỗi (subclass ValueError ở mọi backend - lỗi của
+  msgspec được bọc lại thành MsgspecDecodeError)
+"""
+import json
+from typing import Callable, Dict, Optional
+
+from config.settings import JSON_CODEC
+
+
+class JsonBackend:
+    def __init__(self, name: str, dumps: Callable, dumps_bytes: Callable, loads: Callable, decode_error: type):
+        self.name = name
+        self.dumps = dumps
+        self.dumps_bytes = dumps_bytes
+        self.loads = loads
+        self.decode_error = decode_error
+
+
+def _orjson_backend() -> Optional[JsonBackend]:
+    try:
+        import orjson
+    except ImportError:
+        return None
+
+    # stdlib tự đổi key int/float thành string → giữ hành vi đó
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, option=option)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, option=option).decode('utf-8')
+
+    return JsonBackend("orjson", dumps, dumps_bytes, orjson.loads, orjson.JSONDecodeError)
+
+
+class MsgspecDecodeError(ValueError):
+    """msgspec.DecodeError không kế thừa ValueError → bọc lại cho giống orjson/stdlib"""
+
+
+def _msgspec_backend() -> Optional[JsonBackend]:
+    try:
+        import msgspec
+    except ImportError:
+        return None
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj) -> str:
+        return encoder.encode(obj).decode('utf-8')
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise MsgspecDecodeError(str(e)) from e
+
+    return JsonBackend("msgspec", dumps, encoder.encode, loads, MsgspecDecodeError)
+
+
+def _stdlib_backend() -> JsonBackend:
+    encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def dumps_bytes(obj) -> bytes:
+        return encoder.encode(obj).encode('utf-8')
+
+    return JsonBackend("json", encoder.encode, dumps_bytes, json.loads, json.JSONDecodeError)
+
+
+_FACTORIES: Dict[str, Callable[[], Optional[JsonBackend]]] = {
+    "orjson": _orjson_backend,
+    "msgspec": _msgspec_backend,
+    "json": _stdlib_backend
+}
+
+
+def available_backends() -> Dict[str, JsonBackend]:
+    backends = {}
+    for name, factory in _FACTORIES.items():
+        backend = factory()
+        if backend is not None:
+            backends[name] = backend
+    return backends
+
+
+def select_backend(preferred: str = "auto") -> JsonBackend:
+    """Backend theo JSON_CODEC; backend được chọn nhưng chưa cài → fallback theo thứ tự auto"""
+    if preferred in _FACTORIES:
+        backend = _FACTORIES[preferred]()
+        if backend is not None:
+            return backend
+
+    for factory in (_orjson_backend, _msgspec_backend):
+        backend = factory()
+        if backend is not None:
+            return backend
+    return _stdlib_backend()
+
+
+backend = select_backend(JSON_CODEC)
+
+BACKEND_NAME = backend.name
+dumps = backend.dumps
+dumps_bytes = backend.dumps_bytes
+loads = backend.loads
+DecodeError = backend.decode_error
+
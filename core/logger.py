@@ -1,17 +1,28 @@
 """
 Logger với color và format chuẩn cho ZenEnd
 Hỗ trợ cả log console và log response (Cline API format)
+
+Record được đẩy vào queue và 1 background thread format + ghi stdout theo batch
+→ request path không bao giờ block vì print/flush. Level dưới LOG_LEVEL bị bỏ ngay
+từ đầu (không lấy frame, không format).
 """
+import atexit
 import os
+import queue
 import sys
 import json
+import threading
 import time
 import uuid
 import traceback
+from types import CodeType
 from typing import Optional, Dict, Any
 from pathlib import Path
 from enum import Enum
 
+from core import json_codec
+from config.settings import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE
+
 
 # Toggle để bật/tắt log
 ENABLE_LOGGING = True  # Set False để tắt toàn bộ log
@@ -26,6 +37,106 @@ class LogLevel(Enum):
     CRITICAL = ("CRITICAL", "\033[35m") # Magenta
 
 
+LEVEL_RANKS = {
+    LogLevel.DEBUG: 10,
+    LogLevel.INFO: 20,
+    LogLevel.WARNING: 30,
+    LogLevel.ERROR: 40,
+    LogLevel.CRITICAL: 50
+}
+
+
+def _min_rank(level_name: str) -> int:
+    if not ENABLE_LOGGING or level_name == "OFF":
+        return 100
+    for level, rank in LEVEL_RANKS.items():
+        if level.value[0] == level_name:
+            return rank
+    return LEVEL_RANKS[LogLevel.DEBUG]
+
+
+MIN_RANK = _min_rank(LOG_LEVEL)
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# code object → path tương đối của file (resolve 1 lần cho mỗi code object)
+_caller_paths: Dict[CodeType, str] = {}
+
+
+class _LogWriter:
+    """
+    Queue record + daemon thread ghi ra stdout.
+    Record: (created, level, message, metadata, filepath, lineno, exc_info, payload)
+    """
+
+    def __init__(self, log_format: str = "console", max_size: int = 10000):
+        self.log_format = log_format
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, record: tuple):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="zenend-logger", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # Gom các record đang chờ → 1 lần write + flush
+            while len(records) < 256:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(records)
+            for _ in records:
+                self._queue.task_done()
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                if self.log_format == "json":
+                    lines.append(Logger._format_json(record))
+                else:
+                    lines.append(Logger._format_console(record))
+            except Exception as e:
+                lines.append(f"[LOGGER] Failed to format record: {e}")
+
+        if self.dropped:
+            lines.append(f"[LOGGER] Dropped {self.dropped} log record(s) (queue full)")
+            self.dropped = 0
+
+        try:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+        except Exception:
+            pass
+
+    def flush(self, timeout: float = 2.0):
+        """Chờ ghi hết queue (gọi khi thoát process)"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+_writer = _LogWriter(LOG_FORMAT, LOG_QUEUE_SIZE)
+atexit.register(_writer.flush)
+
+
 class Logger:
     """Logger với color và format chuẩn"""
     
@@ -33,24 +144,29 @@ class Logger:
     BOLD = "\033[1m"
     DIM = "\033[2m"
     
+    @staticmethod
+    def is_enabled(level: LogLevel) -> bool:
+        return LEVEL_RANKS[level] >= MIN_RANK
+    
     @staticmethod
     def _get_caller_info() -> tuple[str, int]:
-        """Lấy thông tin file và line number của caller"""
+        """Lấy thông tin file và line number của caller (path cache theo code object)"""
         try:
             # Lấy stack frame (bỏ qua internal frames)
             frame = sys._getframe(3)  # Skip: _log -> debug/info/error -> caller
+            code = frame.f_code
             
-            filepath = frame.f_code.co_filename
-            lineno = frame.f_lineno
+            filepath = _caller_paths.get(code)
+            if filepath is None:
+                # Convert sang relative path từ project root
+                try:
+                    filepath = str(Path(code.co_filename).relative_to(PROJECT_ROOT))
+                except ValueError:
+                    # Nếu không relative được, trả về basename
+                    filepath = os.path.basename(code.co_filename)
+                _caller_paths[code] = filepath
             
-            # Convert sang relative path từ project root
-            try:
-                project_root = Path(__file__).parent.parent
-                rel_path = Path(filepath).relative_to(project_root)
-                return str(rel_path), lineno
-            except ValueError:
-                # Nếu không relative được, trả về basename
-                return os.path.basename(filepath), lineno
+            return filepath, frame.f_lineno
                 
         except Exception:
             return "unknown", 0
@@ -77,20 +193,11 @@ class Logger:
             return str(metadata)
     
     @staticmethod
-    def _log(
-        level: LogLevel,
-        message: str,
-        metadata: Optional[Dict[str, Any]] = None,
-        show_traceback: bool = False
-    ):
-        """Internal log function"""
-        if not ENABLE_LOGGING:
-            return
-        
+    def _format_console(record: tuple) -> str:
+        """Format: [LEVEL] [file:line] message metadata (+ traceback, + payload)"""
+        _, level, message, metadata, filepath, lineno, exc_info, payload = record
         level_name, level_color = level.value
-        filepath, lineno = Logger._get_caller_info()
         
-        # Format: [LEVEL] [file:line] message metadata
         log_parts = [
             f"{level_color}{Logger.BOLD}[{level_name}]{Logger.RESET}",
             f"{Logger.DIM}[{filepath}:{lineno}]{Logger.RESET}",
@@ -102,13 +209,76 @@ class Logger:
             if meta_str:
                 log_parts.append(f"{Logger.DIM}{meta_str}{Logger.RESET}")
         
-        print(" ".join(log_parts), flush=True)
+        line = " ".join(log_parts)
         
         # Hiển thị traceback nếu được yêu cầu
+        if exc_info is not None:
+            tb_lines = "".join(traceback.format_exception(*exc_info))
+            line += f"\n{Logger.DIM}{tb_lines}{Logger.RESET}"
+        
+        if payload is not None:
+            line += (
+                f"\n{Logger.BOLD}{'='*80}{Logger.RESET}\n"
+                f"{json.dumps(payload, indent=2, ensure_ascii=False)}\n"
+                f"{Logger.BOLD}{'='*80}{Logger.RESET}"
+            )
+        
+        return line
+    
+    @staticmethod
+    def _format_json(record: tuple) -> str:
+        """1 JSON object / dòng"""
+        created, level, message, metadata, filepath, lineno, exc_info, payload = record
+        
+        entry = {
+            "ts": round(created, 3),
+            "level": level.value[0],
+            "file": filepath,
+            "line": lineno,
+            "message": message
+        }
+        if metadata:
+            entry["metadata"] = {
+                str(key): value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+                for key, value in metadata.items()
+            }
+        if exc_info is not None:
+            entry["traceback"] = "".join(traceback.format_exception(*exc_info))
+        if payload is not None:
+            entry["payload"] = payload
+        
+        return json_codec.dumps(entry)
+    
+    @staticmethod
+    def _log(
+        level: LogLevel,
+        message: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        show_traceback: bool = False,
+        payload: Any = None
+    ):
+        """Internal log function - chỉ lấy caller + snapshot rồi enqueue, format ở writer thread"""
+        if LEVEL_RANKS[level] < MIN_RANK:
+            return
+        
+        filepath, lineno = Logger._get_caller_info()
+        
+        exc_info = None
         if show_traceback:
-            tb_lines = traceback.format_exc()
-            if tb_lines and "NoneType: None" not in tb_lines:
-                print(f"{Logger.DIM}{tb_lines}{Logger.RESET}", flush=True)
+            exc_info = sys.exc_info()
+            if exc_info[0] is None:
+                exc_info = None
+        
+        _writer.submit((
+            time.time(),
+            level,
+            message,
+            dict(metadata) if metadata else None,
+            filepath,
+            lineno,
+            exc_info,
+            payload
+        ))
     
     @staticmethod
     def debug(message: str, metadata: Optional[Dict[str, Any]] = None):
@@ -202,7 +372,7 @@ class Logger:
             for key, value in metadata.items():
                 metadata_lines.append(f"  • {key}: {value}")
             if metadata_lines:
-                metadata_str = f"\n\nChi tiết kỹ thuật:\n" + "\n".join(metadata_lines)
+                metadata_str = "\n\nChi tiết kỹ thuật:\n" + "\n".join(metadata_lines)
         
         # Tạo response content THEO FORMAT CLINE (giống attempt_completion thành công)
         # Dùng emoji và Markdown để làm nổi bật, vì Cline không hỗ trợ ANSI colors
@@ -254,17 +424,13 @@ class Logger:
             "system_fingerprint": f"fp_{uuid.uuid4().hex[:8]}"
         }
         
-        # 🆕 Print toàn bộ response JSON (pretty format) để debug
-        print(f"\n{Logger.BOLD}{'='*80}{Logger.RESET}")
-        print(f"{Logger.BOLD}{Logger.DIM}[ERROR RESPONSE JSON]{Logger.RESET}")
-        print(f"{Logger.BOLD}{'='*80}{Logger.RESET}")
-        print(json.dumps(response, indent=2, ensure_ascii=False))
-        print(f"{Logger.BOLD}{'='*80}{Logger.RESET}\n")
+        # 🆕 Log toàn bộ response JSON (DEBUG) - pretty format ở writer thread
+        Logger._log(LogLevel.DEBUG, "[ERROR RESPONSE JSON]", payload=response)
         
         # Trả về SSE stream format giống response thành công
         async def generate_error():
             # Yield từng chunk riêng biệt
-            yield f"data: {json.dumps(response)}\n\n".encode('utf-8')
+            yield b"data: " + json_codec.dumps_bytes(response) + b"\n\n"
             yield "data: [DONE]\n\n".encode('utf-8')
         
         return StreamingResponse(
@@ -274,12 +440,17 @@ class Logger:
         )
 
 
-# Convenience functions để import dễ dàng
-debug = Logger.debug
-info = Logger.info
-warning = Logger.warning
-error = Logger.error
-critical = Logger.critical
+def _disabled(*args, **kwargs):
+    """Level bị tắt (dưới LOG_LEVEL) → no-op"""
+    return None
+
+
+# Convenience functions để import dễ dàng (level bị tắt → bind thẳng vào no-op)
+debug = Logger.debug if Logger.is_enabled(LogLevel.DEBUG) else _disabled
+info = Logger.info if Logger.is_enabled(LogLevel.INFO) else _disabled
+warning = Logger.warning if Logger.is_enabled(LogLevel.WARNING) else _disabled
+error = Logger.error if Logger.is_enabled(LogLevel.ERROR) else _disabled
+critical = Logger.critical if Logger.is_enabled(LogLevel.CRITICAL) else _disabled
 error_response = Logger.error_response
 
 
@@ -301,4 +472,4 @@ if __name__ == "__main__":
         status_code=503,
         show_traceback=False
     )
-    print(json.dumps(response, indent=2, ensure_ascii=False))
\ No newline at end of file
+    print(f"{type(response).__name__} media_type={response.media_type} status={response.status_code}")
\ No newline at end of file
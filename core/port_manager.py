@@ -1,16 +1,51 @@
 import uuid
-import json
 import time
 import asyncio
-from typing import Dict, Optional, Tuple
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 from fastapi import HTTPException
+from core import json_codec
 from core.logger import error_response
+from core.connection_pool import ConnectionPool, ZenTabConnection
+from core.ws_session import ReplayBuffer
+from core.retry_policy import RetryPolicy
+from core.tab_health import TabHealthTracker
+from core.tab_pacing import TabPacing
+from core.prompt_cache import PromptStore, PROMPT_CACHE_CAPABILITY
+from core.image_cache import ImageCache, BINARY_ATTACHMENTS_CAPABILITY
+from core.conversation_index import ConversationIndexCache
+from core.tab_queue import TabWaitQueue, NEW_TASK_KEY
+from core.tab_registry import is_tab_free
+from core.tab_scheduler import TabScheduler
+from core.response_channel import ResponseChannel, EVENT_FINAL
+from core.expiring_store import ExpiringStore
+from core.deadline_scheduler import DeadlineScheduler
+from config.settings import (
+    TAB_QUEUE_MAX_DEPTH, TAB_QUEUE_MAX_WAIT, TAB_LEASE_TTL, TAB_SCHEDULER_POLICY,
+    HEDGE_LATENCY_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY,
+    REQUEST_STATE_TTL, REQUEST_STATE_MAX_ENTRIES,
+    WS_SESSION_RESUME_GRACE, WS_REPLAY_BUFFER_SIZE,
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_RATE_PER_MINUTE,
+    TAB_FAILURE_THRESHOLD, TAB_QUARANTINE_BASE, TAB_QUARANTINE_MAX,
+    TAB_PACING_WINDOW, TAB_COOLDOWN_DEFAULT, TAB_COOLDOWN_MAX,
+    IMAGE_CACHE_MAX_ENTRIES, CONVERSATION_CACHE_MAX_ENTRIES
+)
 
 
 class PortManager:
     _instance = None
     _lock = None
     
+    # Chu kỳ poll lại khi ZenTab không push state (không có notify tab rảnh)
+    TAB_POLL_INTERVAL = 2.0
+    
+    # promptResponse lặp lại trong khoảng này sau khi đã xử lý bị coi là duplicate
+    DUPLICATE_WINDOW = 30.0
+    # Số dòng log xử lý giữ lại cho mỗi request
+    REQUEST_LOG_LIMIT = 20
+    # Request bị kẹt ở trạng thái in-progress quá lâu thì tự giải phóng
+    IN_PROGRESS_TIMEOUT = 30.0
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -23,239 +58,692 @@ class PortManager:
         if self._initialized:
             return
             
-        self.websocket: Optional[object] = None
+        self.connection_pool = ConnectionPool()
         
         self.response_futures: Dict[str, asyncio.Future] = {}
+        self.response_channels: Dict[str, ResponseChannel] = {}
         self.request_to_tab: Dict[str, int] = {}
-        self.processed_requests: Dict[str, float] = {}
-        self.duplicate_count: Dict[str, int] = {}
-        self.requests_in_progress: set[str] = set()
+        self.request_to_connection: Dict[str, str] = {}
+        # connection_id → requests đang chờ response từ connection đó (fail ngay khi disconnect)
+        self.connection_requests: Dict[str, Set[str]] = {}
+        self.connection_lost_failures = 0
+        
+        # State ngắn hạn của request (dedupe/in-progress/forwarded/log) - tự hết hạn, có giới hạn
+        self.request_states = ExpiringStore(default_ttl=REQUEST_STATE_TTL, max_entries=REQUEST_STATE_MAX_ENTRIES)
+        
+        # Mọi deadline theo request (auto cleanup, cleanup mapping) chạy trên 1 background task
+        self.deadlines = DeadlineScheduler()
         
         self.lock = asyncio.Lock()
         self.connection_time = 0
         self.connection_start_time = 0
         
         self._initialized = True
-        self._cleanup_task = None
         
-        self.forwarded_messages: Dict[str, float] = {}
-        self.message_processing_log: Dict[str, list] = {}
+        self._resync_tasks: Dict[str, asyncio.Task] = {}
+        
+        self.tab_queue = TabWaitQueue(max_depth=TAB_QUEUE_MAX_DEPTH, max_wait=TAB_QUEUE_MAX_WAIT)
+        
+        # (connection_id, tab_id) → (request_id, expires_at)
+        self.tab_leases: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self.request_leases: Dict[str, Tuple[str, int]] = {}
+        
+        self.tab_scheduler = TabScheduler(policy=TAB_SCHEDULER_POLICY)
+        self.tab_health = TabHealthTracker(
+            failure_threshold=TAB_FAILURE_THRESHOLD,
+            base_quarantine=TAB_QUARANTINE_BASE,
+            max_quarantine=TAB_QUARANTINE_MAX
+        )
+        self.tab_pacing = TabPacing(
+            window=TAB_PACING_WINDOW,
+            default_cooldown=TAB_COOLDOWN_DEFAULT,
+            max_cooldown=TAB_COOLDOWN_MAX
+        )
+        
+        self.cancelled_requests = 0
+        self.hedge_stats = {"fired": 0, "won": 0, "no_free_tab": 0}
+        
+        self.retry_policy = RetryPolicy(
+            max_retries=RETRY_MAX_ATTEMPTS,
+            base_delay=RETRY_BASE_DELAY,
+            max_delay=RETRY_MAX_DELAY,
+            rate_per_minute=RETRY_RATE_PER_MINUTE
+        )
+        
+        # hash → system prompt, dùng chung mọi connection (gửi lại khi ZenTab báo unknownSystemPrompt)
+        self.prompt_store = PromptStore()
+        # Ảnh đã decode/hash + ảnh mỗi tab đã nhận (chỉ forward ảnh mới mỗi lượt)
+        self.image_cache = ImageCache(max_entries=IMAGE_CACHE_MAX_ENTRIES)
+        # Preprocess messages theo prefix hội thoại (folder, new task, prompts, images)
+        self.conversations = ConversationIndexCache(self.image_cache, max_entries=CONVERSATION_CACHE_MAX_ENTRIES)
     
     async def reconnect_websocket(self, max_retries: int = 3):        
-        # Simply check if we have a websocket object
-        if self.websocket:
-            return True
-        else:
-            return False
+        # Simply check if we have any open connection
+        return len(self.connection_pool.open_connections()) > 0
 
+    def _request_state(self, request_id: str) -> dict:
+        """Lấy (hoặc tạo) state của request và gia hạn TTL"""
+        state = self.request_states.get(request_id)
+        if state is None:
+            state = {
+                "in_progress": False,
+                "processed_at": None,
+                "duplicates": 0,
+                "forwarded": set(),
+                "log": deque(maxlen=self.REQUEST_LOG_LIMIT)
+            }
+        self.request_states.set(request_id, state)
+        return state
+    
+    def _log_request_event(self, request_id: str, event: str):
+        self._request_state(request_id)["log"].append(f"{event} at {time.time()}")
+    
+    def get_request_log(self, request_id: str) -> list:
+        state = self.request_states.get(request_id)
+        return list(state["log"]) if state else []
+    
     def mark_request_in_progress(self, request_id: str):
-        self.requests_in_progress.add(request_id)
-        
-        if request_id not in self.message_processing_log:
-            self.message_processing_log[request_id] = []
-        self.message_processing_log[request_id].append(f"IN_PROGRESS at {time.time()}")
+        self._request_state(request_id)["in_progress"] = True
+        self._log_request_event(request_id, "IN_PROGRESS")
         
-        asyncio.create_task(self._auto_cleanup_request(request_id))
+        self.deadlines.schedule(
+            request_id, self.IN_PROGRESS_TIMEOUT,
+            lambda: self._auto_cleanup_request(request_id),
+            name="in_progress"
+        )
 
-    async def _auto_cleanup_request(self, request_id: str):
-        await asyncio.sleep(30)
-        if request_id in self.requests_in_progress:
-            self.requests_in_progress.discard(request_id)
+    def _auto_cleanup_request(self, request_id: str):
+        if self.is_request_in_progress(request_id):
+            self.request_states.get(request_id)["in_progress"] = False
             
             if request_id in self.request_to_tab:
                 self.request_to_tab.pop(request_id, None)
+                self.request_to_connection.pop(request_id, None)
 
     def mark_request_completed(self, request_id: str):
-        if request_id in self.requests_in_progress:
-            self.requests_in_progress.discard(request_id)
-            
-            if request_id not in self.message_processing_log:
-                self.message_processing_log[request_id] = []
-            self.message_processing_log[request_id].append(f"COMPLETED at {time.time()}")
+        self.deadlines.cancel(request_id, name="in_progress")
+        if self.is_request_in_progress(request_id):
+            self.request_states.get(request_id)["in_progress"] = False
+            self._log_request_event(request_id, "COMPLETED")
 
     def is_request_in_progress(self, request_id: str) -> bool:
-        return request_id in self.requests_in_progress
-    
-    async def start_cleanup_loop(self):
-        if self._cleanup_task is None or self._cleanup_task.done():
-            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+        state = self.request_states.get(request_id)
+        return bool(state and state["in_progress"])
 
     def is_duplicate_request(self, request_id: str) -> bool:
-        if request_id in self.processed_requests:
-            request_time = self.processed_requests[request_id]
-            time_since_processed = time.time() - request_time
-            
-            if time_since_processed < 30.0:
-                dup_count = self.duplicate_count.get(request_id, 0) + 1
-                self.duplicate_count[request_id] = dup_count
-                return True
-            else:
-                self.processed_requests.pop(request_id, None)
-                self.duplicate_count.pop(request_id, None)
-                return False
-        else:
+        state = self.request_states.get(request_id)
+        if state is None or state["processed_at"] is None:
             return False
+        
+        if time.time() - state["processed_at"] < self.DUPLICATE_WINDOW:
+            state["duplicates"] += 1
+            return True
+        
+        state["processed_at"] = None
+        state["duplicates"] = 0
+        return False
 
     def is_request_processed(self, request_id: str) -> bool:
         return self.is_duplicate_request(request_id)
 
     def mark_request_processed(self, request_id: str):
-        current_time = time.time()
-        self.processed_requests[request_id] = current_time
-        
-        if request_id not in self.message_processing_log:
-            self.message_processing_log[request_id] = []
-        self.message_processing_log[request_id].append(f"PROCESSED at {current_time}")
-
-    async def cleanup_old_requests(self):
-        current_time = time.time()
-        keys_to_remove = []
-        
-        for req_id, timestamp in self.processed_requests.items():
-            if current_time - timestamp > 60:
-                keys_to_remove.append(req_id)
-        
-        for req_id in keys_to_remove:
-            self.processed_requests.pop(req_id, None)
-            self.duplicate_count.pop(req_id, None)
-            
-            if req_id in self.message_processing_log:
-                self.message_processing_log.pop(req_id, None)
+        self._request_state(request_id)["processed_at"] = time.time()
+        self._log_request_event(request_id, "PROCESSED")
     
-    async def cleanup_forwarded_messages(self):
-        current_time = time.time()
-        keys_to_remove = []
-        
-        for msg_key, timestamp in self.forwarded_messages.items():
-            if current_time - timestamp > 300:
-                keys_to_remove.append(msg_key)
-        
-        for msg_key in keys_to_remove:
-            self.forwarded_messages.pop(msg_key, None)
+    def is_message_forwarded(self, request_id: str, message_key: str) -> bool:
+        state = self.request_states.get(request_id)
+        return bool(state and message_key in state["forwarded"])
+    
+    def mark_message_forwarded(self, request_id: str, message_key: str):
+        self._request_state(request_id)["forwarded"].add(message_key)
     
-    async def _cleanup_loop(self):
-        while True:
-            await asyncio.sleep(300)
-            await self.cleanup_old_requests()
-            await self.cleanup_forwarded_messages()
-
     def get_connection_status(self) -> dict:        
-        websocket_open = False
-        websocket_connected = False
+        connections = self.connection_pool.all()
+        open_connections = [connection for connection in connections if connection.is_open()]
         
-        if self.websocket:
-            websocket_connected = True
-            try:
-                # 🔥 CRITICAL FIX: FastAPI WebSocket check
-                # FastAPI WebSocket uses client_state and application_state
-                if hasattr(self.websocket, 'client_state'):
-                    # FastAPI WebSocket
-                    from starlette.websockets import WebSocketState
-                    websocket_open = self.websocket.client_state == WebSocketState.CONNECTED
-                    
-                elif hasattr(self.websocket, 'closed'):
-                    # Standard WebSocket
-                    websocket_open = not self.websocket.closed
-                elif hasattr(self.websocket, 'open'):
-                    websocket_open = self.websocket.open
-                elif hasattr(self.websocket, 'state'):
-                    # websockets library
-                    from websockets.protocol import State
-                    websocket_open = self.websocket.state == State.OPEN
-                else:
-                    # Fallback: assume open if we have the object
-                    websocket_open = True
-                    
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                websocket_open = False
-                
         status = {
-            "websocket_connected": websocket_connected,
-            "websocket_open": websocket_open,
+            "websocket_connected": len(connections) > 0,
+            "websocket_open": len(open_connections) > 0,
+            "connection_count": len(connections),
+            "open_connection_count": len(open_connections),
             "connection_age": time.time() - self.connection_start_time if self.connection_start_time > 0 else 0
         }
         
         return status
     
-    async def update_websocket(self, websocket):
+    async def register_connection(self, websocket, session_id: Optional[str] = None,
+                                  last_seq: Optional[int] = None,
+                                  capabilities: Optional[Set[str]] = None) -> ZenTabConnection:
+        """
+        Thêm ZenTab connection mới vào pool (không thay thế các connection khác)
+        
+        Nếu session_id khớp 1 session đang chờ resume → gắn socket mới vào connection
+        cũ và replay các message ZenTab chưa nhận (msgSeq > last_seq).
+        """
         async with self.lock:
-            self.websocket = websocket
+            connection = self.connection_pool.find_by_session(session_id)
+            resumed = connection is not None
+            
+            if resumed:
+                if not connection.parked:
+                    # ZenTab reconnect trước khi server phát hiện socket cũ đã chết
+                    self._close_stale_socket(connection.websocket)
+                    connection.park()
+                self.deadlines.cancel(connection.connection_id, name="session_grace")
+                connection.attach(websocket)
+                # Extension có thể đã update (đổi capabilities) giữa 2 lần kết nối
+                if capabilities is not None:
+                    connection.capabilities = set(capabilities)
+            else:
+                connection = self.connection_pool.add(websocket, session_id, WS_REPLAY_BUFFER_SIZE, capabilities)
+            
             self.connection_time = time.time()
-            self.connection_start_time = time.time()
+            if self.connection_start_time == 0:
+                self.connection_start_time = time.time()
+        
+        if session_id:
+            await self._start_session(connection, resumed, last_seq or 0)
+        
+        # Lấy snapshot tabs ban đầu của connection này (resume: tabs có thể đã đổi khi mất kết nối)
+        self.schedule_tab_resync(connection.connection_id)
+        return connection
     
-    async def broadcast_status_update(self):
-        if self.websocket:
-            try:
-                status_data = {
-                    "type": "statusUpdate",
-                    "data": self.get_detailed_status(),
-                    "timestamp": time.time()
+    @staticmethod
+    def _close_stale_socket(websocket):
+        if websocket is not None and hasattr(websocket, 'close'):
+            asyncio.create_task(websocket.close())
+    
+    async def _start_session(self, connection: ZenTabConnection, resumed: bool, last_seq: int):
+        """Handshake session: báo ZenTab msgSeq đã nhận rồi replay message bị lỡ"""
+        from core import info, warning
+        
+        replay_messages = connection.messages_to_replay(last_seq) if resumed else []
+        
+        if replay_messages is None:
+            # Buffer đã tràn (mất message) → không thể đảm bảo exactly-once, fail các request cũ
+            warning(
+                "ZenTab session could not be resumed, starting fresh",
+                {"connection_id": connection.connection_id, "session_id": connection.session_id, "last_seq": last_seq}
+            )
+            self._fail_connection_requests(connection.connection_id)
+            connection.replay_buffer = ReplayBuffer(WS_REPLAY_BUFFER_SIZE)
+            connection.inbound_seq = 0
+            resumed = False
+            replay_messages = []
+        
+        await connection.send_control({
+            "type": "sessionReady",
+            "sessionId": connection.session_id,
+            "connectionId": connection.connection_id,
+            "resumed": resumed,
+            # ZenTab gửi lại các message có msgSeq > lastSeq
+            "lastSeq": connection.inbound_seq
+        })
+        
+        await connection.replay(replay_messages)
+        
+        if resumed:
+            info(
+                "🔁 ZenTab session resumed",
+                {
+                    "connection_id": connection.connection_id,
+                    "session_id": connection.session_id,
+                    "last_seq": last_seq,
+                    "replayed": len(replay_messages)
                 }
-                await self.websocket.send(json.dumps(status_data))
+            )
+    
+    async def unregister_connection(self, connection_id: str, websocket=None):
+        """
+        Gỡ connection khỏi pool - tabs của connection đó biến mất khỏi routing
+        
+        Connection có session được giữ lại (park) trong WS_SESSION_RESUME_GRACE giây
+        để ZenTab resume; request đang chạy tiếp tục chờ thay vì fail ngay.
+        
+        Args:
+            websocket: Socket vừa đóng - bỏ qua nếu connection đã được resume bằng socket khác
+        """
+        async with self.lock:
+            connection = self.connection_pool.get(connection_id)
+            if connection is None:
+                return
+            if websocket is not None and connection.websocket is not websocket:
+                return
+            
+            resync_task = self._resync_tasks.pop(connection_id, None)
+            if resync_task and not resync_task.done():
+                resync_task.cancel()
+            
+            if connection.session_id and WS_SESSION_RESUME_GRACE > 0 and not connection.parked:
+                connection.park()
+                self.deadlines.schedule(
+                    connection_id, WS_SESSION_RESUME_GRACE,
+                    lambda: self._drop_connection(connection_id),
+                    name="session_grace"
+                )
+                return
+            
+            self._drop_connection(connection_id)
+    
+    def _drop_connection(self, connection_id: str):
+        connection = self.connection_pool.remove(connection_id)
+        if connection is None:
+            return
+        
+        self.deadlines.cancel(connection_id, name="session_grace")
+        self.tab_scheduler.forget_connection(connection_id)
+        self.tab_health.forget_connection(connection_id)
+        self.tab_pacing.forget_connection(connection_id)
+        self.image_cache.forget_connection(connection_id)
+        self._fail_connection_requests(connection_id)
+        
+        if len(self.connection_pool) == 0:
+            self.connection_start_time = 0
+    
+    def _track_request(self, connection_id: str, request_id: str):
+        self.connection_requests.setdefault(connection_id, set()).add(request_id)
+    
+    def _untrack_request(self, request_id: str):
+        for connection_id, request_ids in list(self.connection_requests.items()):
+            request_ids.discard(request_id)
+            if not request_ids:
+                self.connection_requests.pop(connection_id, None)
+    
+    def _fail_connection_requests(self, connection_id: str):
+        """
+        Connection mất → fail ngay mọi request đang chờ response từ connection đó
+        (thay vì để chúng chờ tới REQUEST_TIMEOUT). Client nhận 503 và có thể retry.
+        """
+        request_ids = self.connection_requests.pop(connection_id, set())
+        failed = 0
+        
+        for request_id in request_ids:
+            if not self.has_pending_response(request_id):
+                continue
+            
+            tab_id = self.request_to_tab.pop(request_id, None)
+            self.request_to_connection.pop(request_id, None)
+            self.release_tab_lease(request_id)
+            # Mất connection không phản ánh chất lượng của tab
+            self.tab_scheduler.discard(request_id)
+            self.tab_pacing.discard(request_id)
+            self.image_cache.discard(request_id)
+            
+            self.resolve_response(request_id, {
+                "error": f"ZenTab connection {connection_id} disconnected while tab {tab_id} was processing the request",
+                "error_type": "CONNECTION_LOST",
+                "status_hint": 503,
+                "retryable": True,
+                "request_id": request_id
+            })
+            failed += 1
+        
+        if failed:
+            self.connection_lost_failures += failed
+            from core import warning
+            warning(
+                f"Failed {failed} in-flight request(s) after ZenTab disconnect",
+                {"connection_id": connection_id, "request_ids": list(request_ids)[:10]}
+            )
+    
+    async def unregister_websocket(self, websocket):
+        connection = self.connection_pool.find_by_websocket(websocket)
+        if connection:
+            await self.unregister_connection(connection.connection_id, websocket)
+    
+    async def close_all_connections(self):
+        for connection in self.connection_pool.all():
+            if connection.websocket is None:
+                continue
+            try:
+                await connection.websocket.close()
             except Exception:
                 pass
+        
+        await self.deadlines.stop()
     
-    def resolve_response(self, request_id: str, response: dict):
-        future = self.response_futures.get(request_id)
+    async def send_to_connection(self, connection_id: str, text: str, attachments: Optional[list] = None):
+        """
+        Gửi message tới đúng connection sở hữu tab.
+        `attachments` (binary frames) được gửi trước để ZenTab có đủ ảnh khi nhận message.
+        
+        Raises:
+            ConnectionError: Connection không tồn tại hoặc đã đóng
+        """
+        connection = self.connection_pool.get(connection_id)
+        if connection is None:
+            raise ConnectionError(f"ZenTab connection {connection_id} not found")
+        # Connection đang park chờ resume: message được buffer và replay sau
+        if not connection.is_open() and not connection.parked:
+            raise ConnectionError(f"ZenTab connection {connection_id} is not open")
+        
+        for frame in attachments or ():
+            await connection.send_bytes(frame)
+        await connection.send_text(text)
+    
+    @staticmethod
+    def _lease_key(tab: dict) -> Tuple[str, int]:
+        return (tab.get('connectionId'), tab.get('tabId'))
+    
+    def is_tab_leased(self, tab: dict) -> bool:
+        key = self._lease_key(tab)
+        lease = self.tab_leases.get(key)
+        if lease is None:
+            return False
         
-        if future and not future.done():
+        request_id, expires_at = lease
+        if expires_at <= time.time():
+            # Lease hết hạn (request bị bỏ quên) → thu hồi như release (trả cả slot probe)
+            self.release_tab_lease(request_id)
+            return False
+        
+        return True
+    
+    def is_tab_available(self, tab: dict) -> bool:
+        """Tab rảnh có thể nhận request: chưa bị lease, không bị quarantine và không đang cooldown"""
+        return (
+            not self.is_tab_leased(tab)
+            and self.tab_health.allow_request(self._lease_key(tab))
+            and self.tab_pacing.is_ready(tab)
+        )
+    
+    def lease_tab(self, candidates: list, request_id: str) -> Optional[dict]:
+        """
+        Giữ chỗ tab đầu tiên chưa bị lease (và không bị quarantine) trong candidates.
+        Không có await giữa check và set → atomic trên event loop, 2 request
+        đồng thời không thể nhận cùng 1 tab.
+        """
+        for tab in candidates:
+            if not self.is_tab_available(tab):
+                continue
+            
+            key = self._lease_key(tab)
+            self.tab_leases[key] = (request_id, time.time() + TAB_LEASE_TTL)
+            self.request_leases[request_id] = key
+            
+            if self.tab_health.on_dispatch(key):
+                from core import info
+                info("🩺 Probing quarantined tab", {"request_id": request_id, "tab": f"{key[0]}:{key[1]}"})
+            return tab
+        
+        return None
+    
+    def release_tab_lease(self, request_id: str):
+        """Trả tab về pool (khi có promptResponse, timeout, hoặc gửi prompt thất bại)"""
+        key = self.request_leases.pop(request_id, None)
+        if key is None:
+            return
+        
+        lease = self.tab_leases.get(key)
+        if lease is None or lease[0] != request_id:
+            return
+        
+        self.tab_leases.pop(key, None)
+        self.tab_health.release_probe(key)
+        
+        # Tab vẫn rảnh theo registry (vd: gửi prompt thất bại), hoặc registry không có push state
+        # (không có delta báo tab rảnh) → đánh thức request đầu hàng kiểm tra lại ngay
+        connection = self.connection_pool.get(key[0])
+        tab = connection.tab_registry.get_tab(key[1]) if connection else None
+        if tab and (is_tab_free(tab) or not connection.tab_registry.is_usable()):
+            self.tab_queue.notify_tab_free(tab)
+    
+    def mark_tab_busy(self, connection_id: str, tab_id: int):
+        connection = self.connection_pool.get(connection_id)
+        if connection:
+            connection.tab_registry.mark_busy(tab_id)
+    
+    def encode_prompt_message(self, connection_id: str, message: dict) -> Tuple[str, List[memoryview]]:
+        """
+        Serialize sendPrompt cho connection sở hữu tab.
+        - promptCache: system prompt đã gửi trước đó chỉ còn là hash
+        - binaryAttachments: ảnh đi thành binary frame riêng, JSON chỉ giữ attachmentId
+        
+        Returns:
+            tuple: (JSON text, binary frames cần gửi trước text)
+        """
+        connection = self.connection_pool.get(connection_id)
+        if connection is not None and connection.supports(PROMPT_CACHE_CAPABILITY):
+            message = self.prompt_store.apply(message, connection.known_prompts)
+        
+        frames = []
+        images = message.get("images")
+        if images:
+            if connection is not None and connection.supports(BINARY_ATTACHMENTS_CAPABILITY):
+                frames = [image.frame for image in images]
+                message = {**message, "images": [image.to_reference() for image in images]}
+                self.image_cache.stats["binary_frames"] += len(frames)
+            else:
+                message = {**message, "images": [image.to_inline() for image in images]}
+        
+        return json_codec.dumps(message), frames
+    
+    async def resend_attachment(self, connection_id: str, request_id: Optional[str], attachment_id: Optional[str]):
+        """ZenTab thiếu binary attachment (vd: sendPrompt được replay sau resume) → gửi lại frame"""
+        connection = self.connection_pool.get(connection_id)
+        if connection is None or not attachment_id:
+            return
+        
+        image = self.image_cache.get(attachment_id)
+        if image is None:
+            if request_id and self.has_pending_response(request_id):
+                self.resolve_response(request_id, {
+                    "error": f"Image attachment {attachment_id[:12]} is no longer cached on the server",
+                    "error_type": "TAB_ERROR",
+                    "status_hint": 500
+                })
+            return
+        
+        self.image_cache.stats["resent"] += 1
+        await connection.send_bytes(image.frame)
+    
+    async def resend_system_prompt(self, connection_id: str, request_id: Optional[str], digest: Optional[str]):
+        """ZenTab không có system prompt theo hash (vd: extension reload) → gửi lại full text"""
+        connection = self.connection_pool.get(connection_id)
+        if connection is None or not digest:
+            return
+        
+        text = self.prompt_store.get(digest)
+        if text is None:
+            # Đã bị đẩy khỏi store → không thể tiếp tục request, để client/retry gửi lại prompt đầy đủ
+            self.prompt_store.stats["missing"] += 1
+            connection.known_prompts.discard(digest)
+            if request_id and self.has_pending_response(request_id):
+                self.resolve_response(request_id, {
+                    "error": f"System prompt {digest[:12]} is no longer cached on the server",
+                    "error_type": "TAB_ERROR",
+                    "status_hint": 500
+                })
+            return
+        
+        connection.known_prompts.add(digest)
+        self.prompt_store.stats["resent"] += 1
+        await connection.send_text(json_codec.dumps({
+            "type": "systemPrompt",
+            "requestId": request_id,
+            "hash": digest,
+            "systemPrompt": text
+        }))
+    
+    async def dispatch_prompt(self, request_id: str, tab: dict, message_text: str,
+                              attachments: Optional[List[memoryview]] = None):
+        """
+        Gửi sendPrompt (đã serialize, kèm binary attachments nếu có) tới connection sở hữu tab.
+        Tab phải đã được lease cho request_id; caller tự release lease nếu gửi thất bại.
+        """
+        tab_id = tab.get('tabId')
+        connection_id = tab.get('connectionId')
+        
+        self.request_to_tab[request_id] = tab_id
+        self.request_to_connection[request_id] = connection_id
+        
+        # Mở response channel TRƯỚC khi gửi để không bỏ lỡ delta/response đến sớm
+        self.open_response_channel(request_id)
+        
+        try:
+            await self.send_to_connection(connection_id, message_text, attachments)
+        except Exception:
+            self.request_to_tab.pop(request_id, None)
+            self.request_to_connection.pop(request_id, None)
+            self.discard_response_channel(request_id)
+            raise
+        
+        self._track_request(connection_id, request_id)
+        
+        # Tab đã nhận prompt → busy cho tới khi ZenTab push state mới
+        self.mark_tab_busy(connection_id, tab_id)
+        self.tab_scheduler.record_dispatch(request_id, tab)
+        self.tab_pacing.record_dispatch(request_id, tab)
+    
+    async def broadcast_status_update(self):
+        status_data = {
+            "type": "statusUpdate",
+            "data": self.get_detailed_status(),
+            "timestamp": time.time()
+        }
+        message = json_codec.dumps(status_data)
+        
+        for connection in self.connection_pool.open_connections():
             try:
-                future.set_result(response)
+                await connection.send_text(message)
             except Exception:
                 pass
     
-    async def wait_for_response(self, request_id: str, timeout: float = 180.0) -> dict:
+    def open_response_channel(self, request_id: str) -> ResponseChannel:
+        """Mở channel TRƯỚC khi gửi prompt để không mất response/delta đến sớm"""
+        channel = self.response_channels.get(request_id)
+        if channel is None:
+            channel = self.response_channels[request_id] = ResponseChannel()
+        return channel
+    
+    def discard_response_channel(self, request_id: str):
+        self.response_channels.pop(request_id, None)
+    
+    def has_pending_response(self, request_id: str) -> bool:
+        channel = self.response_channels.get(request_id)
+        return channel is not None and not channel.closed
+    
+    def push_response_delta(self, request_id: str, text: str, seq: Optional[int] = None):
+        channel = self.response_channels.get(request_id)
+        if channel is not None:
+            channel.push_delta(text, seq)
+    
+    def resolve_response(self, request_id: str, response: dict):
+        channel = self.response_channels.get(request_id)
+        if channel is not None:
+            channel.push_final(response)
+    
+    @staticmethod
+    def classify_error_message(error_msg: str) -> Tuple[str, int]:
+        """Phân loại lỗi ZenTab → (error_type, status_hint)"""
+        if "cooling down" in error_msg.lower() or "not ready" in error_msg.lower():
+            return "COOLING_DOWN", 503
+        return "TAB_ERROR", 500
+    
+    def record_tab_outcome(self, request_id: str, success: bool, error_type: Optional[str] = None,
+                           error_message: Optional[str] = None):
+        """Ghi kết quả request cho scheduler (latency), pacing và circuit breaker của tab"""
+        tab_id = self.request_to_tab.get(request_id)
+        key = (self.request_to_connection.get(request_id), tab_id)
+        
+        self.tab_scheduler.record_result(request_id, success=success)
+        cooldown = self.tab_pacing.record_result(request_id, None if success else error_type, error_message)
+        # Tab chỉ thực sự có ảnh khi đã trả lời thành công
+        if success:
+            self.image_cache.commit(request_id)
+        else:
+            self.image_cache.discard(request_id)
+        if tab_id is None:
+            return
+        
+        if cooldown is not None:
+            from core import info
+            info(
+                "⏳ Tab cooling down, holding requests locally",
+                {"tab": f"{key[0]}:{key[1]}", "cooldown_seconds": cooldown}
+            )
+            # Hết cooldown → đánh thức request đang chờ trong queue
+            self.deadlines.schedule(
+                f"tab:{key[0]}:{key[1]}", cooldown,
+                lambda: self._on_quarantine_end(key),
+                name="cooldown"
+            )
+        
+        quarantine = self.tab_health.record(key, success, error_type)
+        if quarantine is None:
+            return
+        
+        from core import warning
+        warning(
+            "🚧 Tab quarantined after repeated failures",
+            {"tab": f"{key[0]}:{key[1]}", "error_type": error_type, "quarantine_seconds": quarantine}
+        )
+        # Hết quarantine → tab half-open, đánh thức request đang chờ để probe
+        self.deadlines.schedule(
+            f"tab:{key[0]}:{key[1]}", quarantine,
+            lambda: self._on_quarantine_end(key),
+            name="quarantine"
+        )
+    
+    def _on_quarantine_end(self, key: Tuple[str, int]):
+        connection = self.connection_pool.get(key[0])
+        tab = connection.tab_registry.get_tab(key[1]) if connection else None
+        if tab and is_tab_free(tab):
+            self._notify_free_tabs([tab])
+    
+    @staticmethod
+    def _classify_response(request_id: str, response: dict) -> dict:
+        # 🔥 FIX: KHÔNG raise HTTPException - chỉ return dict với error
+        # Kiểm tra response có lỗi không
+        if "error" not in response:
+            return response
+        
+        # Error đã được phân loại sẵn (vd: CONNECTION_LOST) → giữ nguyên
+        if "error_type" in response:
+            return response
+        
+        error_msg = response.get("error", "Unknown error")
+        
+        # Classify error type
+        error_type, status_hint = PortManager.classify_error_message(error_msg)
+        
+        # Return error dict thay vì raise
+        return {
+            "error": error_msg,
+            "error_type": error_type,
+            "status_hint": status_hint,
+            "request_id": request_id
+        }
+    
+    async def stream_response(self, request_id: str, timeout: float = 180.0) -> AsyncIterator[Tuple[str, object]]:
         """
-        Đợi response từ ZenTab extension với timeout
+        Stream response từ ZenTab extension với timeout
         
         Args:
             request_id: ID của request cần đợi response
-            timeout: Thời gian tối đa chờ (giây)
+            timeout: Thời gian tối đa chờ response cuối (giây)
             
-        Returns:
-            dict: Response data từ ZenTab hoặc dict chứa error field
+        Yields:
+            (EVENT_DELTA, str): Từng đoạn text ZenTab gửi qua promptChunk
+            (EVENT_FINAL, dict): Response cuối từ ZenTab hoặc dict chứa error field (luôn là event cuối)
         """
-        # Tạo future để chờ response
-        future = asyncio.Future()
-        self.response_futures[request_id] = future
+        channel = self.open_response_channel(request_id)
         
         try:
-            # Đợi response với timeout
-            response = await asyncio.wait_for(future, timeout=timeout)
-            
-            # 🔥 FIX: KHÔNG raise HTTPException - chỉ return dict với error
-            # Kiểm tra response có lỗi không
-            if "error" in response:
-                error_msg = response.get("error", "Unknown error")
-                
-                # Classify error type
-                if "cooling down" in error_msg.lower() or "not ready" in error_msg.lower():
-                    error_type = "COOLING_DOWN"
-                    status_hint = 503
+            async for event_type, payload in channel.events(timeout):
+                if event_type == EVENT_FINAL:
+                    yield event_type, self._classify_response(request_id, payload)
                 else:
-                    error_type = "TAB_ERROR"
-                    status_hint = 500
-                
-                # Return error dict thay vì raise
-                return {
-                    "error": error_msg,
-                    "error_type": error_type,
-                    "status_hint": status_hint,
-                    "request_id": request_id
-                }
-            
-            # Return success response
-            return response
+                    yield event_type, payload
             
         except asyncio.TimeoutError:
-            # Cleanup khi timeout
-            self.response_futures.pop(request_id, None)
+            # Cleanup khi timeout - tab không trả lời tính là 1 lần lỗi
+            self.record_tab_outcome(request_id, success=False, error_type="TIMEOUT")
             self.request_to_tab.pop(request_id, None)
+            self.request_to_connection.pop(request_id, None)
             
             # Return timeout error dict
-            return {
+            yield EVENT_FINAL, {
                 "error": f"Request đã timeout sau {timeout} giây. DeepSeek mất quá nhiều thời gian để phản hồi.",
                 "error_type": "TIMEOUT",
                 "timeout_seconds": timeout,
@@ -265,8 +753,8 @@ class PortManager:
             
         except Exception as e:
             # Cleanup khi có lỗi
-            self.response_futures.pop(request_id, None)
             self.request_to_tab.pop(request_id, None)
+            self.request_to_connection.pop(request_id, None)
             
             # Log exception với traceback
             import traceback
@@ -276,7 +764,7 @@ class PortManager:
             error_message = str(e) if str(e) else f"Unknown exception: {type(e).__name__}"
             
             # Return exception error dict
-            return {
+            yield EVENT_FINAL, {
                 "error": f"Exception trong wait_for_response: {error_message}",
                 "error_type": "EXCEPTION",
                 "exception_class": type(e).__name__,
@@ -286,8 +774,323 @@ class PortManager:
             }
             
         finally:
-            # Luôn cleanup future sau khi xong
-            self.response_futures.pop(request_id, None)
+            # Luôn cleanup channel và trả lease sau khi xong
+            self.response_channels.pop(request_id, None)
+            self._untrack_request(request_id)
+            self.release_tab_lease(request_id)
+            self.tab_scheduler.discard(request_id)
+            self.tab_pacing.discard(request_id)
+            self.image_cache.discard(request_id)
+    
+    async def cancel_request(self, request_id: str, reason: str = "client_disconnected") -> bool:
+        """
+        Huỷ request đang chờ response (vd: client ngắt kết nối giữa chừng)
+        
+        Gửi cancelPrompt tới ZenTab để tab dừng generate, trả lease và dọn state
+        của request. promptResponse đến sau đó sẽ bị bỏ qua vì channel đã bị xoá.
+        
+        Returns:
+            bool: False nếu request đã có response cuối hoặc không tồn tại
+        """
+        channel = self.response_channels.pop(request_id, None)
+        if channel is None or channel.closed:
+            return False
+        
+        self._untrack_request(request_id)
+        
+        tab_id = self.request_to_tab.pop(request_id, None)
+        connection_id = self.request_to_connection.pop(request_id, None)
+        
+        self.release_tab_lease(request_id)
+        # Request bị huỷ không phản ánh latency/lỗi của tab
+        self.tab_scheduler.discard(request_id)
+        self.tab_pacing.discard(request_id)
+        self.image_cache.discard(request_id)
+        self.mark_request_completed(request_id)
+        self.cancelled_requests += 1
+        
+        from core import info, warning
+        info(
+            "🛑 Cancelling request",
+            {"request_id": request_id, "tab_id": tab_id, "connection_id": connection_id, "reason": reason}
+        )
+        
+        if tab_id is None or connection_id is None:
+            return True
+        
+        cancel_message = {
+            "type": "cancelPrompt",
+            "requestId": request_id,
+            "tabId": tab_id,
+            "reason": reason,
+            "timestamp": time.time()
+        }
+        
+        try:
+            await self.send_to_connection(connection_id, json_codec.dumps(cancel_message))
+        except Exception as e:
+            warning(
+                "Failed to send cancelPrompt to ZenTab",
+                {"request_id": request_id, "tab_id": tab_id, "connection_id": connection_id, "error": str(e)}
+            )
+        
+        return True
+    
+    def hedge_delay(self) -> float:
+        """Thời gian chờ tab đầu trước khi gửi hedge - theo percentile latency quan sát được"""
+        observed = self.tab_scheduler.latency_percentile(HEDGE_LATENCY_PERCENTILE)
+        if observed is None:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, observed)
+    
+    async def _dispatch_to_alternate_tab(self, attempt_id: str, message: dict, folder_path: Optional[str],
+                                         exclude: Optional[Set[Tuple[str, int]]] = None) -> Optional[dict]:
+        """
+        Gửi lại prompt new task (dưới attempt_id mới) tới 1 tab rảnh khác, không chờ queue.
+        Dùng cho hedge và retry.
+        
+        Args:
+            exclude: (connection_id, tab_id) của các tab không được chọn (vd: tab vừa lỗi)
+        
+        Returns:
+            dict | None: Tab đã nhận prompt, None nếu không còn tab rảnh hoặc gửi thất bại
+        """
+        exclude = exclude or set()
+        free_tabs = [
+            tab for tab in await self.get_free_tabs(timeout=5.0)
+            if self.is_tab_available(tab) and self._lease_key(tab) not in exclude
+        ]
+        # Cùng thứ tự ưu tiên với new task: tab của folder hoặc chưa link trước
+        preferred = [tab for tab in free_tabs if tab.get('folderPath') in (None, folder_path)]
+        others = [tab for tab in free_tabs if tab.get('folderPath') not in (None, folder_path)]
+        
+        tab = self.lease_tab(self.tab_scheduler.order(preferred) + self.tab_scheduler.order(others), attempt_id)
+        if tab is None:
+            return None
+        
+        attempt_message = {**message, "requestId": attempt_id, "tabId": tab.get('tabId')}
+        
+        try:
+            message_text, attachments = self.encode_prompt_message(tab.get('connectionId'), attempt_message)
+            await self.dispatch_prompt(attempt_id, tab, message_text, attachments)
+            self.image_cache.record_sent(
+                attempt_id, self._lease_key(tab), message.get("images", []), message.get("isNewTask", True)
+            )
+        except Exception as e:
+            self.release_tab_lease(attempt_id)
+            from core import warning
+            warning(
+                "Failed to send prompt to alternate tab",
+                {"attempt_id": attempt_id, "tab_id": tab.get('tabId'), "error": str(e)}
+            )
+            return None
+        
+        return tab
+    
+    async def _launch_hedge(self, request_id: str, message: dict, folder_path: Optional[str]) -> Optional[str]:
+        """
+        Gửi cùng prompt new task tới 1 tab rảnh khác (không chờ queue).
+        
+        Returns:
+            str | None: request_id của hedge, None nếu không còn tab rảnh
+        """
+        hedge_id = f"{request_id}-hedge"
+        
+        tab = await self._dispatch_to_alternate_tab(hedge_id, message, folder_path)
+        if tab is None:
+            self.hedge_stats["no_free_tab"] += 1
+            return None
+        
+        self.hedge_stats["fired"] += 1
+        from core import info
+        info(
+            "🪁 Hedged new task to second tab",
+            {"request_id": request_id, "hedge_request_id": hedge_id, "tab_id": tab.get('tabId')}
+        )
+        return hedge_id
+    
+    async def stream_hedged_response(self, request_id: str, message: dict, folder_path: Optional[str],
+                                     timeout: float = 180.0) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Như stream_response nhưng nếu tab đầu chưa trả event nào sau hedge_delay()
+        thì gửi thêm prompt tới tab rảnh thứ 2.
+        
+        Attempt trả event đầu tiên (delta hoặc response cuối) thắng; attempt còn lại
+        bị cancelPrompt và trả lease. Response lỗi của 1 attempt bị bỏ qua nếu attempt
+        kia vẫn đang chạy.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = self.hedge_delay()
+        
+        streams = {request_id: self.stream_response(request_id, timeout)}
+        pending = {request_id: asyncio.ensure_future(streams[request_id].__anext__())}
+        winner = None
+        
+        try:
+            done, _ = await asyncio.wait(set(pending.values()), timeout=delay)
+            
+            if not done:
+                hedge_id = await self._launch_hedge(request_id, message, folder_path)
+                if hedge_id is not None:
+                    streams[hedge_id] = self.stream_response(hedge_id, max(deadline - loop.time(), 0.0))
+                    pending[hedge_id] = asyncio.ensure_future(streams[hedge_id].__anext__())
+            
+            while winner is None:
+                done, _ = await asyncio.wait(set(pending.values()), return_when=asyncio.FIRST_COMPLETED)
+                
+                for attempt_id, future in list(pending.items()):
+                    if future not in done:
+                        continue
+                    
+                    event_type, payload = future.result()
+                    is_error = event_type == EVENT_FINAL and isinstance(payload, dict) and "error" in payload
+                    
+                    if is_error and len(pending) > 1:
+                        # Attempt này lỗi nhưng attempt kia vẫn còn cơ hội
+                        pending.pop(attempt_id)
+                        await streams[attempt_id].aclose()
+                        continue
+                    
+                    winner = attempt_id
+                    first_event = (event_type, payload)
+                    break
+            
+            pending.pop(winner)
+            for loser_id in list(pending):
+                await self.cancel_request(loser_id, reason="hedge_lost")
+                pending.pop(loser_id).cancel()
+            
+            if winner != request_id:
+                self.hedge_stats["won"] += 1
+            
+            yield first_event
+            
+            # Tiếp tục stream của attempt thắng (kết thúc ngay nếu event đầu đã là response cuối)
+            async for event in streams[winner]:
+                yield event
+        
+        finally:
+            # Client ngắt kết nối / bị cancel giữa chừng → huỷ các attempt còn chạy
+            # (request gốc do caller tự cancel; cancel_request bỏ qua attempt đã xong)
+            for attempt_id, future in pending.items():
+                future.cancel()
+                if attempt_id != request_id:
+                    asyncio.create_task(self.cancel_request(attempt_id, reason="hedge_abandoned"))
+            if winner is not None and winner != request_id:
+                asyncio.create_task(self.cancel_request(winner, reason="hedge_abandoned"))
+    
+    def _attempt_tab_keys(self, attempt_id: str) -> Set[Tuple[str, int]]:
+        """Tab(s) đã nhận attempt này (kể cả hedge của nó) - để retry không chọn lại"""
+        keys = set()
+        for request_id in (attempt_id, f"{attempt_id}-hedge"):
+            tab_id = self.request_to_tab.get(request_id)
+            if tab_id is not None:
+                keys.add((self.request_to_connection.get(request_id), tab_id))
+        return keys
+    
+    async def stream_with_retry(self, request_id: str, message: dict, folder_path: Optional[str],
+                                timeout: float = 180.0,
+                                events: Optional[AsyncIterator[Tuple[str, object]]] = None
+                                ) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Bọc event stream của new task: nếu attempt trả lỗi retryable (TAB_ERROR/COOLING_DOWN/
+        CONNECTION_LOST) TRƯỚC khi stream bất kỳ delta nào, gửi lại tới tab rảnh khác sau
+        backoff, trong giới hạn retry budget của request và rate cap toàn cục.
+        
+        Args:
+            events: Stream của attempt đầu (vd: stream_hedged_response), mặc định stream_response
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        
+        events = events or self.stream_response(request_id, timeout)
+        attempt_id = request_id
+        retries = 0
+        failed_tabs: Set[Tuple[str, int]] = set()
+        
+        try:
+            while True:
+                failed_tabs |= self._attempt_tab_keys(attempt_id)
+                retry_error = None
+                streamed = False
+                
+                async for event_type, payload in events:
+                    if event_type == EVENT_FINAL and not streamed and self.retry_policy.is_retryable(payload):
+                        retry_error = payload
+                        break
+                    streamed = True
+                    if event_type == EVENT_FINAL and retries and "error" not in payload:
+                        self.retry_policy.stats["succeeded"] += 1
+                    yield event_type, payload
+                
+                if retry_error is None:
+                    return
+                
+                await events.aclose()
+                
+                delay = self.retry_policy.backoff(retries)
+                remaining = deadline - loop.time()
+                
+                if retries >= self.retry_policy.max_retries or remaining <= delay:
+                    self.retry_policy.stats["exhausted"] += 1
+                    yield EVENT_FINAL, retry_error
+                    return
+                
+                if not self.retry_policy.try_acquire():
+                    yield EVENT_FINAL, retry_error
+                    return
+                
+                await asyncio.sleep(delay)
+                retries += 1
+                
+                next_attempt_id = f"{request_id}-retry{retries}"
+                tab = await self._dispatch_to_alternate_tab(next_attempt_id, message, folder_path, failed_tabs)
+                if tab is None:
+                    self.retry_policy.stats["no_free_tab"] += 1
+                    yield EVENT_FINAL, retry_error
+                    return
+                
+                self.retry_policy.stats["retries"] += 1
+                from core import info
+                info(
+                    "🔁 Retrying new task on another tab",
+                    {
+                        "request_id": request_id,
+                        "attempt_id": next_attempt_id,
+                        "tab_id": tab.get('tabId'),
+                        "previous_error_type": retry_error.get("error_type"),
+                        "backoff_seconds": round(delay, 2)
+                    }
+                )
+                
+                attempt_id = next_attempt_id
+                events = self.stream_response(attempt_id, max(deadline - loop.time(), 0.0))
+        
+        finally:
+            # Client ngắt kết nối giữa chừng → huỷ attempt retry đang chạy
+            # (request gốc do caller tự cancel; cancel_request bỏ qua attempt đã xong)
+            if attempt_id != request_id:
+                asyncio.create_task(self.cancel_request(attempt_id, reason="retry_abandoned"))
+    
+    async def wait_for_response(self, request_id: str, timeout: float = 180.0,
+                                stream: Optional[AsyncIterator[Tuple[str, object]]] = None) -> dict:
+        """
+        Đợi response cuối từ ZenTab extension với timeout (bỏ qua các delta)
+        
+        Args:
+            stream: Event stream có sẵn (vd: stream_hedged_response), mặc định stream_response(request_id)
+        
+        Returns:
+            dict: Response data từ ZenTab hoặc dict chứa error field
+        """
+        stream = stream or self.stream_response(request_id, timeout)
+        try:
+            async for event_type, payload in stream:
+                if event_type == EVENT_FINAL:
+                    return payload
+        finally:
+            await stream.aclose()
 
     async def cleanup_pending_messages(self):
         try:
@@ -297,133 +1100,111 @@ class PortManager:
                 "force": True
             }
                         
-            if self.websocket:
+            message = json_codec.dumps(cleanup_message)
+            for connection in self.connection_pool.open_connections():
                 try:
-                    await self.websocket.send(json.dumps(cleanup_message))
+                    await connection.send_text(message)
                 except Exception:
                     pass
             
         except Exception:
             pass
 
-    async def request_fresh_tabs(self, timeout: float = 10.0) -> list:
-        """
-        Request danh sách tabs rảnh từ ZenTab extension
-        🔥 FIX: Chỉ trả về tabs có canAccept=true và status=free
-        """
-        if not self.websocket:
-            return []
-        
-        try:
-            # Check websocket state properly
-            if hasattr(self.websocket, 'client_state'):
-                # FastAPI WebSocket
-                from starlette.websockets import WebSocketState
-                if self.websocket.client_state != WebSocketState.CONNECTED:
-                    return []
-            elif hasattr(self.websocket, 'state'):
-                from websockets.protocol import State
-                if self.websocket.state != State.OPEN:
-                    return []
-            elif hasattr(self.websocket, 'closed'):
-                if self.websocket.closed:
-                    return []
-        except Exception:
-            return []
+    async def _request_tabs(self, connection: ZenTabConnection, request_msg: dict, timeout: float) -> Optional[dict]:
+        """Round trip hỏi tabs tới 1 connection. Trả về None nếu lỗi/timeout."""
+        if not connection.is_open():
+            return None
 
-        request_id = f"tabs_req_{uuid.uuid4().hex[:8]}"
-        
+        request_id = request_msg["requestId"]
         future = asyncio.Future()
         self.response_futures[request_id] = future
 
         try:
-            request_msg = {
-                "type": "getAvailableTabs",
-                "requestId": request_id,
-                "timestamp": int(time.time() * 1000),
-                "urgent": True
-            }
-            
-            await self.websocket.send_text(json.dumps(request_msg))
-            
-            response = await asyncio.wait_for(future, timeout=timeout)
-            tabs = response.get('tabs', [])
-            
-            # 🔥 CRITICAL FIX: Chỉ trả tabs THỰC SỰ rảnh (canAccept=true và status=free)
-            free_tabs = [
-                tab for tab in tabs 
-                if tab.get('canAccept', False) and tab.get('status') == 'free'
-            ]
-            
-            return free_tabs
-            
+            await connection.send_text(json_codec.dumps(request_msg))
+            return await asyncio.wait_for(future, timeout=timeout)
         except asyncio.TimeoutError:
-            return []
+            return None
         except Exception:
-            return []
+            return None
         finally:
             self.response_futures.pop(request_id, None)
 
-    async def request_tabs_by_folder(self, folder_path: str, timeout: float = 10.0) -> list:
+    async def request_fresh_tabs(self, connection_id: Optional[str] = None, timeout: float = 10.0) -> list:
         """
-        Request danh sách tabs có folder_path khớp từ ZenTab.
+        Request danh sách tabs rảnh từ ZenTab extension
         🔥 FIX: Chỉ trả về tabs có canAccept=true và status=free
+        
+        Args:
+            connection_id: Chỉ hỏi 1 connection; None = hỏi song song mọi connection
         """
-        if not self.websocket:
-            return []
+        if connection_id is None:
+            results = await asyncio.gather(*[
+                self.request_fresh_tabs(connection.connection_id, timeout)
+                for connection in self.connection_pool.active()
+            ])
+            return [tab for tabs in results for tab in tabs]
         
-        try:
-            # Check websocket state properly
-            if hasattr(self.websocket, 'client_state'):
-                # FastAPI WebSocket
-                from starlette.websockets import WebSocketState
-                if self.websocket.client_state != WebSocketState.CONNECTED:
-                    return []
-            elif hasattr(self.websocket, 'state'):
-                from websockets.protocol import State
-                if self.websocket.state != State.OPEN:
-                    return []
-            elif hasattr(self.websocket, 'closed'):
-                if self.websocket.closed:
-                    return []
-        except Exception:
+        connection = self.connection_pool.get(connection_id)
+        if connection is None:
             return []
 
-        request_id = f"tabs_folder_{uuid.uuid4().hex[:8]}"
+        request_msg = {
+            "type": "getAvailableTabs",
+            "requestId": f"tabs_req_{uuid.uuid4().hex[:8]}",
+            "timestamp": int(time.time() * 1000),
+            "urgent": True
+        }
         
-        future = asyncio.Future()
-        self.response_futures[request_id] = future
-
-        try:
-            request_msg = {
-                "type": "getTabsByFolder",
-                "requestId": request_id,
-                "folderPath": folder_path,
-                "timestamp": int(time.time() * 1000),
-                "urgent": True
-            }
-            
-            await self.websocket.send_text(json.dumps(request_msg))
+        response = await self._request_tabs(connection, request_msg, timeout)
+        if response is None:
+            return []
+        
+        tabs = response.get('tabs', [])
+        
+        # getAvailableTabs trả về toàn bộ tabs → snapshot cho registry của connection
+        self._notify_free_tabs(connection.tab_registry.apply_snapshot(tabs, response.get('version')))
+        
+        # 🔥 CRITICAL FIX: Chỉ trả tabs THỰC SỰ rảnh (canAccept=true và status=free)
+        return connection.tab_registry.free_tabs()
 
-            response = await asyncio.wait_for(future, timeout=timeout)
-            tabs = response.get('tabs', [])
-            
-            # 🔥 CRITICAL FIX: Chỉ trả tabs THỰC SỰ rảnh (canAccept=true và status=free)
-            free_tabs = [
-                tab for tab in tabs 
-                if tab.get('canAccept', False) and tab.get('status') == 'free'
-            ]
-            
-            return free_tabs
-            
-        except asyncio.TimeoutError:
+    async def request_tabs_by_folder(self, folder_path: str, connection_id: Optional[str] = None,
+                                     timeout: float = 10.0) -> list:
+        """
+        Request danh sách tabs có folder_path khớp từ ZenTab.
+        🔥 FIX: Chỉ trả về tabs có canAccept=true và status=free
+        """
+        if connection_id is None:
+            results = await asyncio.gather(*[
+                self.request_tabs_by_folder(folder_path, connection.connection_id, timeout)
+                for connection in self.connection_pool.active()
+            ])
+            return [tab for tabs in results for tab in tabs]
+        
+        connection = self.connection_pool.get(connection_id)
+        if connection is None:
             return []
-        except Exception:
+
+        request_msg = {
+            "type": "getTabsByFolder",
+            "requestId": f"tabs_folder_{uuid.uuid4().hex[:8]}",
+            "folderPath": folder_path,
+            "timestamp": int(time.time() * 1000),
+            "urgent": True
+        }
+        
+        response = await self._request_tabs(connection, request_msg, timeout)
+        if response is None:
             return []
-        finally:
-            self.response_futures.pop(request_id, None)
+        
+        tabs = response.get('tabs', [])
+        
+        # Chỉ là một phần tabs → upsert, không thay snapshot
+        self._notify_free_tabs(connection.tab_registry.upsert_tabs(tabs))
+        
+        # 🔥 CRITICAL FIX: Chỉ trả tabs THỰC SỰ rảnh (canAccept=true và status=free)
+        return connection.tab_registry.free_tabs_by_folder(folder_path)
 
-    def handle_available_tabs_response(self, request_id: str, tabs: list):
+    def handle_available_tabs_response(self, request_id: str, tabs: list, version: Optional[int] = None):
         future = self.response_futures.get(request_id)
         if not future:
             return
@@ -431,35 +1212,182 @@ class PortManager:
         if future.done():
             return
         
-        future.set_result({"tabs": tabs})
+        future.set_result({"tabs": tabs, "version": version})
+    
+    def handle_tab_state_push(self, connection_id: str, tabs: list, removed_tab_ids: Optional[list] = None,
+                              version: Optional[int] = None, full_snapshot: bool = False):
+        """
+        Xử lý tab state do ZenTab chủ động push (focusedTabsUpdate / tabStateDelta).
+        Nếu delta bị lệch version → trigger resync ở background.
+        """
+        connection = self.connection_pool.get(connection_id)
+        if connection is None:
+            return
+        
+        registry = connection.tab_registry
+        registry.push_enabled = True
+        
+        if full_snapshot:
+            self._notify_free_tabs(registry.apply_snapshot(tabs, version))
+            return
+        
+        newly_free = registry.apply_delta(tabs, removed_tab_ids, version)
+        if newly_free is None:
+            self.schedule_tab_resync(connection_id)
+            return
+        
+        self._notify_free_tabs(newly_free)
+    
+    def _notify_free_tabs(self, tabs: list):
+        """Đánh thức request đang xếp hàng cho mỗi tab vừa rảnh (bỏ qua tab đang bị lease/quarantine)"""
+        for tab in tabs:
+            if self.is_tab_available(tab):
+                self.tab_queue.notify_tab_free(tab)
+    
+    def schedule_tab_resync(self, connection_id: str):
+        """Resync registry của 1 connection bằng getAvailableTabs (mỗi connection chỉ 1 resync tại một thời điểm)"""
+        resync_task = self._resync_tasks.get(connection_id)
+        if resync_task is None or resync_task.done():
+            self._resync_tasks[connection_id] = asyncio.create_task(self.request_fresh_tabs(connection_id))
+    
+    def _all_registries_usable(self) -> bool:
+        return all(connection.tab_registry.is_usable() for connection in self.connection_pool.active())
     
-    async def schedule_request_cleanup(self, request_id: str, delay: float = 30.0):
-        await asyncio.sleep(delay)
+    async def get_free_tabs(self, timeout: float = 10.0) -> list:
+        """
+        Danh sách tabs rảnh trên mọi connection - lookup local từ registry nếu ZenTab
+        đang push state, fallback về round trip getAvailableTabs cho connection có
+        registry stale/chưa có push.
+        """
+        local_tabs = []
+        pending = []
         
-        if request_id in self.request_to_tab:
-            self.request_to_tab.pop(request_id, None)
+        for connection in self.connection_pool.active():
+            if connection.tab_registry.is_usable():
+                local_tabs.extend(connection.tab_registry.free_tabs())
+            else:
+                pending.append(self.request_fresh_tabs(connection.connection_id, timeout))
+        
+        if pending:
+            for tabs in await asyncio.gather(*pending):
+                local_tabs.extend(tabs)
+        
+        return local_tabs
     
-    async def cleanup_duplicate_detection(self):
-        current_time = time.time()
+    async def get_free_tabs_by_folder(self, folder_path: str, timeout: float = 10.0) -> list:
+        """Giống get_free_tabs nhưng chỉ lấy tabs đã link với folder_path"""
+        local_tabs = []
+        pending = []
         
-        requests_to_remove = []
-        for request_id in self.requests_in_progress:
-            if len(self.requests_in_progress) > 100:
-                requests_to_remove.append(request_id)
+        for connection in self.connection_pool.active():
+            if connection.tab_registry.is_usable():
+                local_tabs.extend(connection.tab_registry.free_tabs_by_folder(folder_path))
+            else:
+                pending.append(self.request_tabs_by_folder(folder_path, connection.connection_id, timeout))
         
-        for request_id in requests_to_remove:
-            self.requests_in_progress.discard(request_id)
-
-        processed_to_remove = []
-        for request_id, timestamp in self.processed_requests.items():
-            if current_time - timestamp > 600:
-                processed_to_remove.append(request_id)
-        
-        for request_id in processed_to_remove:
-            self.processed_requests.pop(request_id, None)
-            self.duplicate_count.pop(request_id, None)
-
-    async def _duplicate_cleanup_loop(self):
-        while True:
-            await asyncio.sleep(300)
-            await self.cleanup_duplicate_detection()
\ No newline at end of file
+        if pending:
+            for tabs in await asyncio.gather(*pending):
+                local_tabs.extend(tabs)
+        
+        return local_tabs
+    
+    async def wait_for_free_tabs(self, folder_path: Optional[str], is_new_task: bool,
+                                 timeout: float = 10.0) -> Tuple[list, float]:
+        """
+        Lấy tabs rảnh, nếu chưa có thì xếp hàng chờ (FIFO theo folder) tối đa tab_queue.max_wait.
+        
+        Returns:
+            Tuple[list, float]: (tabs rảnh - rỗng nếu hết thời gian chờ, số giây đã chờ)
+            
+        Raises:
+            QueueFullError: Hàng đợi đã đầy
+        """
+        key = NEW_TASK_KEY if is_new_task else folder_path
+        start_time = time.time()
+        deadline = start_time + self.tab_queue.max_wait
+        waiter = None
+        # Request mới không được chen ngang các request đang xếp hàng cùng key
+        may_check = not self.tab_queue.has_waiters(key)
+        
+        try:
+            while True:
+                paced_wait = None
+                if may_check:
+                    if is_new_task:
+                        tabs = await self.get_free_tabs(timeout=timeout)
+                    else:
+                        tabs = await self.get_free_tabs_by_folder(folder_path, timeout=timeout)
+                    
+                    # Tab cooldown theo pacing: giữ request local tới thời điểm dự đoán tab sẵn sàng
+                    paced_wait = min(
+                        (self.tab_pacing.ready_in(tab) for tab in tabs
+                         if not self.is_tab_leased(tab) and not self.tab_pacing.is_ready(tab)),
+                        default=None
+                    )
+                    
+                    # Tab đã bị request khác lease, đang quarantine hoặc cooldown thì không tính là rảnh
+                    tabs = [tab for tab in tabs if self.is_tab_available(tab)]
+                    
+                    if tabs:
+                        waited = time.time() - start_time
+                        if waiter is not None:
+                            self.tab_queue.record_wait(waited)
+                        return tabs, waited
+                
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    waited = time.time() - start_time
+                    if waiter is not None:
+                        self.tab_queue.record_wait(waited, timed_out=True)
+                    return [], waited
+                
+                if waiter is None:
+                    waiter = self.tab_queue.join(key)
+                
+                # Đầu hàng: không có push state → không có notify, phải poll lại theo chu kỳ
+                if self.tab_queue.is_head(waiter) and not self._all_registries_usable():
+                    remaining = min(remaining, self.TAB_POLL_INTERVAL)
+                
+                if paced_wait is not None:
+                    self.tab_pacing.note_paced()
+                    remaining = min(remaining, paced_wait)
+                
+                # Được đánh thức (tab rảnh / waiter trước rời hàng) → kiểm tra;
+                # hết hạn poll/pacing → chỉ waiter đầu hàng kiểm tra (giữ FIFO)
+                woken = await self.tab_queue.wait(waiter, remaining)
+                may_check = woken or self.tab_queue.is_head(waiter)
+        finally:
+            if waiter is not None:
+                self.tab_queue.leave(waiter)
+    
+    def get_detailed_status(self) -> dict:
+        return {
+            **self.get_connection_status(),
+            "connections": [connection.get_stats() for connection in self.connection_pool.all()],
+            "tab_queue": self.tab_queue.get_stats(),
+            "tab_leases": len(self.tab_leases),
+            "tab_scheduler": self.tab_scheduler.get_stats(),
+            "tab_health": self.tab_health.get_stats(),
+            "tab_pacing": self.tab_pacing.get_stats(),
+            "prompt_cache": self.prompt_store.get_stats(),
+            "image_cache": self.image_cache.get_stats(),
+            "conversation_index": self.conversations.get_stats(),
+            "cancelled_requests": self.cancelled_requests,
+            "connection_lost_failures": self.connection_lost_failures,
+            "in_flight_by_connection": {
+                connection_id: len(request_ids) for connection_id, request_ids in self.connection_requests.items()
+            },
+            "hedging": self.hedge_stats,
+            "retries": self.retry_policy.get_stats(),
+            "request_states": self.request_states.get_stats(),
+            "deadlines": self.deadlines.get_stats()
+        }
+    
+    def schedule_request_cleanup(self, request_id: str, delay: float = 30.0):
+        """Xoá mapping request → tab/connection sau `delay` giây (gọi lại sẽ thay deadline cũ)"""
+        self.deadlines.schedule(request_id, delay, lambda: self._cleanup_request_mapping(request_id))
+    
+    def _cleanup_request_mapping(self, request_id: str):
+        if request_id in self.request_to_tab:
+            self.request_to_tab.pop(request_id, None)
+            self.request_to_connection.pop(request_id, None)
@@ -0,0 +1,106 @@
+"""
+System prompt cache (content-addressed) giữa backend và ZenTab
+System prompt của Cline dài hàng chục KB nhưng gần như không đổi giữa các task →
+chỉ gửi full text lần đầu connection thấy hash đó, các lần sau chỉ gửi hash
+
+Protocol (chỉ áp dụng khi ZenTab kết nối với ?capabilities=promptCache):
+- sendPrompt lần đầu: {"systemPrompt": "...", "systemPromptHash": H} → ZenTab lưu H → text
+- sendPrompt các lần sau: {"systemPromptHash": H} (không có systemPrompt)
+- ZenTab không có H (vd: extension reload): gửi {"type": "unknownSystemPrompt", "requestId", "hash": H}
+  → server trả {"type": "systemPrompt", "requestId", "hash": H, "systemPrompt": "..."}
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+
+PROMPT_CACHE_CAPABILITY = "promptCache"
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class KnownPrompts:
+    """Các hash mà 1 connection ZenTab đã nhận full text (LRU, giới hạn như cache phía extension)"""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, digest: str) -> bool:
+        if digest not in self._hashes:
+            return False
+        self._hashes.move_to_end(digest)
+        return True
+
+    def add(self, digest: str):
+        self._hashes[digest] = None
+        self._hashes.move_to_end(digest)
+        while len(self._hashes) > self.max_entries:
+            self._hashes.popitem(last=False)
+
+    def discard(self, digest: str):
+        self._hashes.pop(digest, None)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+class PromptStore:
+    """
+    hash → system prompt (LRU) phía backend, dùng để gửi lại khi ZenTab báo
+    unknownSystemPrompt. Giữ luôn thống kê bytes tiết kiệm được.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._prompts: "OrderedDict[str, str]" = OrderedDict()
+
+        self.stats = {"sent_full": 0, "sent_hash": 0, "bytes_saved": 0, "resent": 0, "missing": 0}
+
+    def put(self, text: str) -> str:
+        digest = prompt_hash(text)
+        if digest in self._prompts:
+            self._prompts.move_to_end(digest)
+        else:
+            self._prompts[digest] = text
+            while len(self._prompts) > self.max_entries:
+                self._prompts.popitem(last=False)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        text = self._prompts.get(digest)
+        if text is not None:
+            self._prompts.move_to_end(digest)
+        return text
+
+    def apply(self, message: dict, known: KnownPrompts) -> dict:
+        """
+        Thay systemPrompt trong sendPrompt bằng hash nếu connection đã có text đó.
+
+        Returns:
+            dict: Message mới (message gốc không bị sửa - hedge/retry còn dùng lại)
+        """
+        text = message.get("systemPrompt")
+        if not text:
+            return message
+
+        digest = self.put(text)
+        if digest in known:
+            self.stats["sent_hash"] += 1
+            self.stats["bytes_saved"] += len(text)
+            cached = {key: value for key, value in message.items() if key != "systemPrompt"}
+            cached["systemPromptHash"] = digest
+            return cached
+
+        # Đánh dấu ngay: request kế tiếp trên cùng socket đến sau message này
+        known.add(digest)
+        self.stats["sent_full"] += 1
+        return {**message, "systemPromptHash": digest}
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self._prompts)
+        }
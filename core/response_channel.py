@@ -0,0 +1,97 @@
+"""
+Response channel cho 1 request - nhận từng delta (promptChunk) và response cuối (promptResponse)
+Thay cho 1 Future đơn lẻ để có thể relay token ngay khi ZenTab gửi lên
+"""
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+
+EVENT_DELTA = "delta"
+EVENT_FINAL = "final"
+
+# Số delta tối đa chờ seq còn thiếu; vượt quá → bỏ qua chỗ thiếu, flush theo thứ tự seq
+MAX_PENDING_DELTAS = 256
+
+
+class ResponseChannel:
+    """
+    Channel async cho 1 request.
+
+    Delta có `seq` được sắp xếp lại theo thứ tự (reorder buffer); delta trùng
+    hoặc đến sau khi đã có response cuối bị bỏ qua.
+
+    - first_seq: seq của delta đầu tiên nếu nơi dispatch biết; None → lấy seq nhận đầu tiên
+    - Buffer giữ tối đa max_pending delta; seq thiếu quá lâu → bỏ qua (gaps_skipped)
+    """
+
+    def __init__(self, first_seq: Optional[int] = None, max_pending: int = MAX_PENDING_DELTAS):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._next_seq = first_seq
+        self._pending: Dict[int, str] = {}
+        self.max_pending = max_pending
+        self.closed = False
+        self.delta_count = 0
+        self.gaps_skipped = 0
+
+    def push_delta(self, text: str, seq: Optional[int] = None):
+        if self.closed or not text:
+            return
+
+        if seq is None:
+            # ZenTab không đánh số → coi như đúng thứ tự
+            self._emit_delta(text)
+            return
+
+        if self._next_seq is None:
+            self._next_seq = seq
+
+        if seq < self._next_seq or seq in self._pending:
+            return
+
+        self._pending[seq] = text
+        if len(self._pending) > self.max_pending:
+            # Seq còn thiếu không tới nữa → flush buffer theo thứ tự, tiếp tục sau seq lớn nhất
+            self.gaps_skipped += 1
+            for pending_seq in sorted(self._pending):
+                self._emit_delta(self._pending[pending_seq])
+            self._next_seq = pending_seq + 1
+            self._pending.clear()
+            return
+
+        while self._next_seq in self._pending:
+            self._emit_delta(self._pending.pop(self._next_seq))
+            self._next_seq += 1
+
+    def _emit_delta(self, text: str):
+        self.delta_count += 1
+        self._queue.put_nowait((EVENT_DELTA, text))
+
+    def push_final(self, response: dict):
+        if self.closed:
+            return
+        self.closed = True
+
+        # Delta còn kẹt trong reorder buffer (thiếu seq) - response cuối đã chứa đủ nội dung
+        self._pending.clear()
+        self._queue.put_nowait((EVENT_FINAL, response))
+
+    async def events(self, timeout: float) -> AsyncIterator[Tuple[str, object]]:
+        """
+        Yield (EVENT_DELTA, text) cho tới (EVENT_FINAL, response).
+
+        Raises:
+            asyncio.TimeoutError: Khi quá `timeout` giây (tính từ lúc bắt đầu) chưa có response cuối
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+
+            event_type, payload = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            yield event_type, payload
+
+            if event_type == EVENT_FINAL:
+                return
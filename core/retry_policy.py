@@ -0,0 +1,62 @@
+"""
+Retry policy cho new task bị lỗi phía tab (TAB_ERROR / COOLING_DOWN / CONNECTION_LOST)
+Budget theo request + exponential backoff + token bucket giới hạn tổng số retry
+"""
+import random
+import time
+
+
+RETRYABLE_ERROR_TYPES = ("TAB_ERROR", "COOLING_DOWN", "CONNECTION_LOST")
+
+
+class RetryPolicy:
+    """
+    - `max_retries`: số lần gửi lại tối đa cho 1 request
+    - `backoff(n)`: base_delay * 2^n (có jitter), tối đa max_delay
+    - `try_acquire()`: token bucket `rate_per_minute` dùng chung mọi request
+      → khi nhiều tab cùng lỗi, retry không nhân lên thành "bão" request
+    """
+
+    def __init__(self, max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 4.0,
+                 rate_per_minute: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_per_minute = rate_per_minute
+
+        # Cho phép burst tối đa bằng số retry/phút
+        self._capacity = max(rate_per_minute, 1.0)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+
+        self.stats = {"retries": 0, "succeeded": 0, "exhausted": 0, "rate_limited": 0, "no_free_tab": 0}
+
+    @staticmethod
+    def is_retryable(response) -> bool:
+        return isinstance(response, dict) and response.get("error_type") in RETRYABLE_ERROR_TYPES
+
+    def backoff(self, retry_number: int) -> float:
+        delay = min(self.base_delay * (2 ** retry_number), self.max_delay)
+        # Jitter ±20% để các request lỗi cùng lúc không retry đồng loạt
+        return delay * random.uniform(0.8, 1.2)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self.rate_per_minute / 60.0)
+        self._last_refill = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens < 1.0:
+            self.stats["rate_limited"] += 1
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def get_stats(self) -> dict:
+        self._refill()
+        return {
+            **self.stats,
+            "max_retries": self.max_retries,
+            "available_tokens": round(self._tokens, 2)
+        }
@@ -0,0 +1,164 @@
+"""
+Tab health - circuit breaker theo tab
+Tab lỗi/timeout liên tiếp bị quarantine (TabStatus.ERROR) với exponential backoff,
+hết hạn thì cho đúng 1 request "probe" (half-open) trước khi dùng lại bình thường
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+from models import TabStatus
+
+
+TabKey = Tuple[str, int]
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Lỗi rate limit phía provider - TabPacing đã xử lý (cooldown), tab không hỏng
+PACING_ERROR_TYPES = ("COOLING_DOWN",)
+
+
+class TabHealth:
+    """Trạng thái breaker của 1 tab"""
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.error_counts: Dict[str, int] = {}
+        self.last_error_type: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": TabStatus.ERROR.value if self.state == STATE_OPEN else self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "quarantine_remaining": max(self.open_until - time.time(), 0.0) if self.state == STATE_OPEN else 0.0,
+            "probe_in_flight": self.probe_in_flight,
+            "error_counts": dict(self.error_counts),
+            "last_error_type": self.last_error_type
+        }
+
+
+class TabHealthTracker:
+    """
+    Circuit breaker cho từng tab (key = (connection_id, tab_id)).
+
+    - closed: dùng bình thường; `failure_threshold` lỗi liên tiếp → open
+    - open: quarantine `base_quarantine * 2^(trips-1)` giây (tối đa `max_quarantine`)
+    - half_open: hết quarantine → chỉ 1 probe request tại một thời điểm;
+      probe thành công → closed (reset backoff), thất bại → open lâu hơn
+    - Lỗi PACING_ERROR_TYPES không tính là lỗi của tab (chỉ trả lại slot probe)
+    """
+
+    def __init__(self, failure_threshold: int = 3, base_quarantine: float = 30.0, max_quarantine: float = 600.0):
+        self.failure_threshold = failure_threshold
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+
+        self._tabs: Dict[TabKey, TabHealth] = {}
+        self.quarantine_count = 0
+
+    def _refresh(self, health: TabHealth):
+        if health.state == STATE_OPEN and health.open_until <= time.time():
+            health.state = STATE_HALF_OPEN
+            health.probe_in_flight = False
+
+    def status(self, key: TabKey) -> TabStatus:
+        health = self._tabs.get(key)
+        if health is None:
+            return TabStatus.FREE
+        self._refresh(health)
+        return TabStatus.ERROR if health.state == STATE_OPEN else TabStatus.FREE
+
+    def allow_request(self, key: TabKey) -> bool:
+        """Tab có được nhận request mới không (quarantine hoặc đang có probe → không)"""
+        health = self._tabs.get(key)
+        if health is None:
+            return True
+
+        self._refresh(health)
+        if health.state == STATE_OPEN:
+            return False
+        if health.state == STATE_HALF_OPEN:
+            return not health.probe_in_flight
+        return True
+
+    def on_dispatch(self, key: TabKey) -> bool:
+        """Gọi khi tab được lease. Trả về True nếu request này là probe (half-open)."""
+        health = self._tabs.get(key)
+        if health is None:
+            return False
+
+        self._refresh(health)
+        if health.state == STATE_HALF_OPEN:
+            health.probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self, key: TabKey):
+        """Probe kết thúc mà không có kết quả (cancel/gửi lỗi) → cho probe khác"""
+        health = self._tabs.get(key)
+        if health is not None:
+            health.probe_in_flight = False
+
+    def record(self, key: TabKey, success: bool, error_type: Optional[str] = None) -> Optional[float]:
+        """
+        Ghi kết quả 1 request của tab.
+
+        Returns:
+            float | None: Thời gian quarantine (giây) nếu tab vừa bị quarantine
+        """
+        if not success and error_type in PACING_ERROR_TYPES:
+            self.release_probe(key)
+            return None
+
+        health = self._tabs.get(key)
+        if health is None:
+            if success:
+                return None
+            health = self._tabs[key] = TabHealth()
+
+        self._refresh(health)
+        health.probe_in_flight = False
+
+        if success:
+            health.state = STATE_CLOSED
+            health.consecutive_failures = 0
+            health.trips = 0
+            return None
+
+        error_type = error_type or "UNKNOWN"
+        health.consecutive_failures += 1
+        health.error_counts[error_type] = health.error_counts.get(error_type, 0) + 1
+        health.last_error_type = error_type
+
+        if health.state == STATE_HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+            health.trips += 1
+            duration = min(self.base_quarantine * (2 ** (health.trips - 1)), self.max_quarantine)
+            health.state = STATE_OPEN
+            health.open_until = time.time() + duration
+            self.quarantine_count += 1
+            return duration
+
+        return None
+
+    def forget_connection(self, connection_id: str):
+        for key in [key for key in self._tabs if key[0] == connection_id]:
+            self._tabs.pop(key, None)
+
+    def get_stats(self) -> dict:
+        quarantined = 0
+        for health in self._tabs.values():
+            self._refresh(health)
+            if health.state == STATE_OPEN:
+                quarantined += 1
+
+        return {
+            "quarantined": quarantined,
+            "total_quarantines": self.quarantine_count,
+            "tabs": {f"{key[0]}:{key[1]}": health.to_dict() for key, health in self._tabs.items()}
+        }
@@ -0,0 +1,188 @@
+"""
+Pacing theo tab và theo account DeepSeek
+Học cooldown window từ lỗi COOLING_DOWN / "not ready" và số request/phút mà account
+chịu được, để giữ request lại local tới thời điểm dự đoán tab sẵn sàng thay vì gửi
+prompt chắc chắn bị từ chối
+"""
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+TabKey = Tuple[str, int]
+
+# "wait 30s", "retry after 45 seconds", "cooling down (12s)"...
+_SECONDS_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:s\b|sec|secs|second|seconds)", re.IGNORECASE)
+# Window có ít request hơn thì không đủ để suy ra giới hạn (1 lỗi "not ready" sau
+# 1 request không có nghĩa account chỉ chịu được 1 request/window)
+MIN_LEARNED_LIMIT = 2
+
+
+def account_key(tab: dict) -> str:
+    """
+    Nhóm account của tab. ZenTab có thể gửi accountId; nếu không, mỗi connection
+    (1 browser profile) được coi là 1 account DeepSeek.
+    """
+    return str(tab.get('accountId') or tab.get('connectionId'))
+
+
+class AccountPacing:
+    """Cooldown đã học + lịch sử dispatch trong window của 1 account"""
+
+    def __init__(self, default_cooldown: float):
+        self.cooldown = default_cooldown
+        self.ready_at = 0.0
+        self.consecutive_cooldowns = 0
+        # Số request/window mà account chịu được (None = chưa bị throttle lần nào)
+        self.learned_limit: Optional[float] = None
+        self.dispatches: Deque[float] = deque()
+        self.cooldown_count = 0
+
+
+class TabPacing:
+    """
+    - Lỗi COOLING_DOWN → tab và account của nó "không sẵn sàng" trong cooldown window.
+      Window lấy từ error message nếu có số giây, không thì dùng giá trị đã học
+      (gấp đôi khi bị cooldown liên tiếp, giảm dần khi request thành công).
+    - Mỗi lần bị throttle, số request account đã gửi trong `window` giây được ghi lại
+      làm learned_limit (EWMA, tối thiểu MIN_LEARNED_LIMIT, window ít request hơn thì
+      bỏ qua; tăng dần khi request thành công); sau cooldown, khi số
+      request trong window chạm limit thì account được pace tới lúc request cũ nhất
+      ra khỏi window.
+    """
+
+    def __init__(self, window: float = 60.0, default_cooldown: float = 20.0, max_cooldown: float = 300.0):
+        self.window = window
+        self.default_cooldown = default_cooldown
+        self.max_cooldown = max_cooldown
+
+        self._accounts: Dict[str, AccountPacing] = {}
+        self._tab_ready_at: Dict[TabKey, float] = {}
+        self._dispatched: Dict[str, Tuple[TabKey, str]] = {}
+
+        self.paced_count = 0
+
+    @staticmethod
+    def tab_key(tab: dict) -> TabKey:
+        return (tab.get('connectionId'), tab.get('tabId'))
+
+    def _account(self, key: str) -> AccountPacing:
+        account = self._accounts.get(key)
+        if account is None:
+            account = self._accounts[key] = AccountPacing(self.default_cooldown)
+        return account
+
+    def _trim(self, account: AccountPacing, now: float):
+        while account.dispatches and account.dispatches[0] <= now - self.window:
+            account.dispatches.popleft()
+
+    def ready_in(self, tab: dict) -> float:
+        """Số giây tới khi tab (và account của nó) dự kiến nhận request được, 0 = sẵn sàng"""
+        now = time.time()
+        wait = self._tab_ready_at.get(self.tab_key(tab), 0.0) - now
+
+        account = self._accounts.get(account_key(tab))
+        if account is not None:
+            wait = max(wait, account.ready_at - now)
+
+            if account.learned_limit is not None:
+                self._trim(account, now)
+                if len(account.dispatches) >= max(account.learned_limit, 1.0):
+                    wait = max(wait, account.dispatches[0] + self.window - now)
+
+        return max(wait, 0.0)
+
+    def is_ready(self, tab: dict) -> bool:
+        return self.ready_in(tab) <= 0.0
+
+    def record_dispatch(self, request_id: str, tab: dict):
+        now = time.time()
+        key = account_key(tab)
+        account = self._account(key)
+        self._trim(account, now)
+        account.dispatches.append(now)
+        self._dispatched[request_id] = (self.tab_key(tab), key)
+
+    def discard(self, request_id: str):
+        self._dispatched.pop(request_id, None)
+
+    def record_result(self, request_id: str, error_type: Optional[str] = None,
+                      error_message: Optional[str] = None) -> Optional[float]:
+        """
+        Ghi kết quả request. Trả về cooldown (giây) nếu vừa học được cooldown mới.
+        """
+        dispatched = self._dispatched.pop(request_id, None)
+        if dispatched is None:
+            return None
+
+        tab_key, key = dispatched
+        account = self._account(key)
+
+        if error_type != "COOLING_DOWN":
+            if error_type is None:
+                # Thành công → nới dần cooldown đã học về mặc định
+                account.consecutive_cooldowns = 0
+                account.cooldown = max(self.default_cooldown, account.cooldown * 0.9)
+                # Additive increase: thăm dò dần giới hạn thật của provider
+                if account.learned_limit is not None:
+                    account.learned_limit += 1.0 / account.learned_limit
+            return None
+
+        now = time.time()
+        account.consecutive_cooldowns += 1
+        account.cooldown_count += 1
+
+        match = _SECONDS_PATTERN.search(error_message or "")
+        if match:
+            cooldown = float(match.group(1))
+        elif account.consecutive_cooldowns > 1:
+            cooldown = account.cooldown * 2
+        else:
+            cooldown = account.cooldown
+        cooldown = min(max(cooldown, 1.0), self.max_cooldown)
+        account.cooldown = cooldown
+
+        # Số request account đã gửi trong window lúc bị throttle ≈ giới hạn thực
+        self._trim(account, now)
+        observed = len(account.dispatches) - 1
+        if observed >= MIN_LEARNED_LIMIT:
+            if account.learned_limit is None:
+                account.learned_limit = float(observed)
+            else:
+                account.learned_limit = max(0.7 * account.learned_limit + 0.3 * observed, MIN_LEARNED_LIMIT)
+        # Provider bắt đầu window mới sau cooldown → đếm lại từ đầu
+        account.dispatches.clear()
+
+        account.ready_at = max(account.ready_at, now + cooldown)
+        self._tab_ready_at[tab_key] = now + cooldown
+
+        return cooldown
+
+    def note_paced(self):
+        self.paced_count += 1
+
+    def forget_connection(self, connection_id: str):
+        for key in [key for key in self._tab_ready_at if key[0] == connection_id]:
+            self._tab_ready_at.pop(key, None)
+        self._accounts.pop(str(connection_id), None)
+
+    def get_stats(self) -> dict:
+        now = time.time()
+        accounts = {}
+        for key, account in self._accounts.items():
+            self._trim(account, now)
+            accounts[key] = {
+                "cooldown": round(account.cooldown, 2),
+                "ready_in": round(max(account.ready_at - now, 0.0), 2),
+                "learned_limit": round(account.learned_limit, 2) if account.learned_limit is not None else None,
+                "requests_in_window": len(account.dispatches),
+                "cooldown_count": account.cooldown_count
+            }
+
+        return {
+            "window": self.window,
+            "paced": self.paced_count,
+            "accounts": accounts,
+            "tabs_cooling": sum(1 for ready_at in self._tab_ready_at.values() if ready_at > now)
+        }
@@ -0,0 +1,147 @@
+"""
+Hàng đợi chờ tab rảnh (admission control)
+Thay vì trả 503 ngay khi hết tab, request được xếp hàng FIFO theo folder
+và được đánh thức ngay khi có tab phù hợp rảnh
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict
+
+
+# Key cho request new task - nhận bất kỳ tab rảnh nào
+NEW_TASK_KEY = "__new_task__"
+
+
+class QueueFullError(Exception):
+    """Hàng đợi đã đầy - request bị từ chối ngay"""
+    pass
+
+
+class TabWaiter:
+    """1 request đang xếp hàng - giữ nguyên vị trí trong hàng tới khi leave()"""
+
+    __slots__ = ("key", "event")
+
+    def __init__(self, key: str):
+        self.key = key
+        # Được set khi tới lượt kiểm tra tab (có tab rảnh / waiter phía trước rời hàng)
+        self.event = asyncio.Event()
+
+
+class TabWaitQueue:
+    """
+    Wait queue trước bước chọn tab.
+
+    - Request tiếp tục task cũ chờ theo key = folderPath (chỉ dùng được tab đã link folder đó)
+    - Request new task chờ theo key = NEW_TASK_KEY (dùng được mọi tab rảnh)
+
+    Waiter giữ vị trí trong hàng cả khi đang kiểm tra tab (request mới không chen ngang).
+    Khi 1 tab rảnh: đánh thức waiter cũ nhất chưa được đánh thức của folder của tab,
+    sau đó tới waiter new task. Waiter rời hàng thì đánh thức waiter kế tiếp.
+    """
+
+    def __init__(self, max_depth: int = 50, max_wait: float = 60.0):
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+
+        self._waiters: Dict[str, Deque[TabWaiter]] = {}
+        self._depth = 0
+
+        self.total_enqueued = 0
+        self.total_rejected = 0
+        self.total_timeouts = 0
+        self._recent_wait_times: Deque[float] = deque(maxlen=200)
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def has_waiters(self, key: str) -> bool:
+        return bool(self._waiters.get(key))
+
+    def join(self, key: str) -> TabWaiter:
+        """
+        Xếp vào cuối hàng của key (folderPath hoặc NEW_TASK_KEY)
+
+        Raises:
+            QueueFullError: Khi hàng đợi đã đạt max_depth
+        """
+        if self._depth >= self.max_depth:
+            self.total_rejected += 1
+            raise QueueFullError(f"Tab wait queue is full ({self._depth}/{self.max_depth})")
+
+        waiter = TabWaiter(key)
+        self._waiters.setdefault(key, deque()).append(waiter)
+        self._depth += 1
+        self.total_enqueued += 1
+        return waiter
+
+    def leave(self, waiter: TabWaiter):
+        """Rời hàng (đã có tab hoặc hết thời gian chờ) - waiter kế tiếp được kiểm tra ngay"""
+        waiters = self._waiters.get(waiter.key)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+
+        self._depth -= 1
+        if not waiters:
+            self._waiters.pop(waiter.key, None)
+            return
+        self._wake_one(waiter.key)
+
+    def is_head(self, waiter: TabWaiter) -> bool:
+        waiters = self._waiters.get(waiter.key)
+        return bool(waiters) and waiters[0] is waiter
+
+    async def wait(self, waiter: TabWaiter, timeout: float) -> bool:
+        """
+        Chờ tới lượt (được đánh thức) hoặc hết timeout.
+
+        Returns:
+            bool: True nếu được đánh thức, False nếu timeout
+        """
+        try:
+            await asyncio.wait_for(waiter.event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        # Clear sau khi thức: notify đến trong lúc đang kiểm tra tab sẽ đánh thức lại ngay
+        waiter.event.clear()
+        return True
+
+    def _wake_one(self, key: str) -> bool:
+        for waiter in self._waiters.get(key, ()):
+            if not waiter.event.is_set():
+                waiter.event.set()
+                return True
+        return False
+
+    def notify_tab_free(self, tab: dict) -> bool:
+        """Đánh thức đúng 1 waiter phù hợp với tab vừa rảnh"""
+        folder_path = tab.get('folderPath')
+        if folder_path and self._wake_one(folder_path):
+            return True
+        return self._wake_one(NEW_TASK_KEY)
+
+    def record_wait(self, wait_seconds: float, timed_out: bool = False):
+        self._recent_wait_times.append(wait_seconds)
+        if timed_out:
+            self.total_timeouts += 1
+
+    def get_stats(self) -> dict:
+        wait_times = sorted(self._recent_wait_times)
+        p95_wait = wait_times[int(len(wait_times) * 0.95) - 1] if wait_times else 0.0
+
+        return {
+            "depth": self._depth,
+            "max_depth": self.max_depth,
+            "max_wait": self.max_wait,
+            "depth_by_key": {key: len(waiters) for key, waiters in self._waiters.items()},
+            "total_enqueued": self.total_enqueued,
+            "total_rejected": self.total_rejected,
+            "total_timeouts": self.total_timeouts,
+            "avg_wait": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "p95_wait": p95_wait
+        }
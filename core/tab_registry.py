@@ -0,0 +1,180 @@
+"""
+Tab registry - trạng thái tabs được ZenTab push lên qua WebSocket
+Giữ index folder → tabs và tập tabs rảnh để chọn tab mà không cần round trip
+"""
+import time
+from typing import Dict, List, Optional, Set
+
+
+def is_tab_free(tab: dict) -> bool:
+    """Tab thực sự rảnh khi canAccept=true và status=free"""
+    return bool(tab.get('canAccept', False)) and tab.get('status') == 'free'
+
+
+class TabRegistry:
+    """
+    In-memory registry của tabs ZenTab.
+
+    - `_tabs`: tabId → tab state mới nhất
+    - `_folder_index`: folderPath (None = chưa link) → set tabId
+    - `_free`: set tabId đang rảnh
+
+    `version` là generation counter do ZenTab gửi kèm mỗi delta. Nếu delta
+    nhảy version (mất message) thì registry bị đánh dấu `stale` và caller
+    phải resync bằng một snapshot đầy đủ (getAvailableTabs).
+
+    Mỗi ZenTab connection có registry riêng; tab state được gắn `connectionId`
+    để routing biết gửi prompt qua connection nào.
+    """
+
+    def __init__(self, connection_id: Optional[str] = None):
+        self.connection_id = connection_id
+        self._tabs: Dict[int, dict] = {}
+        self._folder_index: Dict[Optional[str], Set[int]] = {}
+        self._free: Set[int] = set()
+
+        self.version: Optional[int] = None
+        self.stale = True
+        self.push_enabled = False
+        self.last_update_time = 0.0
+
+    def _index_tab(self, tab_id: int, tab: dict) -> bool:
+        """Cập nhật indexes cho 1 tab. Trả về True nếu tab vừa chuyển sang rảnh."""
+        old_tab = self._tabs.get(tab_id)
+        if old_tab is not None:
+            old_folder = old_tab.get('folderPath')
+            folder_tabs = self._folder_index.get(old_folder)
+            if folder_tabs is not None:
+                folder_tabs.discard(tab_id)
+                if not folder_tabs:
+                    self._folder_index.pop(old_folder, None)
+
+        was_free = tab_id in self._free
+        if self.connection_id is not None:
+            tab['connectionId'] = self.connection_id
+        self._tabs[tab_id] = tab
+        self._folder_index.setdefault(tab.get('folderPath'), set()).add(tab_id)
+
+        if is_tab_free(tab):
+            self._free.add(tab_id)
+            return not was_free
+
+        self._free.discard(tab_id)
+        return False
+
+    def _remove_tab(self, tab_id: int):
+        tab = self._tabs.pop(tab_id, None)
+        self._free.discard(tab_id)
+        if tab is None:
+            return
+
+        folder = tab.get('folderPath')
+        folder_tabs = self._folder_index.get(folder)
+        if folder_tabs is not None:
+            folder_tabs.discard(tab_id)
+            if not folder_tabs:
+                self._folder_index.pop(folder, None)
+
+    def apply_snapshot(self, tabs: list, version: Optional[int] = None) -> List[dict]:
+        """
+        Thay toàn bộ state bằng snapshot đầy đủ từ ZenTab.
+
+        Returns:
+            list: Tabs vừa chuyển sang trạng thái rảnh
+        """
+        valid_tabs = {
+            tab['tabId']: tab for tab in tabs
+            if isinstance(tab, dict) and isinstance(tab.get('tabId'), int)
+        }
+
+        for tab_id in list(self._tabs.keys()):
+            if tab_id not in valid_tabs:
+                self._remove_tab(tab_id)
+
+        newly_free = [tab for tab_id, tab in valid_tabs.items() if self._index_tab(tab_id, tab)]
+
+        if version is not None:
+            self.version = version
+        self.stale = False
+        self.last_update_time = time.time()
+
+        return newly_free
+
+    def apply_delta(
+        self,
+        tabs: list,
+        removed_tab_ids: Optional[list] = None,
+        version: Optional[int] = None
+    ) -> Optional[List[dict]]:
+        """
+        Áp dụng delta (chỉ các tabs thay đổi) từ ZenTab.
+
+        Returns:
+            list | None: Tabs vừa rảnh, hoặc None nếu delta bị lệch version
+            (registry đã bị đánh dấu stale, caller cần resync)
+        """
+        if version is not None and self.version is not None and version != self.version + 1:
+            if version <= self.version:
+                # Delta cũ đến trễ - bỏ qua
+                return []
+            self.stale = True
+            return None
+
+        newly_free = self.upsert_tabs(tabs)
+
+        for tab_id in removed_tab_ids or []:
+            self._remove_tab(tab_id)
+
+        if version is not None:
+            self.version = version
+        self.last_update_time = time.time()
+
+        return newly_free
+
+    def upsert_tabs(self, tabs: list) -> List[dict]:
+        """Cập nhật một phần tabs (không đụng tới version)"""
+        newly_free = []
+        for tab in tabs:
+            if not isinstance(tab, dict) or not isinstance(tab.get('tabId'), int):
+                continue
+            if self._index_tab(tab['tabId'], tab):
+                newly_free.append(tab)
+        return newly_free
+
+    def mark_busy(self, tab_id: int):
+        """Đánh dấu tab busy ngay sau khi gửi prompt, trước khi ZenTab push state mới"""
+        tab = self._tabs.get(tab_id)
+        if tab is None:
+            return
+        self._index_tab(tab_id, {**tab, 'status': 'busy', 'canAccept': False})
+
+    def is_usable(self) -> bool:
+        """Registry chỉ dùng được khi ZenTab đang push state và không bị lệch version"""
+        return self.push_enabled and not self.stale
+
+    def get_tab(self, tab_id: int) -> Optional[dict]:
+        return self._tabs.get(tab_id)
+
+    def free_tabs(self) -> List[dict]:
+        return [self._tabs[tab_id] for tab_id in self._free]
+
+    def free_tabs_by_folder(self, folder_path: Optional[str]) -> List[dict]:
+        folder_tabs = self._folder_index.get(folder_path)
+        if not folder_tabs:
+            return []
+
+        # Duyệt set nhỏ hơn
+        if len(folder_tabs) < len(self._free):
+            return [self._tabs[tab_id] for tab_id in folder_tabs if tab_id in self._free]
+        return [self._tabs[tab_id] for tab_id in self._free if tab_id in folder_tabs]
+
+    def get_stats(self) -> dict:
+        return {
+            "total_tabs": len(self._tabs),
+            "free_tabs": len(self._free),
+            "folders": len([folder for folder in self._folder_index if folder is not None]),
+            "version": self.version,
+            "stale": self.stale,
+            "push_enabled": self.push_enabled,
+            "last_update_age": time.time() - self.last_update_time if self.last_update_time > 0 else None
+        }
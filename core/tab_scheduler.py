@@ -0,0 +1,165 @@
+"""
+Tab scheduler - chọn tab dựa trên latency/error rate quan sát được
+Policy: first_free | least_latency | power_of_two
+"""
+import time
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+TabKey = Tuple[str, int]
+
+POLICY_FIRST_FREE = "first_free"
+POLICY_LEAST_LATENCY = "least_latency"
+POLICY_POWER_OF_TWO = "power_of_two"
+
+POLICIES = (POLICY_FIRST_FREE, POLICY_LEAST_LATENCY, POLICY_POWER_OF_TWO)
+
+
+class TabStats:
+    """Latency EWMA và error rate gần đây của 1 tab"""
+
+    def __init__(self, alpha: float, window: int):
+        self.alpha = alpha
+        self.ewma_latency: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self.samples = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+
+    def record(self, latency: float, success: bool):
+        self.last_latency = latency
+        self.samples += 1
+        self._outcomes.append(success)
+
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def to_dict(self) -> dict:
+        return {
+            "ewma_latency": self.ewma_latency,
+            "last_latency": self.last_latency,
+            "error_rate": self.error_rate,
+            "samples": self.samples
+        }
+
+
+class TabScheduler:
+    """
+    Sắp xếp tabs ứng viên theo expected completion time.
+
+    Expected time = EWMA latency / (1 - error_rate): tab hay lỗi phải gửi lại
+    nhiều lần nên "đắt" hơn. Tab chưa có số liệu dùng trung bình của các tab
+    đã biết để vẫn được thử.
+    """
+
+    def __init__(self, policy: str = POLICY_LEAST_LATENCY, alpha: float = 0.3, window: int = 20,
+                 latency_window: int = 200):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown tab scheduler policy: {policy}. Expected one of {POLICIES}")
+
+        self.policy = policy
+        self.alpha = alpha
+        self.window = window
+
+        self._stats: Dict[TabKey, TabStats] = {}
+        self._dispatched: Dict[str, Tuple[TabKey, float]] = {}
+
+        # Latency của các request thành công gần đây (mọi tab) - dùng cho percentile
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+
+    @staticmethod
+    def tab_key(tab: dict) -> TabKey:
+        return (tab.get('connectionId'), tab.get('tabId'))
+
+    def record_dispatch(self, request_id: str, tab: dict):
+        """Ghi lại thời điểm gửi prompt tới tab"""
+        self._dispatched[request_id] = (self.tab_key(tab), time.time())
+
+    def record_result(self, request_id: str, success: bool) -> Optional[float]:
+        """Ghi kết quả của request (promptResponse hoặc timeout). Trả về latency."""
+        dispatched = self._dispatched.pop(request_id, None)
+        if dispatched is None:
+            return None
+
+        key, start_time = dispatched
+        latency = time.time() - start_time
+
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = TabStats(self.alpha, self.window)
+        stats.record(latency, success)
+
+        if success:
+            self._latencies.append(latency)
+
+        return latency
+
+    def discard(self, request_id: str):
+        self._dispatched.pop(request_id, None)
+
+    def forget_connection(self, connection_id: str):
+        for key in [key for key in self._stats if key[0] == connection_id]:
+            self._stats.pop(key, None)
+
+    def get_tab_stats(self, tab: dict) -> Optional[TabStats]:
+        return self._stats.get(self.tab_key(tab))
+
+    def latency_percentile(self, percentile: float, min_samples: int = 5) -> Optional[float]:
+        """Percentile latency (0-100) của các request thành công gần đây, None nếu chưa đủ mẫu"""
+        if len(self._latencies) < min_samples:
+            return None
+
+        ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * percentile / 100.0), len(ordered) - 1)
+        return ordered[index]
+
+    def _default_expected_time(self) -> float:
+        known = [stats.ewma_latency for stats in self._stats.values() if stats.ewma_latency is not None]
+        return sum(known) / len(known) if known else 0.0
+
+    def expected_time(self, tab: dict, default: Optional[float] = None) -> float:
+        stats = self._stats.get(self.tab_key(tab))
+        if stats is None or stats.ewma_latency is None:
+            return default if default is not None else self._default_expected_time()
+
+        success_rate = max(1.0 - stats.error_rate, 0.05)
+        return stats.ewma_latency / success_rate
+
+    def order(self, candidates: List[dict]) -> List[dict]:
+        """
+        Sắp xếp candidates theo policy. Caller lease theo thứ tự này,
+        nên các phần tử sau là fallback khi tab đầu đã bị lease.
+        """
+        if len(candidates) <= 1 or self.policy == POLICY_FIRST_FREE:
+            return list(candidates)
+
+        default = self._default_expected_time()
+        ranked = sorted(candidates, key=lambda tab: self.expected_time(tab, default))
+
+        if self.policy == POLICY_LEAST_LATENCY:
+            return ranked
+
+        # Power of two choices: chọn ngẫu nhiên 2 tab, lấy tab tốt hơn
+        # (tránh dồn toàn bộ traffic vào 1 tab "nhanh nhất")
+        first, second = random.sample(candidates, 2)
+        best = first if self.expected_time(first, default) <= self.expected_time(second, default) else second
+        return [best] + [tab for tab in ranked if tab is not best]
+
+    def get_stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "in_flight": len(self._dispatched),
+            "latency_samples": len(self._latencies),
+            "tabs": {
+                f"{key[0]}:{key[1]}": stats.to_dict() for key, stats in self._stats.items()
+            }
+        }
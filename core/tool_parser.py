@@ -1,11 +1,230 @@
 """
 Parse tool calls từ DeepSeek response và convert sang OpenAI format
+
+Cả 2 format đều được scan 1 lượt, thời gian tuyến tính theo độ dài output
+(không regex backtracking trên toàn bộ output, không rebuild string mỗi match):
+- XML: lexer tag <name> / </name> → ghép tag mở với tag đóng cùng tên đầu tiên phía sau
+- JSON: object {"name": "...} / {"function": {...}, brace được match (có xử lý
+  string/escape) 1 lần cho mỗi vị trí, hỗ trợ arguments lồng nhau; object đã xét
+  (kể cả JSON lỗi) được bỏ qua nguyên span
+- function_call: {name: "...", arguments: {...}} (không phải JSON) giữ nguyên cách
+  match của regex cũ: tới '}' đầu tiên, không xét string → cùng output với input lỗi
+  (dấu " lẻ...), arguments không lồng nhau
+Text còn lại được ghép 1 lần từ các span nằm ngoài tool call.
+
+Khác regex cũ (chỉ với input lỗi/hiếm): object JSON được match theo brace thật nên
+arguments lồng nhau hoặc có '}' trong string vẫn được nhận (tối đa MAX_TOOL_DEPTH cấp);
+text còn lại bỏ đúng các span tool call (regex cũ replace mọi chỗ trùng chuỗi).
 """
 import re
 import json
 import uuid
 from typing import Dict, List, Tuple, Optional
 
+from core import json_codec
+
+
+Span = Tuple[int, int]
+
+# Tag XML: <name> hoặc </name> (không có '<' bên trong → token không chồng lên nhau)
+_XML_TAG = re.compile(r'<(/?)([a-zA-Z_][a-zA-Z0-9_]*)>')
+_EXTRA_BLANK_LINES = re.compile(r'\n\s*\n\s*\n')
+
+# Điểm bắt đầu của JSON tool call: {"name": "... / {"function": {...
+_JSON_OBJECT_START = re.compile(r'\{\s*"(?:name"\s*:\s*"|function"\s*:\s*\{)')
+# Ký tự có ý nghĩa khi match brace: '{', '}', '"' (ngoài string), '"', '\\' (trong string)
+_BRACE_TOKEN = re.compile(r'[{}"\\]')
+# Object lồng sâu hơn không được decode (tool call thật chỉ vài cấp; decode object
+# hàng nghìn cấp tốn hơn cả việc tìm nó)
+MAX_TOOL_DEPTH = 64
+
+# Regex cũ cho function_call: {name: "...", arguments: {...}}
+_FUNCTION_CALL = re.compile(r'function_call\s*:\s*\{[^}]+\}')
+_FUNCTION_CALL_NAME = re.compile(r'name\s*:\s*"([^"]+)"')
+_FUNCTION_CALL_ARGUMENTS = re.compile(r'arguments\s*:\s*(\{[^}]+\})')
+
+
+def _make_tool_call(name: str, arguments) -> Dict:
+    return {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {
+            "name": name,
+            "arguments": arguments
+        }
+    }
+
+
+def _text_outside(content: str, spans: List[Span]) -> str:
+    """Ghép các đoạn text nằm ngoài spans (spans đã sort theo start, có thể chồng nhau)"""
+    if not spans:
+        return content
+
+    parts = []
+    position = 0
+    for start, end in spans:
+        if start > position:
+            parts.append(content[position:start])
+        position = max(position, end)
+    parts.append(content[position:])
+    return "".join(parts)
+
+
+class _BraceMatcher:
+    """
+    Vị trí '}' tương ứng của mỗi '{' (bỏ qua brace trong string JSON, xử lý escape).
+
+    Mỗi lần scan ghi lại kết quả cho mọi '{' cấu trúc gặp trên đường đi; '{' nằm trong
+    vùng đã scan mà không có kết quả là brace trong string → coi như không match.
+    Mỗi ký tự được scan tối đa 1 lần.
+    """
+
+    def __init__(self, content: str):
+        self.content = content
+        # Vị trí '{' → (vị trí '}' đóng hoặc -1, độ sâu lồng nhau lớn nhất bên trong)
+        self._ends: Dict[int, Tuple[int, int]] = {}
+        self._scanned_until = 0
+
+    def match(self, start: int) -> Tuple[int, int]:
+        """(index của '}' đóng '{' tại start hoặc -1, độ sâu lồng nhau lớn nhất)"""
+        result = self._ends.get(start)
+        if result is not None:
+            return result
+        if start < self._scanned_until:
+            return -1, 0
+        return self._scan(start)
+
+    def _scan(self, start: int) -> Tuple[int, int]:
+        ends = self._ends
+        # Vị trí các '{' đang mở và độ sâu lớn nhất đã thấy bên trong mỗi '{'
+        stack: List[int] = []
+        peaks: List[int] = []
+        in_string = False
+        escaped_at = -1
+        position = len(self.content)
+
+        for token in _BRACE_TOKEN.finditer(self.content, start):
+            index = token.start()
+            if index == escaped_at:
+                continue
+            char = token.group()
+
+            if in_string:
+                if char == '\\':
+                    escaped_at = index + 1
+                elif char == '"':
+                    in_string = False
+                continue
+
+            if char == '"':
+                in_string = True
+            elif char == '{':
+                stack.append(index)
+                peaks.append(len(stack))
+            elif char == '}':
+                opened = stack.pop()
+                peak = peaks.pop()
+                ends[opened] = (index, peak - len(stack))
+                if not stack:
+                    position = index + 1
+                    break
+                peaks[-1] = max(peaks[-1], peak)
+
+        # '{' chưa đóng khi hết content
+        for unmatched in stack:
+            ends[unmatched] = (-1, 0)
+        self._scanned_until = max(self._scanned_until, position)
+        return ends[start]
+
+
+def _json_tool_from_data(tool_data) -> Optional[Dict]:
+    if not isinstance(tool_data, dict):
+        return None
+
+    tool_name = None
+    tool_args = None
+
+    if "name" in tool_data and "arguments" in tool_data:
+        tool_name = tool_data["name"]
+        tool_args = tool_data["arguments"]
+
+    elif "function" in tool_data and isinstance(tool_data["function"], dict):
+        if "name" in tool_data["function"] and "arguments" in tool_data["function"]:
+            tool_name = tool_data["function"]["name"]
+            tool_args = tool_data["function"]["arguments"]
+
+    if not (tool_name and tool_args):
+        return None
+
+    return _make_tool_call(tool_name, json.dumps(tool_args) if isinstance(tool_args, dict) else tool_args)
+
+
+def _scan_json_objects(content: str, last_arguments: int, spans: List[Span], tool_calls: List[Dict]):
+    braces = _BraceMatcher(content)
+    position = 0
+
+    while True:
+        match = _JSON_OBJECT_START.search(content, position, last_arguments)
+        if match is None:
+            break
+
+        start = match.start()
+        end, depth = braces.match(start)
+        if end < 0:
+            # Object không đóng → không thể là JSON hợp lệ, tìm tiếp bên trong
+            position = start + 1
+            continue
+
+        # Object đã xét (tool call, JSON khác hay JSON lỗi) → không tìm tiếp bên trong
+        position = end + 1
+        if depth > MAX_TOOL_DEPTH:
+            continue
+        try:
+            tool_data = json_codec.loads(content[start:end + 1])
+        except (json_codec.DecodeError, ValueError, RecursionError):
+            continue
+
+        tool_call = _json_tool_from_data(tool_data)
+        if tool_call is not None:
+            tool_calls.append(tool_call)
+            spans.append((start, end + 1))
+
+
+def _scan_function_calls(content: str, spans: List[Span], tool_calls: List[Dict]):
+    # Match phải kết thúc ở 1 '}' → không search quá '}' cuối (tránh mỗi lần thử chạy tới hết content)
+    last_close = content.rfind("}")
+    for match in _FUNCTION_CALL.finditer(content, 0, last_close + 1):
+        name_match = _FUNCTION_CALL_NAME.search(content, match.start(), match.end())
+        arguments_match = _FUNCTION_CALL_ARGUMENTS.search(content, match.start(), match.end())
+        if name_match and arguments_match:
+            tool_calls.append(_make_tool_call(name_match.group(1), arguments_match.group(1)))
+            spans.append(match.span())
+
+
+def scan_json_tools(content: str) -> Tuple[List[Span], List[Dict]]:
+    """
+    Tìm JSON tool calls: object JSON theo thứ tự xuất hiện, sau đó function_call
+    (như thứ tự các pattern của regex cũ).
+
+    Returns:
+        (spans của các tool call trong content - đã sort, tool_calls)
+    """
+    spans: List[Span] = []
+    tool_calls: List[Dict] = []
+
+    # Mọi format đều cần key arguments - tool call bắt đầu sau lần xuất hiện cuối thì không thể hợp lệ
+    last_arguments = content.rfind("arguments")
+    if last_arguments < 0:
+        return spans, tool_calls
+
+    _scan_json_objects(content, last_arguments, spans, tool_calls)
+    object_count = len(spans)
+    _scan_function_calls(content, spans, tool_calls)
+    if object_count and len(spans) > object_count:
+        spans.sort()
+
+    return spans, tool_calls
+
 
 def parse_json_tools(content: str) -> Tuple[str, List[Dict]]:
     """
@@ -13,77 +232,85 @@ def parse_json_tools(content: str) -> Tuple[str, List[Dict]]:
     """
     if not content or not isinstance(content, str):
         return content, []
-    
-    tool_calls = []
-    remaining_text = content
-    
-    patterns = [
-        r'\{\s*"name"\s*:\s*"[^"]*"\s*,\s*"arguments"\s*:\s*\{[^{}]*\}\s*\}',
-        r'{\s*"function"\s*:\s*{[^}]*}\s*}',
-        r'function_call\s*:\s*\{[^}]+\}',
-    ]
-    
-    for pattern in patterns:
-        try:
-            matches = list(re.finditer(pattern, content, re.DOTALL))
-            
-            for match in matches:
-                try:
-                    tool_data = json.loads(match.group(0))
-                    
-                    if isinstance(tool_data, dict):
-                        tool_name = None
-                        tool_args = None
-                        
-                        if "name" in tool_data and "arguments" in tool_data:
-                            tool_name = tool_data["name"]
-                            tool_args = tool_data["arguments"]
-                        
-                        elif "function" in tool_data and isinstance(tool_data["function"], dict):
-                            if "name" in tool_data["function"] and "arguments" in tool_data["function"]:
-                                tool_name = tool_data["function"]["name"]
-                                tool_args = tool_data["function"]["arguments"]
-                        
-                        if tool_name and tool_args:
-                            tool_call = {
-                                "id": f"call_{uuid.uuid4().hex[:24]}",
-                                "type": "function",
-                                "function": {
-                                    "name": tool_name,
-                                    "arguments": json.dumps(tool_args) if isinstance(tool_args, dict) else tool_args
-                                }
-                            }
-                            tool_calls.append(tool_call)
-                            remaining_text = remaining_text.replace(match.group(0), "")
-                            
-                except json.JSONDecodeError:
-                    try:
-                        name_match = re.search(r'name\s*:\s*"([^"]+)"', match.group(0))
-                        args_match = re.search(r'arguments\s*:\s*(\{[^}]+\})', match.group(0))
-                        
-                        if name_match and args_match:
-                            tool_name = name_match.group(1)
-                            tool_args = args_match.group(1)
-                            
-                            tool_call = {
-                                "id": f"call_{uuid.uuid4().hex[:24]}",
-                                "type": "function",
-                                "function": {
-                                    "name": tool_name,
-                                    "arguments": tool_args
-                                }
-                            }
-                            tool_calls.append(tool_call)
-                            remaining_text = remaining_text.replace(match.group(0), "")
-                    except Exception:
-                        continue
-                except Exception:
-                    continue
-                    
-        except Exception:
+
+    spans, tool_calls = scan_json_tools(content)
+    return _text_outside(content, spans).strip(), tool_calls
+
+
+def scan_xml_tools(content: str) -> Tuple[List[Span], List[Dict]]:
+    """
+    Tìm XML tool calls <tool><param>value</param>...</tool> theo thứ tự xuất hiện.
+
+    Cùng kết quả với regex <(name)>\\s*(.*?)\\s*</\\1> + param regex trên nội dung:
+    tag mở ghép với tag đóng cùng tên ĐẦU TIÊN phía sau, các match không chồng nhau.
+    Con trỏ tag đóng theo từng tên chỉ tăng → mỗi tag được xét O(1) lần.
+
+    Returns:
+        (spans của các tool call trong content, tool_calls)
+    """
+    tags = [(match.start(), match.end(), bool(match.group(1)), match.group(2))
+            for match in _XML_TAG.finditer(content)]
+
+    # Tên tag → index (trong tags) của các tag đóng, theo thứ tự
+    closes: Dict[str, List[int]] = {}
+    for index, (_, _, is_close, name) in enumerate(tags):
+        if is_close:
+            closes.setdefault(name, []).append(index)
+
+    tool_pointers: Dict[str, int] = {}
+    param_pointers: Dict[str, int] = {}
+
+    def next_close(pointers: Dict[str, int], name: str, after: int) -> int:
+        """Index tag đóng đầu tiên của name bắt đầu từ vị trí >= after, -1 nếu không có"""
+        indexes = closes.get(name)
+        if not indexes:
+            return -1
+        pointer = pointers.get(name, 0)
+        while pointer < len(indexes) and tags[indexes[pointer]][0] < after:
+            pointer += 1
+        pointers[name] = pointer
+        return indexes[pointer] if pointer < len(indexes) else -1
+
+    spans: List[Span] = []
+    tool_calls: List[Dict] = []
+
+    index = 0
+    while index < len(tags):
+        start, open_end, is_close, tool_name = tags[index]
+        if is_close:
+            index += 1
             continue
-    
-    return remaining_text.strip(), tool_calls
+
+        close_index = next_close(tool_pointers, tool_name, open_end)
+        if close_index < 0:
+            index += 1
+            continue
+
+        # Param trong nội dung tool: các tag nằm giữa tag mở và tag đóng
+        params = {}
+        param_index = index + 1
+        while param_index < close_index:
+            _, param_open_end, param_is_close, param_name = tags[param_index]
+            if param_is_close:
+                param_index += 1
+                continue
+
+            param_close = next_close(param_pointers, param_name, param_open_end)
+            if param_close < 0 or param_close >= close_index:
+                param_index += 1
+                continue
+
+            params[param_name] = content[param_open_end:tags[param_close][0]].strip()
+            param_index = param_close + 1
+
+        if params:
+            tool_calls.append(_make_tool_call(tool_name, json.dumps(params)))
+            spans.append((start, tags[close_index][1]))
+
+        # Như regex finditer: tiếp tục sau match kể cả khi không có param
+        index = close_index + 1
+
+    return spans, tool_calls
 
 
 def parse_xml_tools(content: str) -> Tuple[str, List[Dict]]:
@@ -92,51 +319,12 @@ def parse_xml_tools(content: str) -> Tuple[str, List[Dict]]:
     """
     if not content or not isinstance(content, str):
         return content, []
-    
-    tool_pattern = r'<([a-zA-Z_][a-zA-Z0-9_]*)>\s*(.*?)\s*</\1>'
-    
-    tool_calls = []
-    positions_to_remove = []
-    
-    matches = list(re.finditer(tool_pattern, content, re.DOTALL))
-    
-    for match in matches:
-        tool_name = match.group(1)
-        tool_content = match.group(2).strip()
-        
-        if not re.search(r'<\w+>', tool_content):
-            continue
-        
-        param_pattern = r'<([a-zA-Z_][a-zA-Z0-9_]*)>(.*?)</\1>'
-        params = {}
-        param_matches = list(re.finditer(param_pattern, tool_content, re.DOTALL))
-        
-        for param_match in param_matches:
-            param_name = param_match.group(1)
-            param_value = param_match.group(2).strip()
-            params[param_name] = param_value
-        
-        if not params:
-            continue
-        
-        tool_call = {
-            "id": f"call_{uuid.uuid4().hex[:24]}",
-            "type": "function",
-            "function": {
-                "name": tool_name,
-                "arguments": json.dumps(params)
-            }
-        }
-        
-        tool_calls.append(tool_call)
-        positions_to_remove.append((match.start(), match.end()))
-    
-    remaining_text = content
-    for start, end in reversed(positions_to_remove):
-        remaining_text = remaining_text[:start] + remaining_text[end:]
-    
-    remaining_text = re.sub(r'\n\s*\n\s*\n', '\n\n', remaining_text.strip())
-    
+
+    spans, tool_calls = scan_xml_tools(content)
+
+    remaining_text = _text_outside(content, spans)
+    remaining_text = _EXTRA_BLANK_LINES.sub('\n\n', remaining_text.strip())
+
     return remaining_text, tool_calls
 
 def enhance_response_with_tools(response: Dict) -> Dict:
@@ -294,4 +482,5 @@ def validate_tool_arguments(tool_name: str, arguments: dict) -> Tuple[bool, Opti
     validator = validators[tool_name]
     is_valid, error_msg = validator(arguments)
     
-    return is_valid, error_msg if not is_valid else None
\ No newline at end of file
+    return is_valid, error_msg if not is_valid else None
+
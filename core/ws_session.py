@@ -0,0 +1,80 @@
+"""
+WebSocket session - đánh số message gửi tới ZenTab và giữ lại tới khi được ack
+để replay khi ZenTab reconnect với cùng sessionId (resume)
+
+Protocol (chỉ áp dụng khi ZenTab kết nối với ?sessionId=...):
+- Mọi message server gửi qua connection có thêm field `msgSeq` tăng dần
+- ZenTab gửi {"type": "ack", "msgSeq": N} → server bỏ các message <= N khỏi buffer
+- Message ZenTab gửi lên có `msgSeq` được server ack lại và dedupe theo seq
+- Reconnect với ?sessionId=...&lastSeq=N → server replay các message > N
+"""
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+
+SEQ_FIELD = "msgSeq"
+
+
+def stamp_message(text: str, seq: int) -> str:
+    """Chèn msgSeq vào JSON object đã serialize (tránh parse lại prompt lớn)"""
+    if text.startswith("{") and text.rstrip().endswith("}"):
+        body = text[1:].lstrip()
+        separator = "" if body.startswith("}") else ", "
+        return f'{{"{SEQ_FIELD}": {seq}{separator}{body}'
+    return text
+
+
+class ReplayBuffer:
+    """
+    Bounded buffer các message chưa được ack: (seq, text) theo thứ tự seq.
+
+    Khi đầy, message cũ nhất bị bỏ (`dropped`) - nếu ZenTab resume từ seq
+    cũ hơn phần còn giữ thì không replay được (replay_after trả về None).
+    """
+
+    def __init__(self, max_messages: int = 200):
+        self.max_messages = max_messages
+        self._messages: Deque[Tuple[int, str]] = deque()
+        self.last_seq = 0
+        self.acked_seq = 0
+        self.dropped = 0
+
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, seq: int, text: str):
+        self._messages.append((seq, text))
+        while len(self._messages) > self.max_messages:
+            self._messages.popleft()
+            self.dropped += 1
+
+    def ack(self, seq: int):
+        if seq <= self.acked_seq:
+            return
+        self.acked_seq = seq
+        while self._messages and self._messages[0][0] <= seq:
+            self._messages.popleft()
+
+    def replay_after(self, seq: int) -> Optional[List[str]]:
+        """
+        Message cần gửi lại cho client đã nhận tới `seq`.
+
+        Returns:
+            list | None: None nếu đã mất message (buffer tràn) → không resume được
+        """
+        self.ack(seq)
+        if self._messages and self._messages[0][0] > seq + 1:
+            return None
+        return [text for message_seq, text in self._messages if message_seq > seq]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def get_stats(self) -> dict:
+        return {
+            "last_seq": self.last_seq,
+            "acked_seq": self.acked_seq,
+            "unacked": len(self._messages),
+            "dropped": self.dropped
+        }
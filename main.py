@@ -24,11 +24,11 @@ async def lifespan(app: FastAPI):
     """
     yield
     
-    if port_manager.websocket:
-        try:
-            await port_manager.websocket.close()
-        except:
-            pass
+    await port_manager.close_all_connections()
+    
+    # Ghi nốt các request debug đang chờ trong capture queue
+    from core.capture import capture_pipeline
+    await asyncio.to_thread(capture_pipeline.stop)
 
 
 app = FastAPI(
@@ -46,8 +46,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from api.middleware import DebugRequestMiddleware
-app.add_middleware(DebugRequestMiddleware)
+from api.middleware import HttpTapMiddleware
+app.add_middleware(HttpTapMiddleware)
 
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -132,8 +132,7 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         print(f"[WebSocket] ❌ Error: {e}")
     finally:
-        if port_manager.websocket == websocket:
-            port_manager.websocket = None
+        await port_manager.unregister_websocket(websocket)
 
 setup_routes(app, port_manager)
 
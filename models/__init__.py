@@ -1,8 +1,13 @@
 from .enums import TabStatus
-from .requests import Message, ChatCompletionRequest
+from .requests import (
+    Message, ChatCompletionRequest, ChatCompletionRequestView, RequestParseError, parse_chat_completion_request
+)
 
 __all__ = [
     "TabStatus",
     "Message", 
-    "ChatCompletionRequest"
+    "ChatCompletionRequest",
+    "ChatCompletionRequestView",
+    "RequestParseError",
+    "parse_chat_completion_request"
 ]
\ No newline at end of file
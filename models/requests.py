@@ -28,4 +28,73 @@ class ChatCompletionRequest(BaseModel):
     frequency_penalty: Optional[float] = Field(default=0.0)
     
     class Config:
-        extra = "allow"  # Cho phép các field không khai báo (như logprobs, user, etc.)
\ No newline at end of file
+        extra = "allow"  # Cho phép các field không khai báo (như logprobs, user, etc.)
+
+
+class RequestParseError(ValueError):
+    """Body /v1/chat/completions không hợp lệ (status_code + chi tiết lỗi cho error_response)"""
+
+    def __init__(self, message: str, errors: Optional[list] = None, status_code: int = 422):
+        super().__init__(message)
+        self.errors = errors or []
+        self.status_code = status_code
+
+
+class ChatCompletionRequestView:
+    """
+    Fast path: chỉ đọc các field handler cần từ JSON đã parse, KHÔNG validate
+    từng message thành Pydantic Message. `messages` là list dict gốc - conversation
+    index chỉ đọc role/content của những message cần thiết.
+    """
+
+    __slots__ = ("model", "messages", "stream", "raw")
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.model = raw.get("model")
+        self.messages = raw.get("messages")
+        self.stream = bool(raw.get("stream") or False)
+
+
+def parse_chat_completion_request(body: bytes, strict: bool = False):
+    """
+    Parse body /v1/chat/completions đúng 1 lần.
+
+    Args:
+        strict: True → validate toàn bộ bằng ChatCompletionRequest (như trước đây)
+
+    Returns:
+        ChatCompletionRequestView | ChatCompletionRequest
+
+    Raises:
+        RequestParseError: JSON lỗi hoặc thiếu/sai kiểu field bắt buộc
+    """
+    from core import json_codec
+
+    try:
+        data = json_codec.loads(body)
+    except json_codec.DecodeError as e:
+        raise RequestParseError(f"Invalid JSON body: {e}", status_code=400)
+
+    if not isinstance(data, dict):
+        raise RequestParseError("Request body must be a JSON object")
+
+    if strict:
+        from pydantic import ValidationError
+        try:
+            return ChatCompletionRequest.model_validate(data)
+        except ValidationError as e:
+            raise RequestParseError("Request validation failed", errors=e.errors(include_url=False))
+
+    errors = []
+    if not isinstance(data.get("model"), str):
+        errors.append({"loc": ["body", "model"], "msg": "model must be a string"})
+    messages = data.get("messages")
+    if not isinstance(messages, list):
+        errors.append({"loc": ["body", "messages"], "msg": "messages must be a list"})
+    if "stream" in data and data["stream"] is not None and not isinstance(data["stream"], bool):
+        errors.append({"loc": ["body", "stream"], "msg": "stream must be a boolean"})
+    if errors:
+        raise RequestParseError("Request validation failed", errors=errors)
+
+    return ChatCompletionRequestView(data)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Chạy pytest từ root repo hoặc từ tests/ đều import được core/, api/, config/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+"""
+CapturePipeline: sample, giới hạn size, drop khi queue đầy, ghi file content-addressed
+"""
+import base64
+import json
+import os
+
+from core import capture
+from core.capture import CapturePipeline
+
+
+def _body(system_prompt: str = "You are Cline", images=()) -> bytes:
+    content = [{"type": "text", "text": "hi"}] + [
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64," + base64.b64encode(image).decode()}}
+        for image in images
+    ]
+    return json.dumps({"messages": [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content}
+    ]}).encode('utf-8')
+
+
+def _files(root, folder: str) -> list:
+    path = os.path.join(str(root), folder)
+    return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+
+def test_sample_rate(monkeypatch):
+    monkeypatch.setattr(capture.random, "random", lambda: 0.5)
+
+    assert CapturePipeline(sample_rate=1.0).sample()
+    assert CapturePipeline(sample_rate=0.6).sample()
+
+    pipeline = CapturePipeline(sample_rate=0.5)
+    assert not pipeline.sample()
+    assert pipeline.stats["sampled_out"] == 1
+    assert not CapturePipeline(enabled=False).sample()
+
+
+def test_oversize_body_is_skipped(tmp_path):
+    pipeline = CapturePipeline(root=str(tmp_path), max_body_bytes=10)
+
+    assert pipeline.accepts_size(10)
+    assert not pipeline.submit(b"x" * 11)
+    assert pipeline.stats["oversize"] == 1
+    assert pipeline.stats["enqueued"] == 0
+
+
+def test_submit_drops_when_queue_is_full(tmp_path):
+    pipeline = CapturePipeline(root=str(tmp_path), queue_size=1)
+    # Worker không chạy → queue không được xử lý
+    pipeline._ensure_worker = lambda: None
+
+    assert pipeline.submit(b"{}")
+    assert not pipeline.submit(b"{}")
+    assert pipeline.stats["dropped"] == 1
+    assert pipeline.get_stats()["queue_depth"] == 1
+
+
+def test_process_writes_each_content_once(tmp_path):
+    pipeline = CapturePipeline(root=str(tmp_path))
+
+    pipeline._process(_body(images=[b"png bytes", b"png bytes"]))
+    pipeline._process(_body(images=[b"png bytes"]))
+
+    prompts = _files(tmp_path, "system_prompts")
+    images = _files(tmp_path, "images")
+    assert len(prompts) == 1 and len(images) == 1
+    assert pipeline.stats["prompts_stored"] == 1
+    assert pipeline.stats["images_stored"] == 1
+    assert pipeline.stats["duplicates"] == 3
+
+    with open(os.path.join(str(tmp_path), "images", images[0]), 'rb') as f:
+        assert f.read() == b"png bytes"
+    with open(os.path.join(str(tmp_path), "system_prompts", prompts[0]), encoding='utf-8') as f:
+        assert f.read().endswith("You are Cline")
+    # Không còn file tmp
+    assert not [name for name in images + prompts if name.endswith(".tmp")]
+
+
+def test_oversize_image_is_not_decoded(tmp_path):
+    pipeline = CapturePipeline(root=str(tmp_path), max_image_bytes=4)
+
+    pipeline._process(_body(images=[b"too large image"]))
+
+    assert _files(tmp_path, "images") == []
+    assert pipeline.stats["images_oversize"] == 1
+
+
+def test_stop_drains_queue(tmp_path):
+    pipeline = CapturePipeline(root=str(tmp_path))
+
+    assert pipeline.submit(_body("first"))
+    assert pipeline.submit(_body("second"))
+    assert pipeline.submit(b"{bad")
+    pipeline.stop()
+
+    assert len(_files(tmp_path, "system_prompts")) == 2
+    assert pipeline.stats["processed"] == 2
+    assert pipeline.stats["errors"] == 1
+    assert not pipeline._thread.is_alive()
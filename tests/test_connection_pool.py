@@ -0,0 +1,64 @@
+"""
+ConnectionPool: nhiều ZenTab connection, mỗi connection có tab registry riêng
+"""
+import asyncio
+
+from core.connection_pool import ConnectionPool
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+def test_add_get_remove():
+    pool = ConnectionPool()
+    websocket = FakeWebSocket()
+    connection = pool.add(websocket)
+
+    assert len(pool) == 1
+    assert pool.get(connection.connection_id) is connection
+    assert pool.get(None) is None
+    assert pool.find_by_websocket(websocket) is connection
+    assert pool.find_by_websocket(FakeWebSocket()) is None
+
+    assert pool.remove(connection.connection_id) is connection
+    assert pool.remove(connection.connection_id) is None
+    assert len(pool) == 0
+
+
+def test_each_connection_has_own_registry():
+    pool = ConnectionPool()
+    first = pool.add(FakeWebSocket())
+    second = pool.add(FakeWebSocket())
+
+    first.tab_registry.apply_snapshot([{"tabId": 1, "status": "free", "canAccept": True}])
+
+    assert first.connection_id != second.connection_id
+    assert first.tab_registry.get_tab(1)["connectionId"] == first.connection_id
+    assert second.tab_registry.get_tab(1) is None
+
+
+def test_open_connections_skip_closed_sockets():
+    pool = ConnectionPool()
+    open_connection = pool.add(FakeWebSocket())
+    closed_connection = pool.add(FakeWebSocket())
+    closed_connection.websocket.closed = True
+
+    assert pool.open_connections() == [open_connection]
+    assert len(pool.active()) == 2
+
+
+def test_send_text_without_session_is_not_buffered():
+    pool = ConnectionPool()
+    connection = pool.add(FakeWebSocket())
+
+    asyncio.run(connection.send_text('{"type": "ping"}'))
+
+    assert connection.websocket.sent == ['{"type": "ping"}']
+    assert connection.replay_buffer is None
+    assert connection.messages_to_replay(0) == []
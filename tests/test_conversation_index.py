@@ -0,0 +1,141 @@
+"""
+ConversationIndexCache: dùng lại index theo prefix, message lỗi kiểu, resolve ảnh đã bị evict
+"""
+import base64
+
+from core import conversation_index
+from core.conversation_index import ConversationIndexCache, message_digest
+from core.image_cache import ImageCache
+
+
+SYSTEM = {"role": "system", "content": "SYS\n# Current Working Directory (/proj)"}
+TASK = {"role": "user", "content": "<task>do it</task>"}
+ASSISTANT = {"role": "assistant", "content": "done"}
+
+
+def _image(payload: bytes) -> dict:
+    url = "data:image/png;base64," + base64.b64encode(payload).decode('ascii')
+    return {"type": "image_url", "image_url": {"url": url}}
+
+
+def test_next_turn_reuses_previous_prefix():
+    cache = ConversationIndexCache(ImageCache())
+    first = cache.build([SYSTEM, TASK])
+
+    assert first.folder_path == "/proj"
+    assert first.is_new_task
+    assert first.last_user_text == "<task>do it</task>"
+
+    follow_up = {"role": "user", "content": [{"type": "text", "text": "next"}]}
+    second = cache.build([SYSTEM, TASK, ASSISTANT, follow_up])
+
+    assert cache.stats["prefix_hits"] == 1
+    assert cache.stats["messages_reused"] == 2
+    assert cache.stats["messages_processed"] == 4
+    assert second.folder_path == "/proj"
+    assert second.system_prompt == SYSTEM["content"]
+    assert second.user_count == 2
+    assert second.message_count == 4
+    assert second.last_user_text == "next"
+    assert not second.is_new_task
+    # Index của lượt trước không bị sửa
+    assert first.user_count == 1
+
+
+def test_same_messages_return_cached_index():
+    cache = ConversationIndexCache(ImageCache())
+    index = cache.build([SYSTEM, TASK])
+
+    assert cache.build([dict(SYSTEM), dict(TASK)]) is index
+    assert cache.stats["messages_processed"] == 2
+
+
+def test_edited_history_does_not_reuse_prefix():
+    cache = ConversationIndexCache(ImageCache())
+    cache.build([SYSTEM, TASK])
+
+    edited = {"role": "system", "content": "SYS\n# Current Working Directory (/other)"}
+    index = cache.build([edited, TASK])
+
+    assert cache.stats["prefix_hits"] == 0
+    assert index.folder_path == "/other"
+
+
+def test_next_turn_hashes_only_anchor_and_new_messages(monkeypatch):
+    cache = ConversationIndexCache(ImageCache())
+    history = [SYSTEM, TASK]
+    for number in range(50):
+        history += [ASSISTANT, {"role": "user", "content": f"turn {number}"}]
+    cache.build(history)
+
+    hashed = []
+    original = conversation_index.message_digest
+    monkeypatch.setattr(conversation_index, "message_digest", lambda message: hashed.append(message) or original(message))
+
+    cache.build(history + [ASSISTANT, {"role": "user", "content": "next"}])
+
+    # Message đầu, message cuối của prefix đã cache, message cuối của request
+    assert len(hashed) == 3
+    assert cache.stats["messages_reused"] == len(history)
+
+
+def test_changed_last_message_does_not_reuse_prefix():
+    cache = ConversationIndexCache(ImageCache())
+    cache.build([SYSTEM, TASK])
+
+    index = cache.build([SYSTEM, {"role": "user", "content": "<task>other</task>"}, ASSISTANT])
+
+    assert cache.stats["prefix_hits"] == 0
+    assert index.last_user_text == "<task>other</task>"
+
+
+def test_entries_are_bounded():
+    cache = ConversationIndexCache(ImageCache(), max_entries=2)
+    for number in range(5):
+        cache.build([{"role": "user", "content": f"message {number}"}])
+
+    assert cache.get_stats()["entries"] == 2
+
+
+def test_malformed_content_does_not_raise():
+    cache = ConversationIndexCache(ImageCache())
+    messages = [
+        {"role": "system", "content": [{"type": "text", "text": None}, {"type": "text", "text": 42}]},
+        {"role": None, "content": {"unexpected": "dict"}},
+        {"role": "user", "content": [
+            "plain string item",
+            {"type": "image_url", "image_url": {"url": 123}},
+            {"type": "image_url", "image_url": "data:image/png;base64,@@@not base64"},
+            {"type": "text", "text": "<task>x</task>"},
+        ]},
+    ]
+
+    index = cache.build(messages)
+
+    assert index.system_prompt == ""
+    assert index.last_user_text == "<task>x</task>"
+    assert index.is_new_task
+    assert index.image_digests == []
+
+
+def test_message_digest_handles_non_json_content():
+    message = {"role": "user", "content": [object()]}
+
+    assert len(message_digest(message)) == 16
+    assert message_digest({"role": "user", "content": "a"}) != message_digest({"role": "user", "content": "b"})
+
+
+def test_resolve_images_reinterns_evicted_images():
+    image_cache = ImageCache(max_entries=1)
+    cache = ConversationIndexCache(image_cache)
+    messages = [{"role": "user", "content": [_image(b"first"), _image(b"second")]}]
+
+    index = cache.build(messages)
+    assert len(index.image_digests) == 2
+    # max_entries=1 → ảnh đầu tiên đã bị evict khỏi ImageCache
+    assert image_cache.get(index.image_digests[0]) is None
+
+    images = cache.resolve_images(index, messages)
+
+    assert [image.digest for image in images] == index.image_digests
+    assert cache.stats["images_reinterned"] == 1
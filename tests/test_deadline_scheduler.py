@@ -0,0 +1,119 @@
+"""
+DeadlineScheduler với clock giả: schedule, thay deadline cùng key, cancel, thứ tự
+"""
+import asyncio
+
+from core.deadline_scheduler import DeadlineScheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _scheduler():
+    clock = FakeClock()
+    return DeadlineScheduler(clock=clock), clock
+
+
+def test_schedule_fires_when_due():
+    scheduler, clock = _scheduler()
+    fired = []
+    scheduler.schedule("req-1", 5.0, lambda: fired.append("req-1"))
+
+    assert scheduler.has_deadline("req-1")
+    assert scheduler.run_due() == 0
+
+    clock.now += 5.0
+    assert scheduler.run_due() == 1
+    assert fired == ["req-1"]
+    assert not scheduler.has_deadline("req-1")
+    assert len(scheduler) == 0
+    assert scheduler.run_due() == 0
+
+
+def test_same_key_replaces_deadline():
+    scheduler, clock = _scheduler()
+    fired = []
+    scheduler.schedule("req-1", 5.0, lambda: fired.append("old"))
+    scheduler.schedule("req-1", 10.0, lambda: fired.append("new"))
+
+    clock.now += 5.0
+    assert scheduler.run_due() == 0
+    clock.now += 5.0
+    assert scheduler.run_due() == 1
+    assert fired == ["new"]
+
+
+def test_names_are_independent_per_request():
+    scheduler, clock = _scheduler()
+    fired = []
+    scheduler.schedule("req-1", 1.0, lambda: fired.append("in_progress"), name="in_progress")
+    scheduler.schedule("req-1", 2.0, lambda: fired.append("cleanup"))
+
+    assert scheduler.cancel("req-1", "in_progress") == 1
+    assert scheduler.has_deadline("req-1", "cleanup")
+
+    clock.now += 2.0
+    scheduler.run_due()
+    assert fired == ["cleanup"]
+
+
+def test_cancel_all_deadlines_of_request():
+    scheduler, clock = _scheduler()
+    fired = []
+    scheduler.schedule("req-1", 1.0, lambda: fired.append("a"), name="a")
+    scheduler.schedule("req-1", 1.0, lambda: fired.append("b"), name="b")
+    scheduler.schedule("req-2", 1.0, lambda: fired.append("other"))
+
+    assert scheduler.cancel("req-1") == 2
+    assert scheduler.cancel("req-1") == 0
+    assert scheduler.cancel("missing") == 0
+
+    clock.now += 1.0
+    scheduler.run_due()
+    assert fired == ["other"]
+
+
+def test_fires_in_deadline_order():
+    scheduler, clock = _scheduler()
+    fired = []
+    for request_id, delay in [("c", 3.0), ("a", 1.0), ("d", 3.0), ("b", 2.0)]:
+        scheduler.schedule(request_id, delay, lambda request_id=request_id: fired.append(request_id))
+
+    assert scheduler.next_deadline() == clock.now + 1.0
+    clock.now += 10.0
+    assert scheduler.run_due() == 4
+    # Cùng deadline → theo thứ tự đăng ký
+    assert fired == ["a", "b", "c", "d"]
+    assert scheduler.next_deadline() is None
+
+
+def test_failing_callback_does_not_stop_others():
+    scheduler, clock = _scheduler()
+    fired = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    scheduler.schedule("req-1", 1.0, fail)
+    scheduler.schedule("req-2", 2.0, lambda: fired.append("req-2"))
+
+    clock.now += 2.0
+    assert scheduler.run_due() == 2
+    assert fired == ["req-2"]
+
+
+def test_background_task_runs_deadlines():
+    async def scenario():
+        scheduler = DeadlineScheduler()
+        fired = asyncio.Event()
+        scheduler.schedule("req-1", 0.01, fired.set)
+        await asyncio.wait_for(fired.wait(), timeout=1.0)
+        await scheduler.stop()
+        return len(scheduler)
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,92 @@
+"""
+ExpiringStore: TTL theo entry, gia hạn, giới hạn số entry
+"""
+import pytest
+
+from core import expiring_store
+from core.expiring_store import ExpiringStore
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(expiring_store.time, "time", lambda: clock[0])
+    return clock
+
+
+def test_entries_expire_after_ttl(now):
+    store = ExpiringStore(default_ttl=10.0)
+    store.set("a", 1)
+    store.set("b", 2, ttl=30.0)
+
+    assert store.get("a") == 1
+    assert "b" in store
+
+    now[0] += 10.0
+    assert store.get("a") is None
+    assert "a" not in store
+    assert store.get("b") == 2
+    assert store.pop("b") == 2
+    assert store.pop("b") is None
+
+
+def test_overwrite_replaces_expiry(now):
+    store = ExpiringStore(default_ttl=10.0)
+    store.set("a", 1)
+    now[0] += 5.0
+    store.set("a", 2)
+
+    now[0] += 6.0
+    assert store.expire() == 0
+    assert store.get("a") == 2
+
+
+def test_touch_extends_live_entries_only(now):
+    store = ExpiringStore(default_ttl=10.0)
+    store.set("a", "value")
+
+    now[0] += 8.0
+    assert store.touch("a")
+    now[0] += 8.0
+    assert store.get("a") == "value"
+
+    now[0] += 10.0
+    assert not store.touch("a")
+    assert not store.touch("missing")
+
+
+def test_expired_entries_are_cleaned_on_write(now):
+    store = ExpiringStore(default_ttl=1.0)
+    for number in range(5):
+        store.set(number)
+
+    now[0] += 1.0
+    store.set("fresh")
+
+    assert len(store) == 1
+    assert store.get_stats()["expired"] == 5
+
+
+def test_max_entries_evicts_soonest_expiring(now):
+    store = ExpiringStore(default_ttl=10.0, max_entries=2)
+    store.set("short", ttl=1.0)
+    store.set("long", ttl=100.0)
+    store.set("medium", ttl=50.0)
+
+    assert "short" not in store
+    assert "long" in store and "medium" in store
+    assert store.evicted_count == 1
+
+
+def test_heap_is_compacted(now):
+    store = ExpiringStore(default_ttl=10.0)
+    for _ in range(500):
+        store.set("same")
+
+    assert len(store) == 1
+    assert store.get_stats()["heap_size"] <= 2 * len(store) + 64
+
+
+def test_rejects_non_positive_limit():
+    with pytest.raises(ValueError):
+        ExpiringStore(default_ttl=1.0, max_entries=0)
@@ -0,0 +1,115 @@
+"""
+ImageCache: decode vào frame, LRU eviction, ảnh đã gửi theo tab
+"""
+import base64
+import hashlib
+
+from core.image_cache import ImageCache
+
+
+def _data_url(payload: bytes, image_format: str = "png") -> str:
+    return f"data:image/{image_format};base64," + base64.b64encode(payload).decode('ascii')
+
+
+def test_intern_decodes_into_frame():
+    cache = ImageCache()
+    payload = bytes(range(256)) * 5
+
+    image = cache.intern(_data_url(payload))
+
+    assert image.format == "png"
+    assert image.size == len(payload)
+    assert bytes(image.frame[image.header_size:]) == payload
+    assert image.digest == hashlib.sha256(payload).hexdigest()
+    assert base64.b64decode(image.to_inline()["data"]) == payload
+
+
+def test_intern_reuses_entry():
+    cache = ImageCache()
+    url = _data_url(b"same image")
+
+    assert cache.intern(url) is cache.intern(url)
+    assert cache.stats["cache_hits"] == 1
+
+
+def test_intern_rejects_non_image_urls():
+    cache = ImageCache()
+
+    assert cache.intern("https://example.com/a.png") is None
+    assert cache.intern("data:image/png;base64,") is None
+
+
+def test_eviction_is_lru():
+    cache = ImageCache(max_entries=2)
+    first = cache.intern(_data_url(b"first"))
+    second = cache.intern(_data_url(b"second"))
+
+    # Dùng lại first → second là entry cũ nhất
+    cache.intern(_data_url(b"first"))
+    third = cache.intern(_data_url(b"third"))
+
+    assert cache.get(first.digest) is first
+    assert cache.get(second.digest) is None
+    assert cache.get(third.digest) is third
+    assert cache.get_stats()["entries"] == 2
+
+
+def test_eviction_keeps_digest_of_same_image_under_other_url():
+    cache = ImageCache(max_entries=2)
+    payload = b"shared bytes"
+    old = cache.intern(_data_url(payload, "png"))
+    new = cache.intern(_data_url(payload, "jpeg"))
+    cache.intern(_data_url(b"other"))
+
+    # Entry png bị evict nhưng digest vẫn trỏ tới entry jpeg còn trong cache
+    assert old.digest == new.digest
+    assert cache.get(new.digest) is new
+
+
+def test_select_new_skips_images_committed_to_tab():
+    cache = ImageCache()
+    tab = ("conn", 1)
+    first = cache.intern(_data_url(b"first"))
+    second = cache.intern(_data_url(b"second"))
+
+    assert cache.select_new(tab, [first, first], new_task=False) == [first]
+
+    cache.record_sent("req-1", tab, [first], new_task=False)
+    cache.commit("req-1")
+    assert cache.select_new(tab, [first, second], new_task=False) == [second]
+    # New task → tab cần lại toàn bộ ảnh
+    assert cache.select_new(tab, [first, second], new_task=True) == [first, second]
+
+    # Request lỗi → không ghi nhận
+    cache.record_sent("req-2", tab, [second], new_task=False)
+    cache.discard("req-2")
+    assert cache.select_new(tab, [second], new_task=False) == [second]
+
+
+def test_port_manager_commits_images_only_on_success():
+    from core.port_manager import PortManager
+
+    PortManager._instance = None
+    manager = PortManager()
+    try:
+        connection = manager.connection_pool.add(object())
+        tab = (connection.connection_id, 1)
+        cache = manager.image_cache
+        first = cache.intern(_data_url(b"first"))
+        second = cache.intern(_data_url(b"second"))
+
+        cache.record_sent("req-1", tab, [first], new_task=True)
+        manager.record_tab_outcome("req-1", success=True)
+        # Lượt tiếp theo chỉ forward ảnh mới
+        assert cache.select_new(tab, [first, second], new_task=False) == [second]
+
+        cache.record_sent("req-2", tab, [second], new_task=False)
+        manager.record_tab_outcome("req-2", success=False, error_type="TAB_ERROR")
+        assert cache.select_new(tab, [first, second], new_task=False) == [second]
+
+        # Connection mất → tab mới (cùng id) phải nhận lại toàn bộ ảnh
+        manager._drop_connection(connection.connection_id)
+        assert cache.select_new(tab, [first, second], new_task=False) == [first, second]
+        assert cache.get_stats()["tabs"] == 0
+    finally:
+        PortManager._instance = None
@@ -0,0 +1,30 @@
+"""
+json_codec: mọi backend đã cài cho cùng output, lỗi parse là ValueError
+"""
+import pytest
+
+from core import json_codec
+
+
+BACKENDS = json_codec.available_backends()
+PAYLOAD = {"type": "sendPrompt", "tabId": 1, "text": "Xin chào \"ZenTab\"", "items": [1, 2.5, None, True]}
+
+
+@pytest.mark.parametrize("name", sorted(BACKENDS))
+def test_backends_match_stdlib_output(name):
+    backend = BACKENDS[name]
+    expected = BACKENDS["json"].dumps(PAYLOAD)
+
+    assert backend.dumps(PAYLOAD) == expected
+    assert backend.dumps_bytes(PAYLOAD) == expected.encode('utf-8')
+    assert backend.loads(expected) == PAYLOAD
+    assert backend.loads(expected.encode('utf-8')) == PAYLOAD
+
+
+@pytest.mark.parametrize("name", sorted(BACKENDS))
+def test_decode_error_is_value_error(name):
+    backend = BACKENDS[name]
+
+    assert issubclass(backend.decode_error, ValueError)
+    with pytest.raises(backend.decode_error):
+        backend.loads(b'{"broken": ')
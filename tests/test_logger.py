@@ -0,0 +1,98 @@
+"""
+Logger: record được enqueue, writer thread format + ghi theo batch, drop khi queue đầy
+"""
+import json
+import time
+
+from core import logger
+from core.logger import Logger, LogLevel, _LogWriter
+
+
+def _record(message: str, level: LogLevel = LogLevel.INFO, metadata=None, payload=None) -> tuple:
+    return (time.time(), level, message, metadata, "tests/test_logger.py", 1, None, payload)
+
+
+class FakeWriter:
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record: tuple):
+        self.records.append(record)
+
+
+def test_writer_thread_writes_in_order(capsys):
+    writer = _LogWriter("console")
+    for number in range(5):
+        writer.submit(_record(f"message {number}", metadata={"n": number}))
+    writer.flush()
+
+    lines = [line for line in capsys.readouterr().out.splitlines() if "message" in line]
+    assert len(lines) == 5
+    assert all(f"message {number}" in line and f"n={number}" in line for number, line in enumerate(lines))
+    assert writer._thread.daemon
+
+
+def test_json_format(capsys):
+    writer = _LogWriter("json")
+    writer.submit(_record("hello", LogLevel.WARNING, metadata={"request_id": "r1", "data": object()},
+                          payload={"a": 1}))
+    writer.flush()
+
+    entry = json.loads(capsys.readouterr().out.strip())
+    assert entry["level"] == "WARNING"
+    assert entry["message"] == "hello"
+    assert entry["metadata"]["request_id"] == "r1"
+    assert isinstance(entry["metadata"]["data"], str)
+    assert entry["payload"] == {"a": 1}
+
+
+def test_full_queue_drops_and_reports(capsys):
+    writer = _LogWriter("console", max_size=2)
+    # Không start thread → queue không được xử lý
+    writer._thread = object()
+    for number in range(5):
+        writer.submit(_record(f"message {number}"))
+
+    assert writer.dropped == 3
+
+    writer._write([writer._queue.get_nowait(), writer._queue.get_nowait()])
+    output = capsys.readouterr().out
+    assert "message 0" in output and "message 1" in output
+    assert "Dropped 3 log record(s)" in output
+    assert writer.dropped == 0
+
+
+def test_bad_record_does_not_stop_batch(capsys):
+    writer = _LogWriter("console")
+    writer._write([("broken",), _record("after")])
+
+    output = capsys.readouterr().out
+    assert "Failed to format record" in output
+    assert "after" in output
+
+
+def test_log_enqueues_caller_and_metadata_snapshot(monkeypatch):
+    fake = FakeWriter()
+    monkeypatch.setattr(logger, "_writer", fake)
+    metadata = {"request_id": "r1"}
+
+    Logger.warning("queued", metadata)
+    metadata["request_id"] = "changed"
+
+    _, level, message, recorded, filepath, lineno, exc_info, _ = fake.records[0]
+    assert level is LogLevel.WARNING
+    assert message == "queued"
+    assert recorded == {"request_id": "r1"}
+    assert filepath.endswith("test_logger.py") and lineno > 0
+    assert exc_info is None
+
+
+def test_disabled_level_is_not_enqueued(monkeypatch):
+    fake = FakeWriter()
+    monkeypatch.setattr(logger, "_writer", fake)
+    monkeypatch.setattr(logger, "MIN_RANK", logger.LEVEL_RANKS[LogLevel.ERROR])
+
+    Logger.info("skipped")
+    Logger.error("kept")
+
+    assert [record[2] for record in fake.records] == ["kept"]
@@ -0,0 +1,153 @@
+"""
+HttpTapMiddleware: thống kê theo path, preview payload, đếm SSE event, client disconnect, capture body
+"""
+import asyncio
+
+import pytest
+
+from api.middleware import CAPTURE_PATH, OTHER_PATHS, HttpTap, HttpTapMiddleware
+
+
+class FakeCapture:
+    def __init__(self, max_body_bytes: int = 1024):
+        self.max_body_bytes = max_body_bytes
+        self.submitted = []
+
+    def sample(self) -> bool:
+        return True
+
+    def accepts_size(self, size: int) -> bool:
+        return size <= self.max_body_bytes
+
+    def submit(self, body: bytes) -> bool:
+        self.submitted.append(body)
+        return True
+
+
+def _scope(path: str = "/v1/status", headers=()) -> dict:
+    return {"type": "http", "method": "POST", "path": path, "headers": list(headers)}
+
+
+def _app(chunks, content_type: bytes = b"application/json", status: int = 200):
+    async def app(scope, receive, send):
+        while (await receive()).get("more_body", False):
+            pass
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": index < len(chunks) - 1})
+    return app
+
+
+def _run(middleware, scope, request_chunks=(b"",)):
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": index < len(request_chunks) - 1}
+        for index, chunk in enumerate(request_chunks)
+    ] + [{"type": "http.disconnect"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_records_sizes_and_preview():
+    tap = HttpTap(payload_bytes=8)
+    middleware = HttpTapMiddleware(_app([b'{"ok": ', b'true}']), tap=tap, capture=FakeCapture())
+
+    sent = _run(middleware, _scope(), [b"ab", b"cd"])
+
+    # Message được forward nguyên vẹn
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body", "http.response.body"]
+    stats = tap.get_stats()
+    assert stats["paths"]["/v1/status"]["requests"] == 1
+    assert stats["paths"]["/v1/status"]["request_bytes"] == 4
+    entry = stats["recent"][0]
+    assert entry["status"] == 200
+    assert entry["response_bytes"] == len(b'{"ok": true}')
+    assert entry["chunks"] == 2
+    assert entry["payload_preview"] == '{"ok": t'
+    assert entry["ttfb_ms"] is not None
+    assert not entry["disconnected"]
+
+
+def test_unsampled_exchange_has_no_preview():
+    tap = HttpTap(sample_rate=0.0)
+    _run(HttpTapMiddleware(_app([b"{}"]), tap=tap, capture=FakeCapture()), _scope())
+
+    assert "payload_preview" not in tap.get_stats()["recent"][0]
+
+
+def test_counts_stream_events():
+    tap = HttpTap()
+    chunks = [b"data: {}\n\n", b"data: {}\n\ndata: [DONE]\n\n"]
+    _run(HttpTapMiddleware(_app(chunks, b"text/event-stream; charset=utf-8"), tap=tap, capture=FakeCapture()),
+         _scope())
+
+    entry = tap.get_stats()["recent"][0]
+    assert entry["streaming"]
+    assert entry["events"] == 3
+    # http.disconnect sau khi stream xong không phải client disconnect
+    assert not entry["disconnected"]
+
+
+def test_cancelled_stream_is_disconnect():
+    tap = HttpTap()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"data: {}\n\n", "more_body": True})
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        _run(HttpTapMiddleware(app, tap=tap, capture=FakeCapture()), _scope())
+
+    assert tap.get_stats()["recent"][0]["disconnected"]
+    assert tap.get_stats()["paths"]["/v1/status"]["disconnects"] == 1
+
+
+def test_failure_before_response_is_server_error():
+    tap = HttpTap()
+
+    async def app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        _run(HttpTapMiddleware(app, tap=tap, capture=FakeCapture()), _scope())
+
+    assert tap.get_stats()["paths"]["/v1/status"]["server_errors"] == 1
+
+
+def test_chat_body_is_captured_once():
+    capture = FakeCapture()
+    middleware = HttpTapMiddleware(_app([b"{}"]), tap=HttpTap(), capture=capture)
+
+    _run(middleware, _scope(CAPTURE_PATH), [b'{"model"', b': "x"}'])
+    _run(middleware, _scope("/v1/status"), [b"{}"])
+    # Content-Length vượt giới hạn → không giữ body
+    _run(middleware, _scope(CAPTURE_PATH, [(b"content-length", b"4096")]), [b"{}"])
+
+    assert capture.submitted == [b'{"model": "x"}']
+
+
+def test_unknown_paths_are_grouped_after_limit():
+    tap = HttpTap(max_paths=2)
+    middleware = HttpTapMiddleware(_app([b"{}"]), tap=tap, capture=FakeCapture())
+
+    for path in ("/a", "/b", "/c", "/d"):
+        _run(middleware, _scope(path))
+
+    assert sorted(tap.get_stats()["paths"]) == ["/a", "/b", OTHER_PATHS]
+    assert tap.get_stats()["paths"][OTHER_PATHS]["requests"] == 2
+
+
+def test_disabled_tap_passes_through():
+    tap = HttpTap(enabled=False)
+    sent = _run(HttpTapMiddleware(_app([b"{}"]), tap=tap, capture=FakeCapture()), _scope())
+
+    assert len(sent) == 2
+    assert tap.get_stats()["paths"] == {}
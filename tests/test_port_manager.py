@@ -0,0 +1,84 @@
+"""
+PortManager: lease tab (atomic, hết hạn), probe của tab half-open
+"""
+import asyncio
+
+import pytest
+
+from core import port_manager as port_manager_module
+from core.port_manager import PortManager
+
+
+@pytest.fixture
+def manager():
+    PortManager._instance = None
+    manager = PortManager()
+    yield manager
+    PortManager._instance = None
+
+
+def _tab(tab_id: int) -> dict:
+    return {"connectionId": "conn", "tabId": tab_id, "status": "free", "canAccept": True}
+
+
+def _connect(manager, tabs: list):
+    """Connection có registry đang nhận push state"""
+    connection = manager.connection_pool.add(object())
+    connection.tab_registry.apply_snapshot(tabs)
+    connection.tab_registry.push_enabled = True
+    return connection
+
+
+def test_concurrent_requests_cannot_lease_same_tab(manager):
+    connection = _connect(manager, [{"tabId": 1, "status": "free", "canAccept": True, "folderPath": None}])
+
+    async def request(request_id: str):
+        tabs, _ = await manager.wait_for_free_tabs(None, is_new_task=True)
+        # Nhường event loop giữa lúc thấy tab rảnh và lúc lease (như routes)
+        await asyncio.sleep(0)
+        return manager.lease_tab(tabs, request_id)
+
+    async def scenario():
+        return await asyncio.gather(request("req-1"), request("req-2"))
+
+    leased = [tab for tab in asyncio.run(scenario()) if tab is not None]
+
+    assert len(leased) == 1
+    assert manager.tab_leases[(connection.connection_id, 1)][0] in ("req-1", "req-2")
+
+
+def test_release_makes_tab_leasable_again(manager):
+    tab = _tab(1)
+
+    assert manager.lease_tab([tab], "req-1") is tab
+    assert manager.lease_tab([tab], "req-2") is None
+
+    # Release của request không giữ lease không có tác dụng
+    manager.release_tab_lease("req-2")
+    assert manager.is_tab_leased(tab)
+
+    manager.release_tab_lease("req-1")
+    assert not manager.is_tab_leased(tab)
+    assert manager.lease_tab([tab], "req-2") is tab
+
+
+def test_expired_lease_releases_probe_slot(manager, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(port_manager_module.time, "time", lambda: now[0])
+    monkeypatch.setattr("core.tab_health.time.time", lambda: now[0])
+
+    tab = _tab(1)
+    key = ("conn", 1)
+    manager.tab_health.failure_threshold = 1
+    quarantine = manager.tab_health.record(key, False, "TAB_ERROR")
+    now[0] += quarantine
+
+    # Probe request bị bỏ quên (không có kết quả, không release)
+    assert manager.lease_tab([tab], "probe") is tab
+    assert not manager.is_tab_available(tab)
+
+    now[0] += port_manager_module.TAB_LEASE_TTL
+    assert not manager.is_tab_leased(tab)
+    assert manager.request_leases == {}
+    assert manager.is_tab_available(tab)
+    assert manager.lease_tab([tab], "next") is tab
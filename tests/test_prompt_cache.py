@@ -0,0 +1,133 @@
+"""
+Prompt cache: system prompt chỉ gửi full text lần đầu mỗi connection, sau đó chỉ gửi hash
+"""
+import asyncio
+import json
+
+import pytest
+
+from core.port_manager import PortManager
+from core.prompt_cache import KnownPrompts, PromptStore, PROMPT_CACHE_CAPABILITY, prompt_hash
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def manager():
+    PortManager._instance = None
+    manager = PortManager()
+    yield manager
+    PortManager._instance = None
+
+
+def _message(system_prompt: str = "You are Cline") -> dict:
+    return {"type": "sendPrompt", "requestId": "req-1", "systemPrompt": system_prompt, "userPrompt": "hi"}
+
+
+def test_prompt_hash_is_stable():
+    assert prompt_hash("abc") == prompt_hash("abc")
+    assert prompt_hash("abc") != prompt_hash("abd")
+    assert len(prompt_hash("")) == 64
+
+
+def test_known_prompts_is_lru():
+    known = KnownPrompts(max_entries=2)
+    known.add("a")
+    known.add("b")
+
+    # Lookup làm "a" mới nhất → "b" bị đẩy ra
+    assert "a" in known
+    known.add("c")
+
+    assert "b" not in known
+    assert "a" in known and "c" in known
+    known.discard("a")
+    known.discard("missing")
+    assert len(known) == 1
+
+
+def test_apply_sends_full_text_once_per_connection():
+    store = PromptStore()
+    known = KnownPrompts()
+    message = _message()
+
+    first = store.apply(message, known)
+    second = store.apply(message, known)
+
+    digest = prompt_hash("You are Cline")
+    assert first["systemPrompt"] == "You are Cline"
+    assert first["systemPromptHash"] == digest
+    assert "systemPrompt" not in second
+    assert second["systemPromptHash"] == digest
+    # Message gốc không bị sửa (hedge/retry dùng lại)
+    assert message == _message()
+
+    # Connection khác chưa có hash → nhận full text
+    assert store.apply(message, KnownPrompts())["systemPrompt"] == "You are Cline"
+    assert store.get_stats() == {
+        "sent_full": 2, "sent_hash": 1, "bytes_saved": len("You are Cline"),
+        "resent": 0, "missing": 0, "entries": 1
+    }
+
+
+def test_apply_without_system_prompt_is_untouched():
+    store = PromptStore()
+    message = {"type": "sendPrompt", "userPrompt": "hi"}
+
+    assert store.apply(message, KnownPrompts()) is message
+    assert store.get_stats()["entries"] == 0
+
+
+def test_store_evicts_least_recently_used():
+    store = PromptStore(max_entries=2)
+    first = store.put("one")
+    second = store.put("two")
+
+    assert store.get(first) == "one"
+    store.put("three")
+
+    assert store.get(second) is None
+    assert store.get(first) == "one"
+
+
+def test_encode_uses_hash_only_for_capable_connection(manager):
+    cached = manager.connection_pool.add(FakeWebSocket(), capabilities=[PROMPT_CACHE_CAPABILITY])
+    legacy = manager.connection_pool.add(FakeWebSocket())
+
+    manager.encode_prompt_message(cached.connection_id, _message())
+    text, _ = manager.encode_prompt_message(cached.connection_id, _message())
+    assert "systemPrompt" not in json.loads(text)
+
+    text, _ = manager.encode_prompt_message(legacy.connection_id, _message())
+    assert json.loads(text) == _message()
+
+
+def test_resend_system_prompt(manager):
+    connection = manager.connection_pool.add(FakeWebSocket(), capabilities=[PROMPT_CACHE_CAPABILITY])
+    digest = manager.prompt_store.put("You are Cline")
+
+    asyncio.run(manager.resend_system_prompt(connection.connection_id, "req-1", digest))
+
+    assert json.loads(connection.websocket.sent[-1]) == {
+        "type": "systemPrompt", "requestId": "req-1", "hash": digest, "systemPrompt": "You are Cline"
+    }
+    assert digest in connection.known_prompts
+    assert manager.prompt_store.stats["resent"] == 1
+
+
+def test_resend_unknown_hash_forgets_it(manager):
+    connection = manager.connection_pool.add(FakeWebSocket(), capabilities=[PROMPT_CACHE_CAPABILITY])
+    connection.known_prompts.add("gone")
+
+    asyncio.run(manager.resend_system_prompt(connection.connection_id, "req-1", "gone"))
+
+    assert connection.websocket.sent == []
+    assert "gone" not in connection.known_prompts
+    assert manager.prompt_store.stats["missing"] == 1
@@ -0,0 +1,108 @@
+"""
+parse_chat_completion_request: lazy view (mặc định) và strict validation, lỗi 400/422
+"""
+import json
+
+import pytest
+
+from models import ChatCompletionRequest, RequestParseError, parse_chat_completion_request
+from models.requests import ChatCompletionRequestView
+
+
+def _body(**data) -> bytes:
+    return json.dumps(data).encode('utf-8')
+
+
+def _fields(error: RequestParseError) -> list:
+    return [tuple(item["loc"]) for item in error.errors]
+
+
+def test_lazy_mode_returns_view_over_raw_messages():
+    messages = [{"role": "user", "content": [{"type": "text", "text": "hi"}], "name": "cline"}]
+    request = parse_chat_completion_request(_body(model="deepseek-chat", messages=messages, stream=True))
+
+    assert isinstance(request, ChatCompletionRequestView)
+    assert request.model == "deepseek-chat"
+    assert request.messages == messages
+    assert request.stream is True
+    assert request.raw["messages"] is request.messages
+
+
+def test_lazy_mode_defaults_stream():
+    request = parse_chat_completion_request(_body(model="m", messages=[], stream=None))
+    assert request.stream is False
+
+
+def test_strict_mode_returns_validated_model():
+    request = parse_chat_completion_request(
+        _body(model="deepseek-chat", messages=[{"role": "user", "content": "hi"}], user="u1"), strict=True
+    )
+
+    assert isinstance(request, ChatCompletionRequest)
+    assert request.messages[0].content == "hi"
+    assert request.temperature == 0.7
+
+
+@pytest.mark.parametrize("strict", [False, True])
+def test_invalid_json_is_400(strict):
+    with pytest.raises(RequestParseError) as error:
+        parse_chat_completion_request(b"{bad", strict=strict)
+
+    assert error.value.status_code == 400
+    assert str(error.value).startswith("Invalid JSON body")
+    assert error.value.errors == []
+
+
+@pytest.mark.parametrize("strict", [False, True])
+def test_non_object_body_is_422(strict):
+    with pytest.raises(RequestParseError) as error:
+        parse_chat_completion_request(b"[]", strict=strict)
+
+    assert error.value.status_code == 422
+
+
+def test_lazy_mode_reports_every_invalid_field():
+    with pytest.raises(RequestParseError) as error:
+        parse_chat_completion_request(_body(model=1, messages="hi", stream="yes"))
+
+    assert error.value.status_code == 422
+    assert _fields(error.value) == [("body", "model"), ("body", "messages"), ("body", "stream")]
+
+
+def test_lazy_mode_does_not_validate_messages():
+    # Chỉ strict mode mới validate từng message
+    request = parse_chat_completion_request(_body(model="m", messages=[{"content": 1}]))
+    assert request.messages == [{"content": 1}]
+
+    with pytest.raises(RequestParseError) as error:
+        parse_chat_completion_request(_body(model="m", messages=[{"content": 1}]), strict=True)
+
+    assert error.value.status_code == 422
+    assert ("messages", 0, "role") in _fields(error.value)
+
+
+def test_strict_mode_reports_missing_fields():
+    with pytest.raises(RequestParseError) as error:
+        parse_chat_completion_request(_body(messages=3), strict=True)
+
+    fields = _fields(error.value)
+    assert ("model",) in fields
+    assert ("messages",) in fields
+    # errors phải serialize được vào error_response
+    json.dumps(error.value.errors, default=str)
+
+
+def test_route_reports_parse_status():
+    from fastapi.testclient import TestClient
+    import main
+
+    headers = {"Authorization": "Bearer THIS_IS_API_KEY"}
+    with TestClient(main.app) as client:
+        # error_response trả lỗi theo format Cline, status nằm trong content
+        response = client.post("/v1/chat/completions", content=b"{bad",
+                               headers={**headers, "content-type": "application/json"})
+        assert "HTTP 400" in response.text
+
+        response = client.post("/v1/chat/completions", json={"messages": 3}, headers=headers)
+        assert "HTTP 422" in response.text
+        assert "messages must be a list" in response.text
@@ -0,0 +1,104 @@
+"""
+ResponseChannel: reorder buffer theo seq, seq bắt đầu, giới hạn buffer
+"""
+import asyncio
+
+import pytest
+
+from core.response_channel import ResponseChannel, EVENT_DELTA, EVENT_FINAL
+
+
+def _drain(channel: ResponseChannel):
+    """Các event đang có trong queue (không chờ)"""
+    events = []
+    while not channel._queue.empty():
+        events.append(channel._queue.get_nowait())
+    return events
+
+
+def _deltas(channel: ResponseChannel):
+    return [payload for event_type, payload in _drain(channel) if event_type == EVENT_DELTA]
+
+
+def test_reorders_by_seq_and_drops_duplicates():
+    channel = ResponseChannel()
+    channel.push_delta("a", 0)
+    channel.push_delta("c", 2)
+    channel.push_delta("b", 1)
+    channel.push_delta("b", 1)
+    channel.push_delta("a", 0)
+
+    assert _deltas(channel) == ["a", "b", "c"]
+
+
+def test_starts_from_first_seq_received():
+    channel = ResponseChannel()
+    channel.push_delta("x", 1)
+    channel.push_delta("z", 3)
+    channel.push_delta("y", 2)
+
+    assert _deltas(channel) == ["x", "y", "z"]
+
+
+def test_first_seq_from_dispatch():
+    channel = ResponseChannel(first_seq=0)
+    channel.push_delta("b", 1)
+    assert _deltas(channel) == []
+
+    channel.push_delta("a", 0)
+    assert _deltas(channel) == ["a", "b"]
+
+
+def test_unnumbered_deltas_pass_through():
+    channel = ResponseChannel()
+    channel.push_delta("a")
+    channel.push_delta("b")
+    assert _deltas(channel) == ["a", "b"]
+
+
+def test_pending_is_bounded_and_flushed_in_order():
+    channel = ResponseChannel(first_seq=0, max_pending=3)
+    for seq in (4, 2, 3, 1):
+        channel.push_delta(str(seq), seq)
+
+    # seq 0 không tới → vượt giới hạn thì flush theo thứ tự, tiếp tục sau seq lớn nhất
+    assert _deltas(channel) == ["1", "2", "3", "4"]
+    assert channel.gaps_skipped == 1
+    assert channel._pending == {}
+
+    channel.push_delta("0", 0)
+    channel.push_delta("5", 5)
+    assert _deltas(channel) == ["5"]
+
+
+def test_final_closes_channel():
+    channel = ResponseChannel()
+    channel.push_delta("b", 1)
+    channel.push_delta("d", 3)
+    channel.push_final({"ok": True})
+    channel.push_delta("e", 4)
+
+    assert _drain(channel) == [(EVENT_DELTA, "b"), (EVENT_FINAL, {"ok": True})]
+
+
+def test_events_until_final():
+    async def scenario():
+        channel = ResponseChannel()
+        channel.push_delta("a", 0)
+        channel.push_delta("b", 1)
+        channel.push_final({"done": True})
+        return [event async for event in channel.events(timeout=1.0)]
+
+    assert asyncio.run(scenario()) == [
+        (EVENT_DELTA, "a"), (EVENT_DELTA, "b"), (EVENT_FINAL, {"done": True})
+    ]
+
+
+def test_events_timeout():
+    async def scenario():
+        channel = ResponseChannel()
+        async for _ in channel.events(timeout=0.01):
+            pass
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(scenario())
@@ -0,0 +1,47 @@
+"""
+RetryPolicy: lỗi retry được, backoff, token bucket
+"""
+from core import retry_policy
+from core.retry_policy import RetryPolicy
+
+
+def test_is_retryable():
+    assert RetryPolicy.is_retryable({"error_type": "TAB_ERROR"})
+    assert RetryPolicy.is_retryable({"error_type": "CONNECTION_LOST"})
+    assert not RetryPolicy.is_retryable({"error_type": "INVALID_REQUEST"})
+    assert not RetryPolicy.is_retryable({})
+    assert not RetryPolicy.is_retryable("TAB_ERROR")
+
+
+def test_backoff_is_exponential_and_capped(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: 1.0)
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+
+    assert [policy.backoff(number) for number in range(5)] == [0.5, 1.0, 2.0, 4.0, 4.0]
+
+
+def test_backoff_jitter_bounds():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+
+    for _ in range(100):
+        assert 0.8 <= policy.backoff(0) <= 1.2
+
+
+def test_token_bucket_limits_and_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry_policy.time, "monotonic", lambda: now[0])
+    policy = RetryPolicy(rate_per_minute=2)
+
+    assert policy.try_acquire()
+    assert policy.try_acquire()
+    assert not policy.try_acquire()
+    assert policy.stats["rate_limited"] == 1
+
+    # 2 retry/phút → 1 token sau 30 giây
+    now[0] += 30
+    assert policy.try_acquire()
+    assert not policy.try_acquire()
+
+    # Refill không vượt capacity
+    now[0] += 600
+    assert policy.get_stats()["available_tokens"] == 2.0
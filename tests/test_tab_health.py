@@ -0,0 +1,114 @@
+"""
+TabHealthTracker: closed → open → half_open (probe) → closed / open lâu hơn
+"""
+from core import tab_health
+from core.tab_health import TabHealthTracker, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+from models import TabStatus
+
+
+TAB = ("conn", 1)
+
+
+def _tracker(monkeypatch, **kwargs):
+    now = [1000.0]
+    monkeypatch.setattr(tab_health.time, "time", lambda: now[0])
+    return TabHealthTracker(**kwargs), now
+
+
+def _state(tracker: TabHealthTracker) -> str:
+    return tracker._tabs[TAB].state
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    tracker, _ = _tracker(monkeypatch, failure_threshold=3, base_quarantine=30.0)
+
+    assert tracker.record(TAB, False, "TAB_ERROR") is None
+    assert tracker.record(TAB, False, "TAB_ERROR") is None
+    assert tracker.allow_request(TAB)
+
+    assert tracker.record(TAB, False, "TIMEOUT") == 30.0
+    assert _state(tracker) == STATE_OPEN
+    assert tracker.status(TAB) == TabStatus.ERROR
+    assert not tracker.allow_request(TAB)
+    assert tracker.get_stats()["tabs"]["conn:1"]["error_counts"] == {"TAB_ERROR": 2, "TIMEOUT": 1}
+
+
+def test_success_resets_failure_count(monkeypatch):
+    tracker, _ = _tracker(monkeypatch, failure_threshold=2)
+
+    tracker.record(TAB, False)
+    tracker.record(TAB, True)
+    assert tracker.record(TAB, False) is None
+    assert _state(tracker) == STATE_CLOSED
+
+
+def test_half_open_allows_single_probe(monkeypatch):
+    tracker, now = _tracker(monkeypatch, failure_threshold=1, base_quarantine=30.0)
+    tracker.record(TAB, False)
+
+    now[0] += 30
+    assert tracker.status(TAB) == TabStatus.FREE
+    assert _state(tracker) == STATE_HALF_OPEN
+    assert tracker.allow_request(TAB)
+
+    assert tracker.on_dispatch(TAB)
+    assert not tracker.allow_request(TAB)
+
+    # Probe bị cancel → probe khác được phép
+    tracker.release_probe(TAB)
+    assert tracker.allow_request(TAB)
+
+
+def test_probe_success_closes(monkeypatch):
+    tracker, now = _tracker(monkeypatch, failure_threshold=1, base_quarantine=30.0)
+    tracker.record(TAB, False)
+    now[0] += 30
+    tracker.on_dispatch(TAB)
+
+    assert tracker.record(TAB, True) is None
+    assert _state(tracker) == STATE_CLOSED
+    assert not tracker.on_dispatch(TAB)
+    # Backoff được reset
+    assert tracker.record(TAB, False) == 30.0
+
+
+def test_probe_failure_reopens_with_backoff(monkeypatch):
+    tracker, now = _tracker(monkeypatch, failure_threshold=3, base_quarantine=30.0, max_quarantine=100.0)
+    for _ in range(3):
+        tracker.record(TAB, False)
+
+    durations = []
+    for _ in range(3):
+        now[0] += 1000
+        tracker.on_dispatch(TAB)
+        # Half-open: 1 lỗi là đủ để quarantine lại
+        durations.append(tracker.record(TAB, False))
+
+    assert durations == [60.0, 100.0, 100.0]
+    assert tracker.quarantine_count == 4
+
+
+def test_unknown_tab_is_free(monkeypatch):
+    tracker, _ = _tracker(monkeypatch)
+
+    assert tracker.status(TAB) == TabStatus.FREE
+    assert tracker.allow_request(TAB)
+    assert not tracker.on_dispatch(TAB)
+    assert tracker.record(TAB, True) is None
+    assert TAB not in tracker._tabs
+
+
+def test_cooling_down_is_not_a_tab_failure(monkeypatch):
+    tracker, now = _tracker(monkeypatch, failure_threshold=1, base_quarantine=30.0)
+
+    assert tracker.record(TAB, False, "COOLING_DOWN") is None
+    assert tracker.allow_request(TAB)
+    assert TAB not in tracker._tabs
+
+    # Probe bị rate limit → vẫn half-open, probe khác được phép
+    tracker.record(TAB, False, "TAB_ERROR")
+    now[0] += 30
+    assert tracker.on_dispatch(TAB)
+    assert tracker.record(TAB, False, "COOLING_DOWN") is None
+    assert _state(tracker) == STATE_HALF_OPEN
+    assert tracker.allow_request(TAB)
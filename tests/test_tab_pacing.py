@@ -0,0 +1,70 @@
+"""
+TabPacing: cooldown sau lỗi COOLING_DOWN, learned_limit theo account
+"""
+from core import tab_pacing
+from core.tab_pacing import TabPacing
+
+
+def _tab(tab_id: int) -> dict:
+    return {"connectionId": "conn", "tabId": tab_id}
+
+
+def _pacing(monkeypatch, **kwargs):
+    now = [1000.0]
+    monkeypatch.setattr(tab_pacing.time, "time", lambda: now[0])
+    return TabPacing(**kwargs), now
+
+
+def test_cooldown_from_error_message(monkeypatch):
+    pacing, now = _pacing(monkeypatch)
+    pacing.record_dispatch("req-1", _tab(1))
+
+    assert pacing.record_result("req-1", "COOLING_DOWN", "please wait 30s") == 30.0
+    assert pacing.ready_in(_tab(1)) == 30.0
+    # Cùng account (connection) → tab khác cũng chờ
+    assert pacing.ready_in(_tab(2)) == 30.0
+
+    now[0] += 30
+    assert pacing.is_ready(_tab(1))
+
+
+def test_single_throttle_does_not_serialise_connection(monkeypatch):
+    pacing, now = _pacing(monkeypatch, window=60.0)
+    pacing.record_dispatch("req-1", _tab(1))
+    pacing.record_result("req-1", "COOLING_DOWN", "wait 5s")
+    now[0] += 5
+
+    # 1 request trong window → không học được giới hạn
+    assert pacing.get_stats()["accounts"]["conn"]["learned_limit"] is None
+    for number in range(4):
+        assert pacing.is_ready(_tab(number))
+        pacing.record_dispatch(f"req-{number + 2}", _tab(number))
+    assert pacing.is_ready(_tab(5))
+
+
+def test_learns_limit_from_busy_window(monkeypatch):
+    pacing, now = _pacing(monkeypatch, window=60.0)
+    for number in range(4):
+        pacing.record_dispatch(f"req-{number}", _tab(number))
+    pacing.record_result("req-3", "COOLING_DOWN", "wait 5s")
+
+    assert pacing.get_stats()["accounts"]["conn"]["learned_limit"] == 3.0
+
+    now[0] += 5
+    for number in range(3):
+        assert pacing.is_ready(_tab(number))
+        pacing.record_dispatch(f"next-{number}", _tab(number))
+    # Đủ 3 request trong window → pace tới khi request cũ nhất ra khỏi window
+    assert pacing.ready_in(_tab(4)) == 60.0
+
+
+def test_success_relaxes_cooldown_and_limit(monkeypatch):
+    pacing, _ = _pacing(monkeypatch, default_cooldown=20.0)
+    for number in range(3):
+        pacing.record_dispatch(f"req-{number}", _tab(number))
+    pacing.record_result("req-2", "COOLING_DOWN")
+    pacing.record_result("req-0")
+
+    account = pacing._accounts["conn"]
+    assert account.learned_limit == 2.5
+    assert account.cooldown == 20.0
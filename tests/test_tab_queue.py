@@ -0,0 +1,104 @@
+"""
+TabWaitQueue: đánh thức theo thứ tự FIFO, giữ vị trí khi kiểm tra tab, giới hạn depth
+"""
+import asyncio
+
+import pytest
+
+from core.tab_queue import TabWaitQueue, QueueFullError, NEW_TASK_KEY
+
+
+def test_notify_wakes_head_first():
+    async def scenario():
+        queue = TabWaitQueue()
+        waiters = [queue.join("/repo") for _ in range(3)]
+
+        assert queue.notify_tab_free({"folderPath": "/repo"})
+        assert [waiter.event.is_set() for waiter in waiters] == [True, False, False]
+
+        # Head đang kiểm tra tab (chưa wait lại) → notify tiếp theo cho waiter kế tiếp
+        assert queue.notify_tab_free({"folderPath": "/repo"})
+        assert [waiter.event.is_set() for waiter in waiters] == [True, True, False]
+
+    asyncio.run(scenario())
+
+
+def test_waiter_keeps_position_until_leave():
+    async def scenario():
+        queue = TabWaitQueue()
+        first = queue.join("/repo")
+        second = queue.join("/repo")
+
+        queue.notify_tab_free({"folderPath": "/repo"})
+        assert await queue.wait(first, timeout=1.0)
+
+        # Không có tab → chờ tiếp, vẫn đứng đầu hàng; request mới phải xếp sau
+        assert queue.is_head(first)
+        assert queue.has_waiters("/repo")
+        assert not await queue.wait(first, timeout=0.01)
+        assert queue.is_head(first)
+
+        # Head rời hàng → waiter kế tiếp được đánh thức ngay
+        queue.leave(first)
+        assert queue.is_head(second)
+        assert await queue.wait(second, timeout=1.0)
+
+        queue.leave(second)
+        assert queue.depth == 0
+        assert not queue.has_waiters("/repo")
+
+    asyncio.run(scenario())
+
+
+def test_admission_order_is_fifo():
+    async def scenario():
+        queue = TabWaitQueue()
+        admitted = []
+
+        async def request(name: str):
+            waiter = queue.join("/repo")
+            try:
+                await queue.wait(waiter, timeout=1.0)
+                admitted.append(name)
+            finally:
+                queue.leave(waiter)
+
+        tasks = [asyncio.create_task(request(name)) for name in "abcd"]
+        await asyncio.sleep(0)
+        for _ in "abcd":
+            queue.notify_tab_free({"folderPath": "/repo"})
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return admitted
+
+    assert asyncio.run(scenario()) == ["a", "b", "c", "d"]
+
+
+def test_notify_falls_back_to_new_task_waiters():
+    async def scenario():
+        queue = TabWaitQueue()
+        new_task = queue.join(NEW_TASK_KEY)
+        other_folder = queue.join("/other")
+
+        assert queue.notify_tab_free({"folderPath": "/repo"})
+        assert new_task.event.is_set()
+        assert not other_folder.event.is_set()
+
+        # Không còn waiter chưa được đánh thức phù hợp
+        assert not queue.notify_tab_free({"folderPath": None})
+
+    asyncio.run(scenario())
+
+
+def test_join_rejects_when_full():
+    async def scenario():
+        queue = TabWaitQueue(max_depth=2)
+        queue.join("/repo")
+        queue.join(NEW_TASK_KEY)
+
+        with pytest.raises(QueueFullError):
+            queue.join("/repo")
+        assert queue.total_rejected == 1
+        assert queue.get_stats()["depth_by_key"] == {"/repo": 1, NEW_TASK_KEY: 1}
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+"""
+TabRegistry: snapshot, delta theo version, index folder / tab rảnh
+"""
+from core.tab_registry import TabRegistry, is_tab_free
+
+
+def _tab(tab_id: int, status: str = "free", folder=None) -> dict:
+    return {"tabId": tab_id, "status": status, "canAccept": status == "free", "folderPath": folder}
+
+
+def _ids(tabs) -> list:
+    return sorted(tab["tabId"] for tab in tabs)
+
+
+def test_is_tab_free():
+    assert is_tab_free(_tab(1))
+    assert not is_tab_free(_tab(1, "busy"))
+    assert not is_tab_free({"tabId": 1, "status": "free", "canAccept": False})
+
+
+def test_snapshot_replaces_state():
+    registry = TabRegistry("conn")
+    assert not registry.is_usable()
+
+    newly_free = registry.apply_snapshot([_tab(1), _tab(2, "busy"), {"tabId": "bad"}], version=5)
+    registry.push_enabled = True
+
+    assert _ids(newly_free) == [1]
+    assert registry.is_usable()
+    assert registry.version == 5
+    assert registry.get_tab(1)["connectionId"] == "conn"
+
+    registry.apply_snapshot([_tab(2)], version=6)
+    assert registry.get_tab(1) is None
+    assert _ids(registry.free_tabs()) == [2]
+
+
+def test_delta_in_order_updates_tabs():
+    registry = TabRegistry()
+    registry.apply_snapshot([_tab(1, "busy"), _tab(2)], version=1)
+
+    newly_free = registry.apply_delta([_tab(1)], removed_tab_ids=[2], version=2)
+
+    assert _ids(newly_free) == [1]
+    assert registry.get_tab(2) is None
+    assert registry.version == 2
+
+
+def test_late_delta_is_ignored():
+    registry = TabRegistry()
+    registry.apply_snapshot([_tab(1)], version=3)
+
+    assert registry.apply_delta([_tab(1, "busy")], version=3) == []
+    assert is_tab_free(registry.get_tab(1))
+    assert not registry.stale
+
+
+def test_version_gap_marks_stale():
+    registry = TabRegistry()
+    registry.push_enabled = True
+    registry.apply_snapshot([_tab(1)], version=1)
+
+    assert registry.apply_delta([_tab(1, "busy")], version=3) is None
+    assert registry.stale
+    assert not registry.is_usable()
+
+    # Resync bằng snapshot
+    registry.apply_snapshot([_tab(1, "busy")], version=3)
+    assert registry.is_usable()
+
+
+def test_folder_index_follows_tab_moves():
+    registry = TabRegistry()
+    registry.apply_snapshot([_tab(1, folder="/a"), _tab(2, folder="/a"), _tab(3, "busy", folder="/a")])
+
+    assert _ids(registry.free_tabs_by_folder("/a")) == [1, 2]
+
+    registry.upsert_tabs([_tab(2, folder="/b")])
+    registry.mark_busy(1)
+
+    assert registry.free_tabs_by_folder("/a") == []
+    assert _ids(registry.free_tabs_by_folder("/b")) == [2]
+    assert registry.free_tabs_by_folder("/missing") == []
+    assert registry.get_stats()["folders"] == 2
+
+
+def test_newly_free_only_on_transition():
+    registry = TabRegistry()
+    registry.apply_snapshot([_tab(1)])
+
+    assert registry.upsert_tabs([_tab(1)]) == []
+    registry.mark_busy(1)
+    assert _ids(registry.upsert_tabs([_tab(1)])) == [1]
@@ -0,0 +1,308 @@
+"""
+tool_parser: output giống regex path cũ (XML, JSON, function_call kể cả input lỗi),
+các điểm khác có chủ đích (object JSON lồng nhau) và input adversarial
+
+Các test *_matches_regex_path so sánh với regex path cũ (giữ nguyên bên dưới làm tham chiếu).
+"""
+import json
+import random
+import re
+import uuid
+from typing import Dict, List, Tuple
+
+from core import tool_parser
+from core.tool_parser import parse_json_tools, parse_xml_tools
+
+
+def _functions(result):
+    text, tool_calls = result
+    return text, [call["function"] for call in tool_calls]
+
+
+def test_xml_tool_call():
+    content = "Đọc file\n<read_file>\n<path>src/app.py</path>\n</read_file>\n\n\n\nxong"
+    text, tools = _functions(parse_xml_tools(content))
+
+    assert tools == [{"name": "read_file", "arguments": json.dumps({"path": "src/app.py"})}]
+    assert text == "Đọc file\n\nxong"
+
+
+def test_xml_tag_without_params_is_text():
+    content = "<thinking>chỉ là suy nghĩ</thinking>"
+    assert _functions(parse_xml_tools(content)) == (content, [])
+
+
+def test_json_tool_calls_in_order():
+    content = (
+        'a {"name": "read_file", "arguments": {"path": "a.py"}} '
+        'b {"function": {"name": "list_files", "arguments": {"path": "."}}} c'
+    )
+    text, tools = _functions(parse_json_tools(content))
+
+    assert tools == [
+        {"name": "read_file", "arguments": '{"path": "a.py"}'},
+        {"name": "list_files", "arguments": '{"path": "."}'},
+    ]
+    assert text == "a  b  c"
+
+
+def test_function_call_keeps_regex_output_with_stray_quotes():
+    # function_call không phải JSON: match tới '}' đầu tiên, không xét string (như regex cũ)
+    cases = {
+        'Reading now " function_call: {name: "read_file", arguments: {"path": "a.py"}} done':
+            ('Reading now " } done', [{"name": "read_file", "arguments": '{"path": "a.py"}'}]),
+        'function_call: {" x {function_call: {name: "f", arguments: {"k": 1}}"':
+            ('}"', [{"name": "f", "arguments": '{"k": 1}'}]),
+        'say "hi function_call: {name: "f", arguments: {"k": "v}"}} bye':
+            ('say "hi "}} bye', [{"name": "f", "arguments": '{"k": "v}'}]),
+    }
+    for content, expected in cases.items():
+        assert _functions(parse_json_tools(content)) == expected
+
+
+def test_json_object_with_nested_arguments():
+    # Khác regex cũ (có chủ đích): arguments lồng nhau / '}' trong string vẫn là tool call
+    nested = '{"name": "write", "arguments": {"a": {"b": 1}}}'
+    assert _functions(parse_json_tools(nested)) == ("", [{"name": "write", "arguments": '{"a": {"b": 1}}'}])
+
+    brace_in_string = 'x {"name": "write", "arguments": {"code": "if (x) { y(); }"}} y'
+    assert _functions(parse_json_tools(brace_in_string)) == (
+        "x  y", [{"name": "write", "arguments": '{"code": "if (x) { y(); }"}'}]
+    )
+
+
+def test_json_escaped_quotes_in_arguments():
+    content = '{"name": "write", "arguments": {"code": "print(\\"}\\")"}}'
+    assert _functions(parse_json_tools(content)) == (
+        "", [{"name": "write", "arguments": json.dumps({"code": 'print("}")'})}]
+    )
+
+
+def test_adversarial_inputs_have_no_tool_calls():
+    cases = [
+        '{"function": {' * 3000,
+        '{"name": ' * 3000 + "@",
+        '{"function": {"name": "f", "arguments": {"a": 1' * 2000,
+        '{"function": ' * 3000 + '{"arguments": 1}' + '}' * 3000,
+        "function_call: {" * 3000,
+    ]
+    for content in cases:
+        assert parse_json_tools(content)[1] == []
+    assert parse_xml_tools("<a>" * 3000)[1] == []
+
+
+def test_objects_deeper_than_limit_are_not_decoded():
+    depth = tool_parser.MAX_TOOL_DEPTH
+    arguments = '{"a": ' * depth + "1" + "}" * depth
+    content = '{"name": "f", "arguments": ' + arguments + "}"
+    assert parse_json_tools(content)[1] == []
+
+    arguments = '{"a": ' * (depth - 2) + "1" + "}" * (depth - 2)
+    content = '{"name": "f", "arguments": ' + arguments + "}"
+    assert len(parse_json_tools(content)[1]) == 1
+
+
+def test_brace_matcher_with_strings_and_escapes():
+    content = '{"a": "}", "b": {"c": "\\"{"}, "d": "à{"} tail {'
+    matcher = tool_parser._BraceMatcher(content)
+
+    assert matcher.match(0)[0] == content.index("} tail")
+    assert matcher.match(content.index('{"c"'))[0] == content.index('}, "d"')
+    assert matcher.match(len(content) - 1)[0] == -1
+
+
+# ---- Regex path cũ (tham chiếu) ----
+
+def _regex_parse_json_tools(content: str) -> Tuple[str, List[Dict]]:
+    """
+    Parse JSON tool calls từ content (Cline format)
+    """
+    if not content or not isinstance(content, str):
+        return content, []
+
+    tool_calls = []
+    remaining_text = content
+
+    patterns = [
+        r'\{\s*"name"\s*:\s*"[^"]*"\s*,\s*"arguments"\s*:\s*\{[^{}]*\}\s*\}',
+        r'{\s*"function"\s*:\s*{[^}]*}\s*}',
+        r'function_call\s*:\s*\{[^}]+\}',
+    ]
+
+    for pattern in patterns:
+        try:
+            matches = list(re.finditer(pattern, content, re.DOTALL))
+
+            for match in matches:
+                try:
+                    tool_data = json.loads(match.group(0))
+
+                    if isinstance(tool_data, dict):
+                        tool_name = None
+                        tool_args = None
+
+                        if "name" in tool_data and "arguments" in tool_data:
+                            tool_name = tool_data["name"]
+                            tool_args = tool_data["arguments"]
+
+                        elif "function" in tool_data and isinstance(tool_data["function"], dict):
+                            if "name" in tool_data["function"] and "arguments" in tool_data["function"]:
+                                tool_name = tool_data["function"]["name"]
+                                tool_args = tool_data["function"]["arguments"]
+
+                        if tool_name and tool_args:
+                            tool_call = {
+                                "id": f"call_{uuid.uuid4().hex[:24]}",
+                                "type": "function",
+                                "function": {
+                                    "name": tool_name,
+                                    "arguments": json.dumps(tool_args) if isinstance(tool_args, dict) else tool_args
+                                }
+                            }
+                            tool_calls.append(tool_call)
+                            remaining_text = remaining_text.replace(match.group(0), "")
+
+                except json.JSONDecodeError:
+                    try:
+                        name_match = re.search(r'name\s*:\s*"([^"]+)"', match.group(0))
+                        args_match = re.search(r'arguments\s*:\s*(\{[^}]+\})', match.group(0))
+
+                        if name_match and args_match:
+                            tool_name = name_match.group(1)
+                            tool_args = args_match.group(1)
+
+                            tool_call = {
+                                "id": f"call_{uuid.uuid4().hex[:24]}",
+                                "type": "function",
+                                "function": {
+                                    "name": tool_name,
+                                    "arguments": tool_args
+                                }
+                            }
+                            tool_calls.append(tool_call)
+                            remaining_text = remaining_text.replace(match.group(0), "")
+                    except Exception:
+                        continue
+                except Exception:
+                    continue
+
+        except Exception:
+            continue
+
+    return remaining_text.strip(), tool_calls
+
+
+def _regex_parse_xml_tools(content: str) -> Tuple[str, List[Dict]]:
+    """
+    Parse XML tool calls từ content và trả về (text_content, tool_calls)
+    """
+    if not content or not isinstance(content, str):
+        return content, []
+
+    tool_pattern = r'<([a-zA-Z_][a-zA-Z0-9_]*)>\s*(.*?)\s*</\1>'
+
+    tool_calls = []
+    positions_to_remove = []
+
+    matches = list(re.finditer(tool_pattern, content, re.DOTALL))
+
+    for match in matches:
+        tool_name = match.group(1)
+        tool_content = match.group(2).strip()
+
+        if not re.search(r'<\w+>', tool_content):
+            continue
+
+        param_pattern = r'<([a-zA-Z_][a-zA-Z0-9_]*)>(.*?)</\1>'
+        params = {}
+        param_matches = list(re.finditer(param_pattern, tool_content, re.DOTALL))
+
+        for param_match in param_matches:
+            param_name = param_match.group(1)
+            param_value = param_match.group(2).strip()
+            params[param_name] = param_value
+
+        if not params:
+            continue
+
+        tool_call = {
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {
+                "name": tool_name,
+                "arguments": json.dumps(params)
+            }
+        }
+
+        tool_calls.append(tool_call)
+        positions_to_remove.append((match.start(), match.end()))
+
+    remaining_text = content
+    for start, end in reversed(positions_to_remove):
+        remaining_text = remaining_text[:start] + remaining_text[end:]
+
+    remaining_text = re.sub(r'\n\s*\n\s*\n', '\n\n', remaining_text.strip())
+
+    return remaining_text, tool_calls
+
+
+_CODE_BLOCK = (
+    "```python\n"
+    "def handler(event: dict) -> dict:\n"
+    "    config = {\"retries\": 3, \"backoff\": {\"base\": 0.5}}\n"
+    "    if event.get(\"type\") == \"<task>\":\n"
+    "        return {\"status\": \"ok\", \"data\": [x for x in range(10) if x < 5]}\n"
+    "    return {}\n"
+    "```\n"
+)
+_XML_TOOL = "<read_file>\n<path>src/app.py</path>\n</read_file>\n"
+_JSON_TOOL = '{"name": "read_file", "arguments": {"path": "src/app.py"}}\n'
+
+
+def _sorted_functions(result):
+    return sorted(map(json.dumps, _functions(result)[1]))
+
+
+def test_xml_matches_regex_path():
+    contents = [
+        ("Phân tích code <thinking>...</thinking>\n" + _CODE_BLOCK) * 20 + _XML_TOOL,
+        "".join(_XML_TOOL.replace("app", f"app{i}") + "text\n" for i in range(200)),
+        "<a>" * 300,
+        "<tool>" + "<param>x" * 300,
+    ]
+    names = ["a", "b", "read_file", "path", "x"]
+    pieces = [f"<{name}>" for name in names] + [f"</{name}>" for name in names] + \
+        ["  ", "\n", "text", "<1>", "<", ">", "\n\n\n"]
+    generator = random.Random(1)
+    for _ in range(3000):
+        contents.append("".join(generator.choice(pieces) for _ in range(generator.randint(0, 30))))
+
+    for content in contents:
+        assert _functions(parse_xml_tools(content)) == _functions(_regex_parse_xml_tools(content)), content
+
+
+def test_json_tool_calls_match_regex_path():
+    # Chỉ so sánh tool calls: text còn lại khác có chủ đích (regex cũ replace mọi chỗ trùng chuỗi)
+    contents = [
+        ("Đây là đoạn code:\n" + _CODE_BLOCK) * 20 + _JSON_TOOL,
+        "".join(_JSON_TOOL.replace("app", f"app{i}") + "text\n" for i in range(200)),
+        '{"function": {' * 300,
+        '{"name": ' * 300 + "@",
+        '{"function": {"name": "f", "arguments": {"a": 1' * 200,
+        'say "hi function_call: {name: "f", arguments: {"k": 1}} ' * 200,
+        "function_call: {" * 300,
+    ]
+    pieces = [
+        '{"name": "read_file", "arguments": {"path": "a"}}',
+        '{"function": {"name": "f", "arguments": {"k": 1}}}',
+        'function_call: {name: "g", arguments: {"k": 2}}',
+        '{"name": "x", "arguments": {}}',
+        "{", "}", '"', " text ", "\\", "\n",
+    ]
+    generator = random.Random(1)
+    for _ in range(3000):
+        contents.append("".join(generator.choice(pieces) for _ in range(generator.randint(0, 12))))
+
+    for content in contents:
+        assert _sorted_functions(parse_json_tools(content)) == \
+            _sorted_functions(_regex_parse_json_tools(content)), content
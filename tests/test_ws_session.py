@@ -0,0 +1,147 @@
+"""
+Session resume: msgSeq, replay buffer/ack, dedupe message ZenTab gửi lại
+"""
+import asyncio
+import json
+import threading
+
+from core.connection_pool import ZenTabConnection
+from core.ws_session import ReplayBuffer, stamp_message
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+def test_stamp_message():
+    assert json.loads(stamp_message('{"type": "ping"}', 7)) == {"msgSeq": 7, "type": "ping"}
+    assert json.loads(stamp_message('{}', 1)) == {"msgSeq": 1}
+    assert stamp_message('not json', 1) == 'not json'
+
+
+def test_replay_after_partial_ack():
+    buffer = ReplayBuffer()
+    for text in ("a", "b", "c"):
+        buffer.append(buffer.next_seq(), text)
+
+    buffer.ack(1)
+    assert len(buffer) == 2
+    # Ack cũ hơn không làm gì
+    buffer.ack(0)
+    assert buffer.acked_seq == 1
+
+    assert buffer.replay_after(2) == ["c"]
+    assert buffer.get_stats()["unacked"] == 1
+
+
+def test_replay_fails_after_overflow():
+    buffer = ReplayBuffer(max_messages=2)
+    for text in ("a", "b", "c"):
+        buffer.append(buffer.next_seq(), text)
+
+    assert buffer.dropped == 1
+    assert buffer.replay_after(0) is None
+    assert buffer.replay_after(1) == ["b", "c"]
+
+
+def test_parked_connection_buffers_and_replays():
+    async def scenario():
+        connection = ZenTabConnection(FakeWebSocket(), session_id="s1")
+        await connection.send_text('{"type": "first"}')
+
+        connection.park()
+        await connection.send_text('{"type": "second"}')
+
+        resumed_socket = FakeWebSocket()
+        connection.attach(resumed_socket)
+        # ZenTab đã nhận message 1 → chỉ replay message 2
+        await connection.replay(connection.messages_to_replay(1))
+        return resumed_socket.sent
+
+    assert [json.loads(text) for text in asyncio.run(scenario())] == [{"msgSeq": 2, "type": "second"}]
+
+
+def test_accept_inbound_dedupes_by_seq():
+    connection = ZenTabConnection(FakeWebSocket(), session_id="s1")
+
+    assert connection.accept_inbound(1)
+    assert connection.accept_inbound(3)
+    assert not connection.accept_inbound(3)
+    assert not connection.accept_inbound(2)
+    # Message không có seq luôn được xử lý
+    assert connection.accept_inbound(None)
+
+
+def _receive(websocket) -> dict:
+    return json.loads(websocket.receive()["text"])
+
+
+def _receive_until(websocket, message_type: str) -> dict:
+    while True:
+        message = _receive(websocket)
+        if message.get("type") == message_type:
+            return message
+
+
+def test_resume_replays_unacked_and_drops_duplicate_inbound():
+    from fastapi.testclient import TestClient
+    import main
+
+    tabs = [{"tabId": 11, "status": "free", "canAccept": True, "folderPath": None}]
+    body = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "<task>resume</task>"}]}
+    headers = {"Authorization": "Bearer THIS_IS_API_KEY"}
+    session = "/ws?sessionId=test-resume"
+
+    with TestClient(main.app) as client:
+        responses = []
+        with client.websocket_connect(session) as websocket:
+            assert _receive_until(websocket, "sessionReady")["resumed"] is False
+            websocket.send_text(json.dumps({"type": "focusedTabsUpdate", "tabs": tabs, "msgSeq": 1}))
+            assert _receive_until(websocket, "ack") == {"type": "ack", "msgSeq": 1}
+
+            request = threading.Thread(
+                target=lambda: responses.append(client.post("/v1/chat/completions", json=body, headers=headers))
+            )
+            request.start()
+            prompt = _receive_until(websocket, "sendPrompt")
+            # Partial ack: ZenTab chỉ xác nhận các message trước sendPrompt rồi mất kết nối
+            acked = prompt["msgSeq"] - 1
+            websocket.send_text(json.dumps({"type": "ack", "msgSeq": acked}))
+
+        with client.websocket_connect(f"{session}&lastSeq={acked}") as websocket:
+            ready = _receive_until(websocket, "sessionReady")
+            assert ready["resumed"] is True
+            assert ready["lastSeq"] == 1
+
+            replayed = _receive_until(websocket, "sendPrompt")
+            assert replayed["msgSeq"] == prompt["msgSeq"]
+            assert replayed["requestId"] == prompt["requestId"]
+
+            # Message cũ gửi lại sau resume (msgSeq đã nhận) bị bỏ qua nhưng vẫn được ack
+            websocket.send_text(json.dumps({"type": "focusedTabsUpdate", "tabs": [], "msgSeq": 1}))
+            assert _receive_until(websocket, "ack") == {"type": "ack", "msgSeq": 1}
+
+            response = {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "resumed"},
+                                     "finish_reason": "stop"}]}
+            websocket.send_text(json.dumps({
+                "type": "promptResponse", "msgSeq": 2, "requestId": replayed["requestId"],
+                "tabId": replayed["tabId"], "success": True, "response": json.dumps(response)
+            }))
+            assert _receive_until(websocket, "ack") == {"type": "ack", "msgSeq": 2}
+
+            request.join(10)
+            assert responses and responses[0].status_code == 200
+            assert "resumed" in responses[0].text
+
+            status = client.get("/v1/status", headers=headers).json()
+            connection = next(item for item in status["connections"]
+                              if item.get("session", {}).get("session_id") == "test-resume")
+            assert connection["session"]["inbound_seq"] == 2
+            assert connection["session"]["resume_count"] == 1
+            # focusedTabsUpdate trùng không xoá tab khỏi registry
+            assert connection["tab_registry"]["total_tabs"] == 1
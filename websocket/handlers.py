@@ -1,10 +1,12 @@
-import json
 import time
 import asyncio
 from websockets.server import WebSocketServerProtocol
 from starlette.websockets import WebSocketDisconnect
 import websockets
 
+from core import json_codec
+from core.ws_session import SEQ_FIELD
+
 async def handle_websocket_connection(websocket: WebSocketServerProtocol, port_manager):
     """
     Handle WebSocket connection với protection cho HEAD requests
@@ -12,7 +14,7 @@ async def handle_websocket_connection(websocket: WebSocketServerProtocol, port_m
     # Check if this is a HEAD request (health check)
     try:
         # WebSocket handshake sẽ fail nếu là HEAD request
-        await port_manager.update_websocket(websocket)
+        connection = await port_manager.register_connection(websocket)
     except Exception as e:
         # Ignore HEAD request errors từ health checks
         if "HEAD" in str(e):
@@ -23,7 +25,7 @@ async def handle_websocket_connection(websocket: WebSocketServerProtocol, port_m
     
     try:
         async def send_ping():
-            while port_manager.websocket == websocket:
+            while port_manager.connection_pool.get(connection.connection_id) is connection:
                 try:
                     await websocket.ping()
                     await asyncio.sleep(30)
@@ -34,9 +36,9 @@ async def handle_websocket_connection(websocket: WebSocketServerProtocol, port_m
         
         async for message in websocket:
             try:
-                data = json.loads(message)
-                await handle_websocket_message(data, port_manager)
-            except json.JSONDecodeError:
+                data = json_codec.loads(message)
+                await handle_websocket_message(data, port_manager, connection.connection_id)
+            except json_codec.DecodeError:
                 pass
             except Exception:
                 pass
@@ -53,12 +55,11 @@ async def handle_websocket_connection(websocket: WebSocketServerProtocol, port_m
             except asyncio.CancelledError:
                 pass
         
-        if port_manager.websocket == websocket:
-            port_manager.websocket = None
+        await port_manager.unregister_connection(connection.connection_id, websocket)
 
-async def handle_websocket_message(data: dict, port_manager):
+async def handle_websocket_message(data: dict, port_manager, connection_id: str = None):
     msg_type = data.get("type")
-    VALIDATE_TIMESTAMP_TYPES = ["getAvailableTabs", "focusedTabsUpdate", "promptResponse"]
+    VALIDATE_TIMESTAMP_TYPES = ["getAvailableTabs", "focusedTabsUpdate", "tabStateDelta", "promptResponse"]
     
     if msg_type in VALIDATE_TIMESTAMP_TYPES:
         message_timestamp = data.get("timestamp", 0)
@@ -93,10 +94,53 @@ async def handle_websocket_message(data: dict, port_manager):
             tabs = []
         
         # Resolve future cho request này
-        port_manager.handle_available_tabs_response(request_id, tabs)
+        port_manager.handle_available_tabs_response(request_id, tabs, data.get("version"))
     
     elif msg_type == "focusedTabsUpdate":
-        return
+        # ZenTab push toàn bộ state tabs (snapshot)
+        tabs = data.get("tabs", data.get("data", []))
+        if not isinstance(tabs, list):
+            return
+        
+        port_manager.handle_tab_state_push(connection_id, tabs, version=data.get("version"), full_snapshot=True)
+    
+    elif msg_type == "tabStateDelta":
+        # ZenTab push chỉ các tabs thay đổi, kèm version để phát hiện mất message
+        tabs = data.get("tabs", [])
+        removed_tab_ids = data.get("removedTabIds", [])
+        if not isinstance(tabs, list):
+            tabs = []
+        if not isinstance(removed_tab_ids, list):
+            removed_tab_ids = []
+        
+        port_manager.handle_tab_state_push(connection_id, tabs, removed_tab_ids, version=data.get("version"))
+        
+    elif msg_type == "unknownSystemPrompt":
+        # 🆕 ZenTab không có system prompt theo hash (cache bị xoá) → gửi lại full text
+        await port_manager.resend_system_prompt(connection_id, data.get("requestId"), data.get("hash"))
+        
+    elif msg_type == "unknownAttachment":
+        # 🆕 ZenTab thiếu binary frame của ảnh (vd: sendPrompt replay sau resume) → gửi lại
+        await port_manager.resend_attachment(connection_id, data.get("requestId"), data.get("attachmentId"))
+        
+    elif msg_type == "promptChunk":
+        # 🆕 Token streaming: ZenTab gửi từng đoạn output kèm seq trước promptResponse cuối
+        request_id = data.get("requestId")
+        delta = data.get("delta", "")
+        seq = data.get("seq")
+        
+        if not request_id or not isinstance(delta, str) or not port_manager.has_pending_response(request_id):
+            return
+        
+        expected_tab_id = port_manager.request_to_tab.get(request_id)
+        if expected_tab_id is not None and data.get("tabId") != expected_tab_id:
+            return
+        
+        expected_connection_id = port_manager.request_to_connection.get(request_id)
+        if expected_connection_id is not None and connection_id is not None and expected_connection_id != connection_id:
+            return
+        
+        port_manager.push_response_delta(request_id, delta, seq if isinstance(seq, int) else None)
         
     elif msg_type == "promptResponse":
         request_id = data.get("requestId")
@@ -110,35 +154,27 @@ async def handle_websocket_message(data: dict, port_manager):
         message_age = time.time() - message_timestamp_seconds if message_timestamp > 0 else 0
         message_key = f"{message_timestamp}_{request_id}"
         
-        in_response_futures = request_id in port_manager.response_futures
+        awaiting_response = port_manager.has_pending_response(request_id)
         in_progress = port_manager.is_request_in_progress(request_id)
         already_processed = port_manager.is_request_processed(request_id)
         message_too_old = message_age > 30.0
         in_request_to_tab = request_id in port_manager.request_to_tab
         expected_tab_id = port_manager.request_to_tab.get(request_id) if in_request_to_tab else None
-        already_forwarded = message_key in port_manager.forwarded_messages
-        
-        future_done = False
-        if in_response_futures:
-            future = port_manager.response_futures.get(request_id)
-            future_done = future.done() if future else False
+        already_forwarded = port_manager.is_message_forwarded(request_id, message_key)
         
         should_process = (
-            in_response_futures and 
+            awaiting_response and 
             not in_progress and 
             not already_processed and 
             not message_too_old and
-            not already_forwarded and
-            not future_done
+            not already_forwarded
         )
         
         if not should_process:
             return
         
         port_manager.mark_request_in_progress(request_id)
-        
-        current_time = time.time()
-        port_manager.forwarded_messages[message_key] = current_time
+        port_manager.mark_message_forwarded(request_id, message_key)
         
         if not request_id or tab_id is None:
             port_manager.mark_request_completed(request_id)
@@ -153,6 +189,17 @@ async def handle_websocket_message(data: dict, port_manager):
             port_manager.mark_request_completed(request_id)
             return
         
+        # Response phải đến từ đúng connection sở hữu tab (tab IDs có thể trùng giữa các browser)
+        expected_connection_id = port_manager.request_to_connection.get(request_id)
+        if expected_connection_id is not None and connection_id is not None and expected_connection_id != connection_id:
+            port_manager.mark_request_completed(request_id)
+            return
+        
+        # Tab đã trả lời → trả lease ngay để request tiếp theo có thể dùng tab
+        port_manager.release_tab_lease(request_id)
+        error_type = None if success else port_manager.classify_error_message(data.get("error") or "")[0]
+        port_manager.record_tab_outcome(request_id, bool(success), error_type, data.get("error"))
+        
         if not success:
             error_msg = data.get("error", "Unknown error")
             port_manager.resolve_response(request_id, {"error": error_msg})
@@ -177,7 +224,7 @@ async def handle_websocket_message(data: dict, port_manager):
                 # 🆕 FIX: Parse JSON ONCE và decode escaped sequences
                 try:
                     # Single parse - ZenTab đã stringify 1 lần
-                    response_data = json.loads(response_text)
+                    response_data = json_codec.loads(response_text)
                     
                     # 🔥 CRITICAL: Decode escaped newlines trong content field
                     if isinstance(response_data, dict) and 'choices' in response_data:
@@ -191,18 +238,18 @@ async def handle_websocket_message(data: dict, port_manager):
                                         decoded_content = raw_content.replace('\\n', '\n').replace('\\r', '\r').replace('\\t', '\t')
                                         choice[key]['content'] = decoded_content
                     
-                except json.JSONDecodeError:
+                except json_codec.DecodeError:
                     # Fallback: nếu parse fail, dùng response_parser
                     from core.response_parser import parse_deepseek_response
                     response_data = parse_deepseek_response(response_text)
             else:
-                response_data = json.loads(str(response_text))
+                response_data = json_codec.loads(str(response_text))
             
-        except (json.JSONDecodeError, TypeError):
+        except (json_codec.DecodeError, TypeError):
             from core.response_parser import parse_deepseek_response
             response_data = parse_deepseek_response(response_text)
         
-        if request_id not in port_manager.response_futures:
+        if not port_manager.has_pending_response(request_id):
             port_manager.mark_request_completed(request_id)
             return
         
@@ -211,19 +258,31 @@ async def handle_websocket_message(data: dict, port_manager):
         port_manager.mark_request_processed(request_id)
         port_manager.mark_request_completed(request_id)
         
-        asyncio.create_task(port_manager.schedule_request_cleanup(request_id, delay=10.0))
+        port_manager.schedule_request_cleanup(request_id, delay=10.0)
 
 async def handle_fastapi_websocket_connection(websocket, port_manager):
     """
     Handle FastAPI WebSocket connection
     Adapter để bridge FastAPI WebSocket với logic hiện tại
     """
+    connection = None
+    ping_task = None
+    
     try:
-        # Update port_manager với websocket mới
-        await port_manager.update_websocket(websocket)
-                
-        # Ping task để keep-alive
-        ping_task = None
+        # 🆕 Session resume: ZenTab gửi sessionId (+ lastSeq đã nhận) qua query string
+        session_id = websocket.query_params.get("sessionId") or None
+        try:
+            last_seq = int(websocket.query_params.get("lastSeq", 0))
+        except ValueError:
+            last_seq = 0
+        
+        # 🆕 Tính năng protocol extension hỗ trợ: ?capabilities=promptCache,...
+        capabilities = {
+            item.strip() for item in websocket.query_params.get("capabilities", "").split(",") if item.strip()
+        }
+        
+        # Thêm websocket mới vào connection pool (hoặc resume session cũ)
+        connection = await port_manager.register_connection(websocket, session_id, last_seq, capabilities)
         
         # 🆕 Track last pong time để detect timeout
         last_pong_time = time.time()
@@ -231,7 +290,7 @@ async def handle_fastapi_websocket_connection(websocket, port_manager):
         
         async def send_ping():
             nonlocal last_pong_time
-            while port_manager.websocket == websocket:
+            while connection.websocket is websocket:
                 try:
                     # FastAPI WebSocket dùng send_json thay vì send
                     await websocket.send_json({"type": "ping", "timestamp": time.time()})
@@ -253,24 +312,40 @@ async def handle_fastapi_websocket_connection(websocket, port_manager):
             
             while True:
                 try:                    
-                    # Receive text message
-                    message = await websocket.receive_text()
+                    # Receive text/binary frame - parse thẳng bytes, không decode sang str trước
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
                     message_count += 1
                     
-                    data = json.loads(message)
+                    payload = message.get("text")
+                    data = json_codec.loads(payload if payload is not None else message.get("bytes") or b"")
                     
                     # 🆕 CRITICAL: Handle pong message trước
                     if data.get("type") == "pong":
                         last_pong_time = time.time()
                         continue
+                    
+                    # 🆕 Session: ZenTab ack message đã nhận → bỏ khỏi replay buffer
+                    if data.get("type") == "ack":
+                        if connection.replay_buffer is not None and isinstance(data.get(SEQ_FIELD), int):
+                            connection.replay_buffer.ack(data[SEQ_FIELD])
+                        continue
+                    
+                    if connection.session_id and SEQ_FIELD in data:
+                        is_new = connection.accept_inbound(data[SEQ_FIELD])
+                        # Luôn ack (kể cả message trùng) để ZenTab ngừng gửi lại
+                        await connection.send_control({"type": "ack", SEQ_FIELD: data[SEQ_FIELD]})
+                        if not is_new:
+                            continue
                                         
-                    await handle_websocket_message(data, port_manager)
+                    await handle_websocket_message(data, port_manager, connection.connection_id)
 
                 except WebSocketDisconnect:
                     # Client manually disconnected - graceful exit
                     break
 
-                except json.JSONDecodeError as e:
+                except json_codec.DecodeError as e:
                     pass
                 except Exception as e:
                     # Check if connection closed - break immediately
@@ -301,5 +376,5 @@ async def handle_fastapi_websocket_connection(websocket, port_manager):
             except asyncio.CancelledError:
                 pass
         
-        if port_manager.websocket == websocket:
-            port_manager.websocket = None
\ No newline at end of file
+        if connection:
+            await port_manager.unregister_connection(connection.connection_id, websocket)
\ No newline at end of file